@@ -0,0 +1,63 @@
+"""
+登录状态缓存：记录探测到的 API 版本与 token / 传统 Session Cookie，进程重启（如 cron --once）时跳过登录探测
+"""
+import json
+import logging
+import os
+import time
+
+from config import Config
+from state_store import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+
+def _key(base_url, account):
+    return f"{base_url}|{account}"
+
+
+def _read(path):
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except Exception as e:
+        logger.warning("读取登录缓存失败: %s", e)
+        return {}
+
+
+def load_auth(base_url, account, path=None):
+    """
+    读取该禅道地址与账号的登录缓存，返回
+    {"api_version": "v2"|"v1"|"legacy", "token": ..., "cookie": [name, value], "obtained_at": ...}，
+    不存在或超过 AUTH_CACHE_MAX_AGE 时返回 None。
+    """
+    path = Config.AUTH_CACHE_FILE if path is None else path
+    entry = _read(path).get(_key(base_url, account))
+    if not isinstance(entry, dict) or entry.get("api_version") not in ("v1", "v2", "legacy"):
+        return None
+    max_age = Config.AUTH_CACHE_MAX_AGE
+    if max_age > 0 and time.time() - float(entry.get("obtained_at") or 0) > max_age:
+        return None
+    return entry
+
+
+def save_auth(base_url, account, api_version, token=None, cookie=None, path=None):
+    """写入登录缓存（文件权限 0600，含 token）。"""
+    path = Config.AUTH_CACHE_FILE if path is None else path
+    if not path:
+        return
+    data = _read(path)
+    data[_key(base_url, account)] = {
+        "api_version": api_version,
+        "token": token,
+        "cookie": list(cookie) if cookie else None,
+        "obtained_at": time.time(),
+    }
+    try:
+        atomic_write_json(path, data)
+        os.chmod(path, 0o600)
+    except Exception as e:
+        logger.warning("写入登录缓存失败: %s", e)
@@ -0,0 +1,3 @@
+"""
+基准测试：本地禅道 / 飞书替身与场景脚本，用法见 benchmarks/run.py
+"""
@@ -0,0 +1,380 @@
+"""
+基准测试用的本地替身：禅道（REST v2 / v1 / 传统 Session）与飞书 Webhook，运行在独立子进程中
+
+数据规模、延迟、错误率、飞书限流均可配置；请求数、字节数、通知延迟等统计通过 /__bench/ 控制接口读取。
+"""
+import gzip
+import hashlib
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+# 初始 Bug 的创建时间（早于任何真实时间，首次运行时只作为基线）；编辑时间从 EDIT_EPOCH 起每次递增 1 秒
+BASE_EPOCH = time.mktime((2020, 1, 1, 0, 0, 0, 0, 0, -1))
+EDIT_EPOCH = time.mktime((2030, 1, 1, 0, 0, 0, 0, 0, -1))
+
+_STATUSES = ("active", "resolved", "closed")
+_CARD_BUG_ID = re.compile(r"(?:Bug #|\[#)(\d+)")
+
+DEFAULTS = {
+    "api": "v1",  # v2 | v1 | legacy
+    "products": 10,
+    "bugs_per_product": 100,
+    "latency_ms": 0,  # 禅道每个请求的固定延迟
+    "jitter_ms": 0,  # 额外的均匀随机延迟
+    "error_rate": 0.0,  # Bug 列表请求返回 500 的概率
+    "feishu_latency_ms": 0,
+    "feishu_rate_per_sec": 0,  # 每个飞书 Webhook 每秒允许的请求数，超出返回 9499（0 不限）
+    "validators": False,  # 禅道响应带 ETag，并对 If-None-Match 命中返回 304
+    "compress": False,  # 请求带 Accept-Encoding: gzip 时压缩禅道响应
+    "ignore_limit": False,  # Bug 列表忽略 limit / recPerPage 与页码，每次返回该产品的全部 Bug
+    "seed": 1,
+}
+
+
+def _fmt(ts):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+
+class _World:
+    """替身的全部状态与统计，在子进程中由各请求线程共享。"""
+
+    def __init__(self, params):
+        self.p = dict(DEFAULTS, **params)
+        self.rand = random.Random(self.p["seed"])
+        self.lock = threading.Lock()
+        self.bugs = {}
+        self.modules = {}
+        for pid in range(1, self.p["products"] + 1):
+            self.modules[pid] = [{"id": pid * 100 + m, "name": f"模块 {pid}-{m}", "children": []} for m in range(1, 6)]
+            self.bugs[pid] = [self._new_bug(pid, i) for i in range(self.p["bugs_per_product"])]
+        self.edit_seq = 0
+        self.edited_at = {}  # bug_id -> 编辑的 time.time()
+        self.reset_stats()
+
+    def _new_bug(self, pid, i):
+        return {
+            "id": pid * 1000000 + i + 1,
+            "title": f"产品 {pid} 的第 {i + 1} 个 Bug：页面操作后出现异常提示",
+            "product": pid,
+            "module": pid * 100 + 1 + i % 5,
+            "severity": 1 + i % 4,
+            "pri": 1 + i % 4,
+            "status": "active",
+            "type": "codeerror",
+            "steps": "<p>[步骤]</p><p>1. 打开页面</p><p>2. 点击按钮</p><p>[结果]</p><p>报错</p>" * 3,
+            "openedBy": {"id": 1, "account": "tester", "realname": "测试"},
+            "assignedTo": {"id": 2, "account": f"dev{i % 20}", "realname": f"开发 {i % 20}"},
+            "openedDate": _fmt(BASE_EPOCH + pid * 86400 + i * 60),
+            "lastEditedDate": "",
+            "lastEditedBy": "",
+        }
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {
+                "zentao_requests": 0,
+                "zentao_bytes_in": 0,
+                "zentao_bytes_out": 0,
+                "zentao_errors": 0,
+                "feishu_requests": 0,
+                "feishu_bytes_in": 0,
+                "feishu_rate_limited": 0,
+                "feishu_cards": 0,
+                "notified_bugs": 0,
+                "latencies": [],
+                "requests_by_kind": {},
+            }
+            self.feishu_window = {}
+
+    def touch(self, count):
+        """随机编辑 count 个 Bug（改状态、指派，推进 lastEditedDate），返回被编辑的 ID。"""
+        ids = []
+        with self.lock:
+            for _ in range(count):
+                pid = self.rand.randint(1, self.p["products"])
+                bug = self.rand.choice(self.bugs[pid])
+                self.edit_seq += 1
+                bug["lastEditedDate"] = _fmt(EDIT_EPOCH + self.edit_seq)
+                bug["status"] = _STATUSES[(_STATUSES.index(bug["status"]) + 1) % len(_STATUSES)]
+                n = self.rand.randint(0, 19)
+                bug["assignedTo"] = {"id": 2, "account": f"dev{n}", "realname": f"开发 {n}"}
+                self.edited_at[str(bug["id"])] = time.time()
+                ids.append(bug["id"])
+        return ids
+
+    def count(self, kind, bytes_in):
+        with self.lock:
+            self.stats["zentao_requests"] += 1
+            self.stats["zentao_bytes_in"] += bytes_in
+            by_kind = self.stats["requests_by_kind"]
+            by_kind[kind] = by_kind.get(kind, 0) + 1
+
+    def sorted_bugs(self, pid, order):
+        bugs = list(self.bugs.get(pid, ()))
+        if order.startswith("lastEditedDate"):
+            bugs.sort(key=lambda b: b["lastEditedDate"], reverse=True)
+        else:
+            bugs.sort(key=lambda b: b["id"], reverse=True)
+        return bugs
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    world = None
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, obj, zentao=True):
+        data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+        headers = {"Content-Type": "application/json; charset=utf-8"}
+        if zentao and status == 200 and self.world.p["validators"]:
+            etag = '"' + hashlib.sha1(data).hexdigest()[:16] + '"'
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                status, data = 304, b""
+        if zentao and data and self.world.p["compress"] and "gzip" in (self.headers.get("Accept-Encoding") or ""):
+            data = gzip.compress(data, 6)
+            headers["Content-Encoding"] = "gzip"
+        headers["Content-Length"] = str(len(data))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+        if zentao:
+            with self.world.lock:
+                self.world.stats["zentao_bytes_out"] += len(data) + 120
+
+    def _delay(self, base_ms, jitter_ms=0):
+        delay = base_ms + (self.world.rand.uniform(0, jitter_ms) if jitter_ms else 0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def do_GET(self):
+        w = self.world
+        u = urlparse(self.path)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        if u.path.startswith("/__bench/"):
+            return self._control(u.path, q)
+        w.count(_kind(u.path, q), len(self.path) + 200)
+        self._delay(w.p["latency_ms"], w.p["jitter_ms"])
+        if u.path == "/index.php":
+            return self._legacy_get(q)
+        parts = u.path.strip("/").split("/")
+        if parts[:1] != ["api.php"] or len(parts) < 3 or parts[1] != w.p["api"]:
+            return self._send(404, {"status": "fail", "message": "not found"})
+        if self.headers.get("Token") != "bench-token":
+            return self._send(401, {"status": "fail", "message": "Unauthorized token"})
+        rest = parts[2:]
+        if rest == ["products"]:
+            return self._send(200, {"status": "success", "products": [
+                {"id": pid, "name": f"产品 {pid}"} for pid in w.bugs]})
+        if rest == ["modules"]:
+            return self._send(200, {"status": "success", "modules": w.modules.get(int(q.get("id", 0)), [])})
+        if rest == ["users"]:
+            users = [{"id": 1, "account": "tester", "realname": "测试"}]
+            users += [{"id": 2 + n, "account": f"dev{n}", "realname": f"开发 {n}"} for n in range(20)]
+            return self._send(200, {"status": "success", "page": 1, "total": len(users), "users": users})
+        if len(rest) == 2 and rest[0] == "bugs":
+            for bugs in w.bugs.values():
+                for bug in bugs:
+                    if str(bug["id"]) == rest[1]:
+                        return self._send(200, bug)
+            return self._send(404, {"status": "fail", "message": "not found"})
+        if len(rest) == 3 and rest[0] == "products" and rest[2] == "bugs":
+            if w.p["error_rate"] and w.rand.random() < w.p["error_rate"]:
+                with w.lock:
+                    w.stats["zentao_errors"] += 1
+                return self._send(500, {"status": "fail", "message": "internal error"})
+            limit = int(q.get("limit", 1000))
+            page = int(q.get("page", 1))
+            bugs = w.sorted_bugs(int(rest[1]), q.get("order", "id_desc"))
+            if w.p["ignore_limit"]:
+                page, limit = 1, len(bugs)
+            return self._send(200, {"status": "success", "page": page, "total": len(bugs), "limit": limit,
+                                    "bugs": bugs[(page - 1) * limit:page * limit]})
+        return self._send(404, {"status": "fail", "message": "not found"})
+
+    def _legacy_get(self, q):
+        w = self.world
+        if q.get("m") == "api" and q.get("f") == "getSessionID":
+            return self._send(200, {"status": "success", "data": {"sessionName": "zentaosid", "sessionID": "bench"}})
+        if w.p["api"] != "legacy":
+            return self._send(404, {"status": "fail"})
+        if q.get("m") == "product" and q.get("f") == "getList":
+            return self._send(200, {"status": "success", "result": {str(pid): f"产品 {pid}" for pid in w.bugs}})
+        if q.get("m") == "bug" and q.get("f") == "getList":
+            if w.p["error_rate"] and w.rand.random() < w.p["error_rate"]:
+                with w.lock:
+                    w.stats["zentao_errors"] += 1
+                return self._send(500, {"status": "fail"})
+            limit = int(q.get("recPerPage", 1000))
+            page = int(q.get("pageID", 1))
+            bugs = w.sorted_bugs(int(q.get("productID", 0)), q.get("orderBy", "id_desc"))
+            if w.p["ignore_limit"]:
+                page, limit = 1, len(bugs)
+            return self._send(200, {"status": "success", "result": {
+                "bugs": bugs[(page - 1) * limit:page * limit], "pager": {"recTotal": len(bugs)},
+                "products": {str(pid): f"产品 {pid}" for pid in w.bugs}}})
+        if q.get("m") == "bug" and q.get("f") == "view":
+            bug_id = q.get("bugID")
+            for bugs in w.bugs.values():
+                for bug in bugs:
+                    if str(bug["id"]) == bug_id:
+                        return self._send(200, {"status": "success", "data": json.dumps({"bug": bug})})
+        return self._send(404, {"status": "fail"})
+
+    def do_POST(self):
+        w = self.world
+        u = urlparse(self.path)
+        body = self._body()
+        if u.path.startswith("/hook/"):
+            return self._feishu(u.path, body)
+        q = {k: v[0] for k, v in parse_qs(u.query).items()}
+        w.count(_kind(u.path, q), len(body) + len(self.path) + 200)
+        self._delay(w.p["latency_ms"], w.p["jitter_ms"])
+        if u.path == "/api.php/v2/users/login" and w.p["api"] == "v2":
+            return self._send(200, {"status": "success", "token": "bench-token"})
+        if u.path == "/api.php/v1/tokens" and w.p["api"] == "v1":
+            return self._send(201, {"token": "bench-token"})
+        if u.path == "/index.php" and q.get("m") == "user" and q.get("f") == "login" and w.p["api"] == "legacy":
+            return self._send(200, {"status": "success"})
+        return self._send(404, {"status": "fail", "message": "not found"})
+
+    def _feishu(self, path, body):
+        w = self.world
+        self._delay(w.p["feishu_latency_ms"])
+        now = time.time()
+        with w.lock:
+            w.stats["feishu_requests"] += 1
+            w.stats["feishu_bytes_in"] += len(body) + len(path) + 200
+            limit = w.p["feishu_rate_per_sec"]
+            if limit:
+                window = [t for t in w.feishu_window.get(path, []) if now - t < 1]
+                if len(window) >= limit:
+                    w.feishu_window[path] = window
+                    w.stats["feishu_rate_limited"] += 1
+                    limited = True
+                else:
+                    window.append(now)
+                    w.feishu_window[path] = window
+                    limited = False
+            else:
+                limited = False
+            if not limited:
+                w.stats["feishu_cards"] += 1
+                for bug_id in set(_CARD_BUG_ID.findall(body.decode("utf-8", "replace"))):
+                    w.stats["notified_bugs"] += 1
+                    edited = w.edited_at.pop(bug_id, None)
+                    if edited is not None:
+                        w.stats["latencies"].append(now - edited)
+        if limited:
+            return self._send(200, {"code": 9499, "msg": "too many request"}, zentao=False)
+        return self._send(200, {"code": 0, "msg": "success"}, zentao=False)
+
+    def _control(self, path, q):
+        w = self.world
+        if path == "/__bench/stats":
+            with w.lock:
+                return self._send(200, w.stats, zentao=False)
+        if path == "/__bench/reset":
+            w.reset_stats()
+            return self._send(200, {}, zentao=False)
+        if path == "/__bench/touch":
+            return self._send(200, {"ids": w.touch(int(q.get("n", 1)))}, zentao=False)
+        return self._send(404, {}, zentao=False)
+
+
+def _kind(path, q):
+    """请求分类（统计用）：login / products / bugs / modules / users / bug / session。"""
+    if path == "/index.php":
+        return {"getSessionID": "session", "login": "login", "view": "bug"}.get(
+            q.get("f"), "products" if q.get("m") == "product" else "bugs")
+    parts = path.strip("/").split("/")[2:]
+    if parts == ["tokens"] or parts == ["users", "login"]:
+        return "login"
+    if len(parts) == 3:
+        return parts[2]
+    if len(parts) == 2:
+        return "bug"
+    return parts[0] if parts else "other"
+
+
+def _serve(params, port_queue):
+    world = _World(params)
+    handler = type("Handler", (_Handler,), {"world": world})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class FakeServers:
+    """
+    在子进程中启动禅道与飞书替身（与被测进程隔离，内存与 CPU 统计不混在一起）：
+        with FakeServers(api="v2", products=20) as fake:
+            fake.zentao_url, fake.feishu_url(), fake.touch(10), fake.stats()
+    """
+
+    def __init__(self, **params):
+        unknown = set(params) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"未知参数: {', '.join(sorted(unknown))}")
+        self.params = dict(DEFAULTS, **params)
+        self._process = None
+        self.port = None
+
+    def start(self):
+        ctx = multiprocessing.get_context("spawn")
+        port_queue = ctx.Queue()
+        self._process = ctx.Process(target=_serve, args=(self.params, port_queue), daemon=True)
+        self._process.start()
+        self.port = port_queue.get(timeout=30)
+        self._control = requests.Session()
+        return self
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join(5)
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def zentao_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def feishu_url(self, name="default"):
+        return f"http://127.0.0.1:{self.port}/hook/{name}"
+
+    def _call(self, path, **params):
+        resp = self._control.get(f"{self.zentao_url}/__bench/{path}", params=params, timeout=30)
+        resp.raise_for_status()
+        return resp.json()
+
+    def touch(self, count):
+        return self._call("touch", n=count)["ids"]
+
+    def stats(self):
+        return self._call("stats")
+
+    def reset_stats(self):
+        self._call("reset")
@@ -0,0 +1,352 @@
+"""
+基准测试：对本地禅道 / 飞书替身运行 run_once，统计耗时、请求数、流量、内存峰值与通知延迟，输出 JSON
+
+    python -m benchmarks.run                          # 全部场景
+    python -m benchmarks.run baseline_v2 large -o new.json
+    python -m benchmarks.run --compare old.json -o new.json   # 与上次结果对比
+
+每个场景先跑一轮首次运行（只建立水位线与快照基线），之后每轮在替身中随机编辑 touch 个 Bug 再执行 run_once。
+webhook 场景首轮之后不轮询，而是把编辑事件 POST 给 --serve 的 WebhookReceiver（并校验未带令牌的请求被拒绝），
+等待飞书替身收到全部卡片。
+cluster 场景每轮由两个副本轮流接手全部产品（水位线、快照、发件箱都在共享的集群库中），换主后推送数应等于编辑数。
+通知延迟为替身中编辑 Bug 到飞书替身收到对应卡片的时间（不含轮询间隔）。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import requests
+
+from benchmarks.fake_servers import FakeServers
+from cluster import Cluster
+from config import Config
+from notifier import new_delivery_worker, run_round
+from webhook_server import WebhookReceiver
+from zentao_client import ZenTaoClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 场景：server 为替身参数（见 fake_servers.DEFAULTS），config 覆盖 Config 属性，
+# rounds 为首轮之后的轮数，touch 为每轮编辑的 Bug 数，webhook 为 True 时首轮之后经 Webhook 接收推送，
+# cluster 为 True 时每轮换一个副本轮询
+SCENARIOS = {
+    "baseline_v1": {"server": {"api": "v1"}, "rounds": 5, "touch": 20},
+    "baseline_v2": {"server": {"api": "v2"}, "rounds": 5, "touch": 20},
+    "baseline_legacy": {"server": {"api": "legacy"}, "rounds": 5, "touch": 20},
+    "large": {
+        "server": {"api": "v2", "products": 50, "bugs_per_product": 2000},
+        "config": {"ZENTAO_FETCH_WORKERS": 8},
+        "rounds": 3,
+        "touch": 200,
+    },
+    "slow_zentao": {
+        "server": {"api": "v2", "products": 20, "latency_ms": 50, "jitter_ms": 100},
+        "config": {"ZENTAO_FETCH_WORKERS": 4},
+        "rounds": 3,
+        "touch": 20,
+    },
+    "flaky_zentao": {
+        "server": {"api": "v2", "products": 20, "error_rate": 0.2},
+        "config": {"ZENTAO_FETCH_WORKERS": 4},
+        "rounds": 5,
+        "touch": 20,
+    },
+    "quiet_products": {
+        "server": {"api": "v2", "products": 50, "bugs_per_product": 500, "validators": True, "compress": True},
+        "config": {"ZENTAO_FETCH_WORKERS": 4},
+        "rounds": 5,
+        "touch": 3,
+    },
+    # 服务端忽略 limit 且不带 ETag：每页都是全量，流式解析的内存峰值不应随 Bug 总数增长（响应缓存不保留超出 limit 的页）
+    "ignored_limit": {
+        "server": {"api": "v2", "products": 5, "bugs_per_product": 5000, "validators": False, "ignore_limit": True},
+        "rounds": 3,
+        "touch": 20,
+    },
+    "webhook_serve": {"server": {"api": "v2"}, "webhook": True, "rounds": 3, "touch": 20},
+    "cluster_handover": {"server": {"api": "v2"}, "cluster": True, "rounds": 3, "touch": 20},
+    "feishu_rate_limited": {
+        "server": {"api": "v2", "feishu_latency_ms": 20, "feishu_rate_per_sec": 5},
+        "config": {"DIGEST_THRESHOLD": 0, "FEISHU_RATE_PER_MIN": 6000, "FEISHU_RATE_BURST": 20},
+        "rounds": 2,
+        "touch": 30,
+    },
+}
+
+# 各场景共用的 Config 覆盖：关闭登录缓存与路由文件，飞书本地限流放宽到不影响测量
+_COMMON_CONFIG = {
+    "ZENTAO_ACCOUNT": "bench",
+    "ZENTAO_PASSWORD": "bench",
+    "ZENTAO_API_KEY": "",
+    "ZENTAO_PRODUCT_IDS": None,
+    "ZENTAO_USE_LEGACY_API": False,
+    "ZENTAO_HEDGE_AFTER": 0,
+    "AUTH_CACHE_FILE": "",
+    "ROUTES_FILE": None,
+    "FEISHU_RATE_PER_MIN": 60000,
+    "FEISHU_RATE_BURST": 1000,
+    "OUTBOX_DRAIN_TIMEOUT": 120,
+}
+
+_ZENTAO_KINDS = ("session", "login", "products", "bugs", "modules", "users", "bug")
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(pct / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def _round_result(index, wall, result, stats, mem_peak):
+    latencies = stats["latencies"]
+    return {
+        "round": index,
+        "wall_s": round(wall, 4),
+        "pushed": result["pushed"],
+        "failed_products": len(result["failed"]),
+        "skipped_products": len(result["skipped"]) + len(result["circuit_open"]),
+        "zentao_requests": stats["zentao_requests"],
+        "zentao_requests_by_kind": {k: stats["requests_by_kind"].get(k, 0) for k in _ZENTAO_KINDS},
+        "zentao_errors": stats["zentao_errors"],
+        "zentao_bytes_sent": stats["zentao_bytes_in"],
+        "zentao_bytes_received": stats["zentao_bytes_out"],
+        "feishu_requests": stats["feishu_requests"],
+        "feishu_rate_limited": stats["feishu_rate_limited"],
+        "feishu_cards": stats["feishu_cards"],
+        "feishu_bytes_sent": stats["feishu_bytes_in"],
+        "notified_bugs": stats["notified_bugs"],
+        "latency_p50_s": _round_opt(_percentile(latencies, 50)),
+        "latency_p95_s": _round_opt(_percentile(latencies, 95)),
+        "latency_max_s": _round_opt(max(latencies) if latencies else None),
+        "peak_traced_bytes": mem_peak,
+    }
+
+
+def _webhook_round(receiver, fake, edited, timeout=60):
+    """把编辑事件 POST 给 WebhookReceiver，等待飞书替身收到全部卡片，返回与 run_round 相同结构的结果。"""
+    url = f"http://127.0.0.1:{receiver.port}{receiver.path}"
+    resp = requests.post(url, json={"objectType": "bug", "objectID": edited[0], "action": "edited"}, timeout=10)
+    if resp.status_code != 403:
+        raise RuntimeError(f"未带令牌的 Webhook 请求应返回 403，实际为 {resp.status_code}")
+    with requests.Session() as session:
+        for bug_id in edited:
+            session.post(url, json={"objectType": "bug", "objectID": bug_id, "action": "edited"},
+                         headers={"X-Token": receiver.token}, timeout=10).raise_for_status()
+    expected = len(set(edited))
+    deadline = time.monotonic() + timeout
+    while fake.stats()["notified_bugs"] < expected and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return {"pushed": fake.stats()["notified_bugs"], "active": set(), "failed": set(), "skipped": set(),
+            "circuit_open": set()}
+
+
+def _cluster_round(index, path, client):
+    """副本 bench-0 / bench-1 轮流接手：上一轮的副本已退出并释放租约，本轮的副本认领全部产品后轮询一轮。"""
+    cluster = Cluster(path, replica_id=f"bench-{index % 2}")
+    cluster.heartbeat()
+    try:
+        product_ids = cluster.sync([p["id"] for p in client.meta.products()])
+        delivery = new_delivery_worker(cluster=cluster)
+        try:
+            return run_round(client=client, delivery=delivery, product_ids=product_ids, store=cluster.state_store())
+        finally:
+            delivery.drain()
+            delivery.stop()
+    finally:
+        cluster.stop()
+
+
+def _round_opt(value):
+    return None if value is None else round(value, 4)
+
+
+def run_scenario(name, spec, trace_memory=True):
+    """运行一个场景，返回 {"name", "params", "rounds": [首轮, 第 1 轮, ...], "summary"}。"""
+    rounds = spec.get("rounds", 3)
+    touch = spec.get("touch", 20)
+    workdir = tempfile.mkdtemp(prefix=f"zentao-bench-{name}-")
+    saved = {}
+    try:
+        with FakeServers(**spec.get("server", {})) as fake:
+            overrides = dict(_COMMON_CONFIG)
+            overrides.update({
+                "ZENTAO_BASE_URL": fake.zentao_url,
+                "FEISHU_WEBHOOK_URL": fake.feishu_url(name),
+                "STATE_FILE": os.path.join(workdir, "state.json"),
+                "SNAPSHOT_DB": os.path.join(workdir, "snapshots.db"),
+                "OUTBOX_DB": os.path.join(workdir, "outbox.db"),
+                "META_CACHE_FILE": os.path.join(workdir, "meta.json"),
+            })
+            overrides.update(spec.get("config", {}))
+            for key, value in overrides.items():
+                saved[key] = getattr(Config, key)
+                setattr(Config, key, value)
+
+            client = ZenTaoClient()
+            delivery = receiver = None
+            if spec.get("webhook"):
+                delivery = new_delivery_worker()
+                receiver = WebhookReceiver(client, delivery, host="127.0.0.1", port=0, token="bench").start()
+            results = []
+            for index in range(rounds + 1):
+                edited = fake.touch(touch) if index else []
+                if trace_memory:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                if receiver is not None and index:
+                    result = _webhook_round(receiver, fake, edited)
+                elif spec.get("cluster"):
+                    result = _cluster_round(index, os.path.join(workdir, "cluster.db"), client)
+                else:
+                    result = run_round(client=client, delivery=delivery)
+                    if delivery is not None:
+                        delivery.drain()
+                wall = time.perf_counter() - start
+                mem_peak = None
+                if trace_memory:
+                    mem_peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                row = _round_result(index, wall, result, fake.stats(), mem_peak)
+                row["edited"] = len(edited)
+                results.append(row)
+                fake.reset_stats()
+                logging.getLogger(__name__).info("%s 第 %s 轮：%.3f 秒，推送 %s", name, index, wall, result["pushed"])
+            if receiver is not None:
+                receiver.stop()
+                delivery.stop()
+    finally:
+        for key, value in saved.items():
+            setattr(Config, key, value)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"name": name, "params": spec, "rounds": results, "summary": _summary(results[1:])}
+
+
+def _summary(rows):
+    """首轮之后各轮的汇总：耗时取中位数，计数取每轮平均，延迟与内存取最大。"""
+    if not rows:
+        return {}
+
+    def median(key):
+        return _percentile([r[key] for r in rows], 50)
+
+    def mean(key):
+        return round(sum(r[key] for r in rows) / len(rows), 2)
+
+    def worst(key):
+        values = [r[key] for r in rows if r[key] is not None]
+        return max(values) if values else None
+
+    return {
+        "wall_s_median": median("wall_s"),
+        "wall_s_max": worst("wall_s"),
+        "zentao_requests_mean": mean("zentao_requests"),
+        "zentao_bytes_received_mean": mean("zentao_bytes_received"),
+        "feishu_requests_mean": mean("feishu_requests"),
+        "feishu_bytes_sent_mean": mean("feishu_bytes_sent"),
+        "pushed_mean": mean("pushed"),
+        "latency_p95_s_max": worst("latency_p95_s"),
+        "peak_traced_bytes_max": worst("peak_traced_bytes"),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# 对比时关注的指标：越小越好
+_COMPARE_KEYS = ("wall_s_median", "zentao_requests_mean", "zentao_bytes_received_mean", "feishu_requests_mean",
+                 "latency_p95_s_max", "peak_traced_bytes_max")
+
+
+def compare(old, new, threshold=0.1):
+    """逐场景对比两份结果的 summary，返回 [(场景, 指标, 旧值, 新值, 变化比例, 是否退化)]。"""
+    old_by_name = {s["name"]: s["summary"] for s in old.get("scenarios", [])}
+    rows = []
+    for scenario in new.get("scenarios", []):
+        before = old_by_name.get(scenario["name"])
+        if not before:
+            continue
+        for key in _COMPARE_KEYS:
+            a, b = before.get(key), scenario["summary"].get(key)
+            if a is None or b is None:
+                continue
+            change = (b - a) / a if a else (0.0 if b == a else float("inf"))
+            rows.append((scenario["name"], key, a, b, change, change > threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="zentao-notify 基准测试（本地禅道 / 飞书替身）")
+    parser.add_argument("scenarios", nargs="*", help=f"要运行的场景（默认全部）：{', '.join(SCENARIOS)}")
+    parser.add_argument("-o", "--output", help="结果 JSON 写入该文件（默认输出到标准输出）")
+    parser.add_argument("--compare", help="与之前的结果 JSON 对比，退化超过 --threshold 时返回码为 1")
+    parser.add_argument("--threshold", type=float, default=0.1, help="判定退化的相对变化（默认 0.1）")
+    parser.add_argument("--rounds", type=int, help="覆盖各场景首轮之后的轮数")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="不统计 Python 内存峰值（tracemalloc 会拖慢运行）")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出程序日志")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.ERROR,
+        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+    )
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+
+    report = {
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "tracemalloc": not args.no_tracemalloc,
+        "scenarios": [],
+    }
+    for name in names:
+        spec = dict(SCENARIOS[name])
+        if args.rounds is not None:
+            spec["rounds"] = args.rounds
+        print(f"运行场景 {name} ...", file=sys.stderr)
+        report["scenarios"].append(run_scenario(name, spec, trace_memory=not args.no_tracemalloc))
+    # ru_maxrss：Linux 为 KB，macOS 为字节
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report["max_rss_bytes"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    status = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            old = json.load(f)
+        for name, key, a, b, change, regressed in compare(old, report, args.threshold):
+            mark = "退化" if regressed else ""
+            print(f"{name:22} {key:28} {a:>14} -> {b:<14} {change:+.1%} {mark}", file=sys.stderr)
+            if regressed:
+                status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""
+Bug 记录：__slots__ 紧凑存储，重复出现的字符串驻留，日期解析为可直接比较的整数
+"""
+import sys
+
+# 对外字段名（与禅道接口、快照、卡片一致） -> 属性名
+FIELDS = (
+    ("id", "id"),
+    ("title", "title"),
+    ("severity", "severity"),
+    ("status", "status"),
+    ("openedBy", "opened_by"),
+    ("assignedTo", "assigned_to"),
+    ("openedDate", "opened"),
+    ("lastEditedDate", "last_edited"),
+    ("product", "product"),
+    ("module", "module"),
+)
+_ATTRS = dict(FIELDS)
+_KEYS = tuple(key for key, _ in FIELDS)
+_DATE_KEYS = ("openedDate", "lastEditedDate")
+
+
+def parse_date(value):
+    """禅道时间字符串 -> 整数 YYYYMMDDhhmmss（可直接比较大小）；空值或 0000-00-00 为 0。"""
+    if not value:
+        return 0
+    if isinstance(value, int):
+        return value
+    s = str(value).strip()
+    if len(s) == 19 and s[4] == "-" and s[13] == ":":
+        try:
+            return int(s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] + s[17:19])
+        except ValueError:
+            pass
+    digits = "".join(c for c in s if c.isdigit())[:14]
+    if not digits.strip("0"):
+        return 0
+    return int(digits.ljust(14, "0"))
+
+
+def format_date(value):
+    """parse_date 的逆运算，0 为空串。"""
+    if not value:
+        return ""
+    s = "%014d" % value
+    return f"{s[0:4]}-{s[4:6]}-{s[6:8]} {s[8:10]}:{s[10:12]}:{s[12:14]}"
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def bug_time(bug):
+    """Bug 的变更时间（整数）：openedDate 与 lastEditedDate 中较大者。也接受同字段的字典。"""
+    if isinstance(bug, Bug):
+        return bug.timestamp
+    return max(parse_date(bug.get("openedDate")), parse_date(bug.get("lastEditedDate")))
+
+
+class Bug:
+    """
+    归一化后的 Bug。日期以整数保存（opened、last_edited），状态、严重程度、人员、产品、模块等取值有限的字符串驻留共享。
+    兼容只读字典接口（get、[]、keys、items、in），按 FIELDS 中的字段名访问，日期字段返回字符串，
+    卡片、路由、快照等按字典使用 Bug 的代码无需区分。
+    """
+
+    __slots__ = ("id", "title", "severity", "status", "opened_by", "assigned_to", "opened", "last_edited",
+                 "product", "module")
+
+    def __init__(self, id, title="", severity="", status="", opened_by="", assigned_to="", opened=0, last_edited=0,
+                 product="", module=""):
+        self.id = id
+        self.title = title
+        self.severity = _intern(severity)
+        self.status = _intern(status)
+        self.opened_by = _intern(opened_by)
+        self.assigned_to = _intern(assigned_to)
+        self.opened = opened
+        self.last_edited = last_edited
+        self.product = _intern(product)
+        self.module = _intern(module)
+
+    @property
+    def timestamp(self):
+        return self.opened if self.opened > self.last_edited else self.last_edited
+
+    def __getitem__(self, key):
+        value = getattr(self, _ATTRS[key])
+        if key in _DATE_KEYS:
+            return format_date(value)
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in _ATTRS
+
+    def __iter__(self):
+        return iter(_KEYS)
+
+    def __len__(self):
+        return len(_KEYS)
+
+    def keys(self):
+        return _KEYS
+
+    def items(self):
+        return [(key, self[key]) for key in _KEYS]
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"Bug(id={self.id!r}, status={self.status!r}, timestamp={self.timestamp})"
@@ -0,0 +1,279 @@
+"""
+流量录制与回放：把禅道、飞书的请求/响应录制到压缩文件（凭据脱敏），离线回放以复现生产环境的性能问题
+"""
+import atexit
+import base64
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+# 名称匹配这些模式的 JSON 字段、表单字段、查询参数（密码、令牌、会话 ID）在录制时替换为 REDACTED；
+# 请求体中的登录账号也替换（响应中 Bug 指派人等对象同样有 account 字段，保留以便回放时渲染）
+_SECRET_KEY = re.compile(r"password|passwd|token|secret|session_?id|sid$|api_?key", re.I)
+_REQUEST_SECRET_KEY = re.compile(_SECRET_KEY.pattern + r"|^account$", re.I)
+REDACTED = "REDACTED"
+# 录制的响应头（其余如 Set-Cookie 不保存；响应体保存的是解压后的内容）
+_KEEP_HEADERS = ("Content-Type", "Retry-After", "ETag", "Last-Modified")
+# 回放时改写到临时目录的运行时数据路径（Config 属性名），环境变量显式配置的除外
+_STATE_SETTINGS = ("STATE_FILE", "SNAPSHOT_DB", "OUTBOX_DB", "COALESCE_DB", "META_CACHE_FILE")
+# 录制文件至少每隔该秒数刷新一次，进程被杀时最多丢失这段时间的记录
+_FLUSH_INTERVAL = 5.0
+
+
+def _redact_json(obj, secret=_SECRET_KEY):
+    if isinstance(obj, dict):
+        return {k: (REDACTED if secret.search(str(k)) and isinstance(v, (str, int)) else _redact_json(v, secret))
+                for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_redact_json(v, secret) for v in obj]
+    return obj
+
+
+def _redact_pairs(pairs, secret=_SECRET_KEY):
+    return [(k, REDACTED if secret.search(k) else v) for k, v in pairs]
+
+
+def _redact_body(body, content_type="", secret=_SECRET_KEY):
+    """请求体或响应体脱敏：JSON 按字段名、表单按字段名；其他内容原样返回。"""
+    if not body:
+        return body
+    text = body.decode("utf-8", "replace") if isinstance(body, bytes) else body
+    stripped = text.lstrip()
+    if stripped[:1] in ("{", "["):
+        try:
+            return json.dumps(_redact_json(json.loads(text), secret), ensure_ascii=False, separators=(",", ":"))
+        except ValueError:
+            return text
+    if "x-www-form-urlencoded" in (content_type or "") or re.fullmatch(r"[\w.%+-]+=[^&]*(&[\w.%+-]+=[^&]*)*", text):
+        return urlencode(_redact_pairs(parse_qsl(text, keep_blank_values=True), secret))
+    return text
+
+
+def _request_key(channel, method, url):
+    """
+    回放匹配键。禅道只取路径与查询（不含主机，录制与回放的 ZENTAO_BASE_URL 可以不同，查询参数中的凭据已脱敏）；
+    飞书 Webhook 的 URL 含机器人密钥且各环境不同，只按请求方法匹配，按录制顺序依次返回。
+    """
+    if channel == "feishu":
+        return method, ""
+    parts = urlsplit(url)
+    query = urlencode(_redact_pairs(parse_qsl(parts.query, keep_blank_values=True)))
+    return method, parts.path + ("?" + query if query else "")
+
+
+class Recorder:
+    """录制到 gzip 压缩的 JSON Lines：首行为文件头，其后每行一个请求/响应。线程安全。"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._flushed = self._start
+        self.count = 0
+        self._write({"version": FORMAT_VERSION, "created_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+        atexit.register(self.close)
+        logger.info("录制禅道 / 飞书流量到 %s", path)
+
+    def _write(self, obj):
+        self._file.write(json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def record(self, channel, request, response, body, elapsed):
+        content_type = response.headers.get("Content-Type", "")
+        entry = {
+            "ch": channel,
+            "t": round(time.monotonic() - self._start - elapsed, 4),
+            "m": request.method,
+            "k": _request_key(channel, request.method, request.url)[1],
+            "rq": _redact_body(request.body, request.headers.get("Content-Type", ""), _REQUEST_SECRET_KEY),
+            "s": response.status_code,
+            "r": response.reason,
+            "h": {k: response.headers[k] for k in _KEEP_HEADERS if k in response.headers},
+            "e": round(elapsed, 4),
+        }
+        if "json" in content_type or "text" in content_type or body[:1] in (b"{", b"["):
+            entry["b"] = _redact_body(body, content_type)
+        else:
+            entry["b64"] = base64.b64encode(body).decode("ascii")
+        with self._lock:
+            if self._file is None:
+                return
+            self._write(entry)
+            self.count += 1
+            now = time.monotonic()
+            if now - self._flushed >= _FLUSH_INTERVAL:
+                self._file.flush()
+                self._flushed = now
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                logger.info("流量录制结束，共 %s 条，已写入 %s", self.count, self.path)
+
+
+class Player:
+    """
+    读取录制文件，按 (通道, 方法, 路径与查询) 匹配请求并按录制顺序返回；同一请求的录制用完后重复返回最后一条，
+    回放轮数可以多于录制轮数。找不到完全匹配时退回同一路径（忽略查询）的最后一条，仍没有则按连接失败处理。
+    time_scale 为响应耗时的倍数：1 为原始耗时，0 为不等待。
+    """
+
+    def __init__(self, path, time_scale=None):
+        self.path = path
+        self.time_scale = float(Config.CASSETTE_TIME_SCALE if time_scale is None else time_scale)
+        self._queues = {}
+        self._last = {}
+        self._by_path = {}
+        self._lock = threading.Lock()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline() or "{}")
+            if header.get("version") != FORMAT_VERSION:
+                raise ValueError(f"不支持的录制文件版本: {header.get('version')}")
+            count = 0
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                key = (entry["ch"], entry["m"], entry["k"])
+                self._queues.setdefault(key, deque()).append(entry)
+                self._by_path[(entry["ch"], entry["m"], entry["k"].split("?", 1)[0])] = entry
+                count += 1
+        logger.info("回放录制文件 %s（%s 条，耗时倍数 %s）", path, count, self.time_scale)
+
+    def lookup(self, channel, method, url):
+        key = (channel,) + _request_key(channel, method, url)
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue:
+                entry = queue.popleft()
+                self._last[key] = entry
+                return entry
+            entry = self._last.get(key)
+            if entry is None:
+                entry = self._by_path.get((channel, method, key[2].split("?", 1)[0]))
+            return entry
+
+    def respond(self, channel, request):
+        entry = self.lookup(channel, request.method, request.url)
+        if entry is None:
+            raise requests.ConnectionError(f"录制文件中没有 {request.method} {request.url}", request=request)
+        if self.time_scale > 0 and entry.get("e"):
+            time.sleep(entry["e"] * self.time_scale)
+        if "b64" in entry:
+            body = base64.b64decode(entry["b64"])
+        else:
+            body = (entry.get("b") or "").encode("utf-8")
+        response = requests.Response()
+        response.status_code = entry["s"]
+        response.reason = entry.get("r") or ""
+        response.headers = CaseInsensitiveDict(entry.get("h") or {})
+        response.headers["Content-Length"] = str(len(body))
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response.url = request.url
+        response.request = request
+        return response
+
+
+class _RecordingAdapter(BaseAdapter):
+    def __init__(self, inner, recorder, channel):
+        super().__init__()
+        self.inner = inner
+        self.recorder = recorder
+        self.channel = channel
+
+    def send(self, request, **kwargs):
+        start = time.monotonic()
+        response = self.inner.send(request, **kwargs)
+        body = response.content  # 读完整个响应（流式响应之后从内存读取）
+        try:
+            self.recorder.record(self.channel, request, response, body, time.monotonic() - start)
+        except Exception as e:
+            logger.warning("录制请求失败: %s", e)
+        return response
+
+    def close(self):
+        self.inner.close()
+
+
+class _ReplayAdapter(BaseAdapter):
+    def __init__(self, player, channel):
+        super().__init__()
+        self.player = player
+        self.channel = channel
+
+    def send(self, request, **kwargs):
+        return self.player.respond(self.channel, request)
+
+    def close(self):
+        pass
+
+
+_active = None
+_active_lock = threading.Lock()
+
+
+def active():
+    """按 CASSETTE_REPLAY / CASSETTE_RECORD 返回进程内共享的 Player / Recorder，都未配置时为 None。"""
+    global _active
+    with _active_lock:
+        if _active is None:
+            if Config.CASSETTE_REPLAY:
+                _active = Player(Config.CASSETTE_REPLAY)
+            elif Config.CASSETTE_RECORD:
+                _active = Recorder(Config.CASSETTE_RECORD)
+        return _active
+
+
+def replaying():
+    """是否处于回放模式。回放时不写登录缓存（录制文件中的 token 已脱敏，不能覆盖线上的登录缓存）。"""
+    return isinstance(active(), Player)
+
+
+def isolate_state():
+    """
+    回放前调用：未通过环境变量显式配置的状态文件、快照库、投递队列、合并窗口暂存与元数据缓存改到新建的临时目录，
+    回放不会推进线上水位线，也不会把卡片写进线上投递队列。返回临时目录。
+    """
+    directory = tempfile.mkdtemp(prefix="zentao-replay-")
+    for name in _STATE_SETTINGS:
+        if os.getenv(name):
+            logger.warning("回放使用显式配置的 %s=%s", name, getattr(Config, name))
+        elif getattr(Config, name):
+            setattr(Config, name, os.path.join(directory, os.path.basename(getattr(Config, name))))
+    logger.info("回放的运行时数据写入临时目录 %s", directory)
+    return directory
+
+
+def install(session, channel):
+    """在录制或回放模式下给 session 挂上对应的传输层（channel 为 "zentao" 或 "feishu"），否则不做任何事。"""
+    cassette = active()
+    if cassette is None:
+        return session
+    for prefix in ("https://", "http://"):
+        if isinstance(cassette, Player):
+            adapter = _ReplayAdapter(cassette, channel)
+        else:
+            adapter = _RecordingAdapter(session.get_adapter(prefix), cassette, channel)
+        session.mount(prefix, adapter)
+    return session
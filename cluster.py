@@ -0,0 +1,243 @@
+"""
+多副本分片：副本通过共享 SQLite 登记心跳，按一致性哈希划分产品，并以租约保证同一产品同一时刻只有一个副本轮询
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from bug import format_date, parse_date
+from config import Config
+from snapshot_store import SnapshotStore
+from state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+# 一致性哈希环上每个副本的虚拟节点数
+_VNODES = 64
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """一致性哈希环：副本增减时只有相邻区间的产品换主。"""
+
+    def __init__(self, members, vnodes=_VNODES):
+        points = sorted((_hash(f"{m}#{i}"), m) for m in members for i in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._members = [m for _, m in points]
+
+    def owner(self, key):
+        if not self._keys:
+            return None
+        i = bisect.bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._members[i]
+
+
+class Cluster:
+    """
+    共享库 CLUSTER_DB 中的表：
+    - members(replica_id, heartbeat)：心跳超过 CLUSTER_LEASE_TTL 未更新的副本视为已下线
+    - leases(product_id, owner, expires)：产品租约，由持有者的心跳线程续期
+    - watermarks / meta：共享的产品水位线（见 SharedStateStore），换主后新副本从原水位线继续
+    - bugs / seeded：共享的 Bug 快照（snapshot_store.SnapshotStore），新主按旧主的快照比对，不重复推送、不重建基线
+    - messages：共享的发件箱（outbox.Outbox），旧主退出后未送达的消息在租约过期后由其他副本认领，
+      相同的待投递消息只保留一条
+    交接：sync() 只在两轮之间调用；旧主先在自己的轮次结束、水位线写入后释放租约，
+    新主只能认领空闲或已过期的租约，因此同一产品不会被两个副本同时轮询。
+    旧主心跳中断、租约过期被接管时，其进行中的轮次在入队前按 holds() 再检查一次，放弃已失去租约的产品的变更。
+    """
+
+    def __init__(self, path=None, replica_id=None, ttl=None):
+        self.path = path or Config.CLUSTER_DB
+        self.replica_id = replica_id or Config.CLUSTER_REPLICA_ID or f"{socket.gethostname()}-{os.getpid()}"
+        self.ttl = float(ttl or Config.CLUSTER_LEASE_TTL)
+        dir_path = os.path.dirname(self.path)
+        if dir_path and not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA busy_timeout=30000")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS members (replica_id TEXT PRIMARY KEY, heartbeat REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS leases ("
+            " product_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS leases_owner ON leases (owner);"
+            "CREATE TABLE IF NOT EXISTS watermarks ("
+            " product_id TEXT PRIMARY KEY, watermark TEXT NOT NULL, ids TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+        )
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _tx(self, fn):
+        """在 BEGIN IMMEDIATE 事务中执行 fn(conn)，跨进程串行化写操作。"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def start(self):
+        self.heartbeat()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._heartbeat_loop, name="cluster-heartbeat", daemon=True)
+        self._thread.start()
+        logger.info("集群模式：副本 %s，租约 %s 秒", self.replica_id, int(self.ttl))
+        return self
+
+    def stop(self):
+        """退出时释放全部租约并注销，其他副本可立即接手。"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+
+        def leave(conn):
+            conn.execute("DELETE FROM leases WHERE owner = ?", (self.replica_id,))
+            conn.execute("DELETE FROM members WHERE replica_id = ?", (self.replica_id,))
+
+        self._tx(leave)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                logger.warning("集群心跳失败: %s", e)
+
+    def heartbeat(self):
+        """登记心跳并为本副本持有的租约续期。"""
+        now = time.time()
+
+        def beat(conn):
+            conn.execute(
+                "INSERT INTO members (replica_id, heartbeat) VALUES (?, ?) "
+                "ON CONFLICT(replica_id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (self.replica_id, now),
+            )
+            conn.execute("UPDATE leases SET expires = ? WHERE owner = ?", (now + self.ttl, self.replica_id))
+            conn.execute("DELETE FROM members WHERE heartbeat < ?", (now - 10 * self.ttl,))
+
+        self._tx(beat)
+
+    def members(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT replica_id FROM members WHERE heartbeat >= ?", (time.time() - self.ttl,)
+            ).fetchall()
+        return sorted(r[0] for r in rows)
+
+    def sync(self, product_ids):
+        """
+        按当前存活副本重新划分产品：释放不再归属本副本的租约，认领归属本副本且空闲/过期的租约。
+        返回本副本当前持有租约的产品（按 product_ids 顺序）。须在两轮轮询之间调用。
+        """
+        members = self.members()
+        if self.replica_id not in members:
+            members.append(self.replica_id)
+        ring = HashRing(members)
+        mine = [str(pid) for pid in product_ids if ring.owner(pid) == self.replica_id]
+        now = time.time()
+
+        def rebalance(conn):
+            held = {r[0] for r in conn.execute("SELECT product_id FROM leases WHERE owner = ?", (self.replica_id,))}
+            release = held - set(mine)
+            conn.executemany(
+                "DELETE FROM leases WHERE product_id = ? AND owner = ?",
+                [(pid, self.replica_id) for pid in release],
+            )
+            conn.executemany(
+                "INSERT INTO leases (product_id, owner, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT(product_id) DO UPDATE SET owner = excluded.owner, expires = excluded.expires "
+                "WHERE leases.owner = excluded.owner OR leases.expires < ?",
+                [(pid, self.replica_id, now + self.ttl, now) for pid in mine],
+            )
+            owned = {r[0] for r in conn.execute("SELECT product_id FROM leases WHERE owner = ?", (self.replica_id,))}
+            return release, owned
+
+        release, owned = self._tx(rebalance)
+        if release:
+            logger.info("集群重新分片：释放 %s 个产品", len(release))
+        waiting = len(mine) - len(owned)
+        if waiting:
+            logger.info("集群重新分片：%s 个产品等待原副本释放租约", waiting)
+        return [pid for pid in map(str, product_ids) if pid in owned]
+
+    def holds(self, product_ids):
+        """本副本当前持有且未过期的租约（product_ids 的子集）。"""
+        ids = [str(pid) for pid in product_ids]
+        if not ids:
+            return set()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT product_id FROM leases WHERE owner = ? AND expires >= ?", (self.replica_id, time.time())
+            ).fetchall()
+        return {r[0] for r in rows} & set(ids)
+
+    def state_store(self):
+        return SharedStateStore(self)
+
+
+class SharedStateStore(StateStore):
+    """
+    存放在集群库中的 StateStore：所有副本共享水位线。
+    save() 只写本轮变化的产品，且仅当本副本仍持有该产品租约时才写入（租约已被接管的旧主不会覆盖新主的水位线）。
+    快照也在集群库中（snapshots()），owned() 按租约判断本副本是否仍负责推送。
+    """
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        super().__init__(path=cluster.path)
+
+    def owned(self, product_ids):
+        return self.cluster.holds(product_ids)
+
+    def snapshots(self, path=None):
+        return SnapshotStore(self.cluster.path, shared=True)
+
+    def load(self):
+        self.created_at = None
+        self._products = {}
+        with self.cluster._lock:
+            conn = self.cluster._conn
+            row = conn.execute("SELECT value FROM meta WHERE key = 'created_at'").fetchone()
+            self.created_at = row[0] if row else None
+            for pid, wm, ids in conn.execute("SELECT product_id, watermark, ids FROM watermarks"):
+                self._products[pid] = (parse_date(wm), set(json.loads(ids)))
+
+    def save(self):
+        if not self._dirty:
+            return
+        rows = [
+            (pid, format_date(self._products[pid][0]), json.dumps(sorted(self._products[pid][1])), pid,
+             self.cluster.replica_id)
+            for pid in self._dirty_pids
+        ]
+
+        def write(conn):
+            if self.created_at is not None:
+                conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('created_at', ?)", (self.created_at,))
+            conn.executemany(
+                "INSERT INTO watermarks (product_id, watermark, ids) "
+                "SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM leases WHERE product_id = ? AND owner = ?) "
+                "ON CONFLICT(product_id) DO UPDATE SET watermark = excluded.watermark, ids = excluded.ids",
+                rows,
+            )
+
+        try:
+            self.cluster._tx(write)
+            self._dirty = False
+            self._dirty_pids.clear()
+        except Exception as e:
+            logger.error("写入集群水位线失败: %s", e)
@@ -0,0 +1,268 @@
+"""
+合并窗口：同一 Bug 短时间内的多次变更合并为一张卡片，静默一段时间后按最终状态推送
+"""
+import heapq
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+from metrics import counter
+from zentao_client import _normalize_bug
+
+logger = logging.getLogger(__name__)
+
+COALESCED = counter("notify_coalesced_total", "合并窗口内并入已有待推送卡片的变更次数")
+
+
+class _Pending:
+    __slots__ = ("bug", "changes", "first_seen", "last_seen", "due")
+
+    def __init__(self, bug, changes, first_seen, last_seen, due):
+        self.bug = bug
+        self.changes = changes  # None 为新 Bug；否则 {字段: [最初旧值, 最新值]}，保持首次出现的顺序
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.due = due
+
+    def change_list(self):
+        if self.changes is None:
+            return None
+        return [(f, old, new) for f, (old, new) in self.changes.items()]
+
+
+class Coalescer:
+    """
+    待推送 Bug 按 ID 暂存：同一 Bug 再次变更时合并（字段保留最初的旧值与最新值，改回原值的字段去掉，
+    全部改回则不再推送），Bug 内容取最新状态。最后一次变更后静默 window 秒、或首次变更后满 max_hold 秒时到期。
+    到期时间放在最小堆里（过时的堆项在弹出时丢弃），暂存数量多时 add / 到期检查仍为对数复杂度。
+    配置 COALESCE_DB 时暂存内容写入 SQLite，重启后恢复；add 返回时已提交，调用方随后可以推进水位线。
+    """
+
+    def __init__(self, window=None, max_hold=None, path=None, clock=time.time):
+        self.window = float(Config.COALESCE_WINDOW if window is None else window)
+        self.max_hold = float(Config.COALESCE_MAX_HOLD if max_hold is None else max_hold)
+        self.path = Config.COALESCE_DB if path is None else path
+        self._clock = clock
+        self._pending = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition(threading.RLock())
+        self._thread = None
+        self._stopping = False
+        self._conn = None
+        if self.path:
+            dir_path = os.path.dirname(self.path)
+            if dir_path and not os.path.isdir(dir_path):
+                os.makedirs(dir_path, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pending ("
+                " id TEXT PRIMARY KEY,"
+                " bug TEXT NOT NULL,"
+                " changes TEXT,"
+                " first_seen REAL NOT NULL,"
+                " last_seen REAL NOT NULL"
+                ") WITHOUT ROWID"
+            )
+            self._conn.commit()
+            self._restore()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _due(self, first_seen, last_seen):
+        return min(last_seen + self.window, first_seen + max(self.window, self.max_hold))
+
+    def _restore(self):
+        rows = self._conn.execute("SELECT id, bug, changes, first_seen, last_seen FROM pending").fetchall()
+        for bid, bug, changes, first_seen, last_seen in rows:
+            changes = None if changes is None else {f: list(v) for f, v in json.loads(changes)}
+            entry = _Pending(_normalize_bug(json.loads(bug)), changes, first_seen, last_seen,
+                             self._due(first_seen, last_seen))
+            self._pending[bid] = entry
+            heapq.heappush(self._heap, (entry.due, next(self._seq), bid))
+        if rows:
+            logger.info("合并窗口恢复 %s 个待推送 Bug", len(rows))
+
+    def add(self, changed):
+        """暂存 snapshots.diff() 的结果 [(bug, changes)]，同一 Bug 与已暂存的变更合并。"""
+        if not changed:
+            return
+        now = self._clock()
+        with self._cond:
+            upserts, deletes = [], []
+            for bug, changes in changed:
+                bid = str(bug.get("id", ""))
+                if not bid:
+                    continue
+                entry = self._pending.get(bid)
+                if entry is None:
+                    entry = _Pending(bug, None, now, now, 0)
+                    if changes is not None:
+                        entry.changes = {f: [old, new] for f, old, new in changes}
+                    self._pending[bid] = entry
+                else:
+                    COALESCED.inc()
+                    entry.bug = bug
+                    entry.last_seen = now
+                    if entry.changes is not None:
+                        if changes is None:
+                            entry.changes = None  # 快照丢失，按新 Bug 推送
+                        else:
+                            for f, old, new in changes:
+                                if f in entry.changes:
+                                    entry.changes[f][1] = new
+                                else:
+                                    entry.changes[f] = [old, new]
+                            entry.changes = {f: v for f, v in entry.changes.items() if v[0] != v[1]}
+                            if not entry.changes:
+                                del self._pending[bid]  # 全部改回原值，不再推送
+                                deletes.append((bid,))
+                                continue
+                due = self._due(entry.first_seen, entry.last_seen)
+                if due != entry.due:
+                    # 到期时间不变（已到 max_hold 上限）时不重复入堆
+                    entry.due = due
+                    heapq.heappush(self._heap, (due, next(self._seq), bid))
+                upserts.append(self._row(bid, entry))
+            self._persist(upserts, deletes)
+            self._cond.notify_all()
+
+    def _row(self, bid, entry):
+        changes = None
+        if entry.changes is not None:
+            changes = json.dumps(list(entry.changes.items()), ensure_ascii=False)
+        return (bid, json.dumps(dict(entry.bug.items()), ensure_ascii=False), changes, entry.first_seen,
+                entry.last_seen)
+
+    def _persist(self, upserts, deletes):
+        if self._conn is None or not (upserts or deletes):
+            return
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO pending (id, bug, changes, first_seen, last_seen) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET bug=excluded.bug, changes=excluded.changes, "
+                    "last_seen=excluded.last_seen",
+                    upserts,
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM pending WHERE id = ?", deletes)
+
+    def seconds_until_due(self):
+        """距最早到期的 Bug 的秒数，无暂存时为 None。"""
+        with self._cond:
+            self._drop_stale()
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - self._clock())
+
+    def _drop_stale(self):
+        while self._heap:
+            due, _, bid = self._heap[0]
+            entry = self._pending.get(bid)
+            if entry is not None and entry.due == due:
+                return
+            heapq.heappop(self._heap)
+
+    def release(self, emit, flush=False):
+        """
+        把到期的 Bug 以 [(bug, changes)] 交给 emit（flush 为 True 时不论是否到期全部交出），返回 emit 的返回值（无到期时为 0）。
+        到期的 Bug 在锁内取出，emit 在锁外调用，推送慢时 add 不被阻塞；emit 期间同一 Bug 的新变更另起一条暂存。
+        库中的记录在 emit 返回后才删除；emit 抛出异常时放回暂存（与期间的新变更合并），下次再试。
+        """
+        with self._cond:
+            now = self._clock()
+            ready = {}
+            while True:
+                self._drop_stale()
+                if not self._heap or (not flush and self._heap[0][0] > now):
+                    break
+                _, _, bid = heapq.heappop(self._heap)
+                ready[bid] = self._pending.pop(bid)
+            if not ready:
+                return 0
+        try:
+            result = emit([(entry.bug, entry.change_list()) for entry in ready.values()])
+        except Exception:
+            with self._cond:
+                self._restore_ready(ready)
+            raise
+        with self._cond:
+            # emit 期间再次变更的 Bug 的记录已被 add 覆盖，不删除
+            self._persist([], [(bid,) for bid in ready if bid not in self._pending])
+        return result
+
+    def _restore_ready(self, ready):
+        """emit 失败时放回取出的 Bug；期间又有新变更的，以取出的为起点合并（保留最初的旧值与首次变更时间）。"""
+        upserts, deletes = [], []
+        for bid, entry in ready.items():
+            newer = self._pending.get(bid)
+            if newer is not None:
+                if entry.changes is None or newer.changes is None:
+                    changes = None
+                else:
+                    changes = dict(entry.changes)
+                    for f, (old, new) in newer.changes.items():
+                        changes[f] = [changes[f][0] if f in changes else old, new]
+                    changes = {f: v for f, v in changes.items() if v[0] != v[1]}
+                    if not changes:
+                        del self._pending[bid]
+                        deletes.append((bid,))
+                        continue
+                entry = _Pending(newer.bug, changes, entry.first_seen, newer.last_seen, 0)
+                upserts.append(self._row(bid, entry))
+            self._pending[bid] = entry
+            entry.due = self._due(entry.first_seen, entry.last_seen)
+            heapq.heappush(self._heap, (entry.due, next(self._seq), bid))
+        self._persist(upserts, deletes)
+        self._cond.notify_all()
+
+    def start(self, emit):
+        """后台线程在到期时调用 release(emit)。"""
+        if self._thread is not None:
+            return self
+        self._stopping = False
+
+        def run():
+            while True:
+                with self._cond:
+                    while not self._stopping:
+                        wait = self.seconds_until_due()
+                        if wait is not None and wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    if self._stopping:
+                        return
+                try:
+                    self.release(emit)
+                except Exception as e:
+                    logger.error("合并窗口推送异常: %s", e, exc_info=True)
+                    with self._cond:
+                        self._cond.wait(5)
+
+        self._thread = threading.Thread(target=run, name="coalescer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        if self._conn is not None:
+            with self._cond:
+                self._conn.close()
+                self._conn = None
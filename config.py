@@ -22,8 +22,105 @@ class Config:
     ZENTAO_API_KEY = os.getenv("ZENTAO_API_KEY", "")
     ZENTAO_PRODUCT_IDS = os.getenv("ZENTAO_PRODUCT_IDS", "").strip() or None
     ZENTAO_USE_LEGACY_API = os.getenv("ZENTAO_USE_LEGACY_API", "").strip().lower() in ("1", "true", "yes")
+    # 多个禅道实例的配置文件（JSON，见 sources.load_sources）；配置后忽略上面的单实例设置
+    ZENTAO_SOURCES_FILE = os.getenv("ZENTAO_SOURCES_FILE", "").strip() or None
+    # 并发拉取产品 Bug 的线程数（1 为逐个产品串行拉取）
+    ZENTAO_FETCH_WORKERS = int(os.getenv("ZENTAO_FETCH_WORKERS", "1"))
+    # Bug 列表分页大小（REST limit / 传统 API recPerPage）
+    ZENTAO_PAGE_SIZE = int(os.getenv("ZENTAO_PAGE_SIZE", "100"))
+    # --async 模式：对禅道的并发请求上限
+    ZENTAO_ASYNC_CONCURRENCY = int(os.getenv("ZENTAO_ASYNC_CONCURRENCY", "8"))
+    # 单次请求超时秒数；每轮拉取 Bug 的总预算秒数，按产品分配（默认 0 不限制，超出预算的产品本轮跳过、下一轮优先拉取）
+    ZENTAO_TIMEOUT = float(os.getenv("ZENTAO_TIMEOUT", "15"))
+    ZENTAO_ROUND_DEADLINE = float(os.getenv("ZENTAO_ROUND_DEADLINE", "0"))
+    # 熔断：连续失败次数阈值、首次冷却秒数（再次失败翻倍）、冷却上限
+    ZENTAO_BREAKER_THRESHOLD = int(os.getenv("ZENTAO_BREAKER_THRESHOLD", "3"))
+    ZENTAO_BREAKER_COOLDOWN = float(os.getenv("ZENTAO_BREAKER_COOLDOWN", "300"))
+    ZENTAO_BREAKER_MAX_COOLDOWN = float(os.getenv("ZENTAO_BREAKER_MAX_COOLDOWN", "3600"))
+    # 对冲请求：列表页超过该秒数未响应时再发一次相同请求，取先返回者（0 关闭）
+    ZENTAO_HEDGE_AFTER = float(os.getenv("ZENTAO_HEDGE_AFTER", "0"))
+    # 产品列表、Bug 列表页的条件请求缓存条目数（ETag / Last-Modified，服务端不支持时按响应体哈希），0 关闭
+    ZENTAO_RESPONSE_CACHE = int(os.getenv("ZENTAO_RESPONSE_CACHE", "1024"))
 
     FEISHU_WEBHOOK_URL = os.getenv("FEISHU_WEBHOOK_URL", "").strip() or None
+    # 推送路由规则文件（JSON，见 router.Router）；未配置时全部发往 FEISHU_WEBHOOK_URL
+    ROUTES_FILE = os.getenv("ROUTES_FILE", "").strip() or None
+    # 每个 Webhook 的限流（飞书自定义机器人 100 次/分钟、5 次/秒）与投递重试
+    FEISHU_RATE_PER_MIN = float(os.getenv("FEISHU_RATE_PER_MIN", "100"))
+    FEISHU_RATE_BURST = float(os.getenv("FEISHU_RATE_BURST", "5"))
+    FEISHU_MAX_RETRIES = int(os.getenv("FEISHU_MAX_RETRIES", "5"))
+    FEISHU_DELIVERY_WORKERS = int(os.getenv("FEISHU_DELIVERY_WORKERS", "2"))
+    # --async 模式：每个 Webhook 的并发请求上限
+    FEISHU_ASYNC_CONCURRENCY = int(os.getenv("FEISHU_ASYNC_CONCURRENCY", "2"))
+    # 一轮变更数达到 DIGEST_THRESHOLD 时改发汇总卡片（0 为不汇总），按 product / severity 分组
+    DIGEST_THRESHOLD = int(os.getenv("DIGEST_THRESHOLD", "10"))
+    DIGEST_GROUP_BY = os.getenv("DIGEST_GROUP_BY", "product").strip().lower()
+    # 单张卡片 JSON 上限（飞书为 30KB，留出余量）
+    FEISHU_CARD_MAX_BYTES = int(os.getenv("FEISHU_CARD_MAX_BYTES", "28000"))
 
     POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "300"))
+    # 常驻模式自适应调度：每个产品的轮询间隔在 [SCHED_MIN_INTERVAL, SCHED_MAX_INTERVAL] 内按活跃度调整，
+    # 无变更时乘以 SCHED_BACKOFF；SCHED_ROUND_BUDGET 为每轮最多拉取的产品数
+    SCHED_MIN_INTERVAL = int(os.getenv("SCHED_MIN_INTERVAL") or max(60, POLL_INTERVAL))
+    SCHED_MAX_INTERVAL = int(os.getenv("SCHED_MAX_INTERVAL", "1800"))
+    SCHED_BACKOFF = float(os.getenv("SCHED_BACKOFF", "2"))
+    SCHED_ROUND_BUDGET = int(os.getenv("SCHED_ROUND_BUDGET", "50"))
+    # 多副本分片：CLUSTER_DB 为各副本共享的 SQLite 文件（共享存储），配置后常驻模式按一致性哈希分摊产品，
+    # 水位线、Bug 快照与发件箱都存放在该库中（OUTBOX_DB=off 时仍不启用发件箱）
+    CLUSTER_DB = os.getenv("CLUSTER_DB", "").strip() or None
+    CLUSTER_REPLICA_ID = os.getenv("CLUSTER_REPLICA_ID", "").strip() or None
+    CLUSTER_LEASE_TTL = int(os.getenv("CLUSTER_LEASE_TTL", "60"))
+    # --serve 模式：接收禅道 Webhook 的地址；RECONCILE_INTERVAL 为兜底轮询间隔（秒）
+    # 监听非本机地址时必须配置 WEBHOOK_TOKEN（请求头 X-Token 或查询参数 token），否则拒绝启动
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/zentao/webhook")
+    WEBHOOK_TOKEN = os.getenv("WEBHOOK_TOKEN", "").strip() or None
+    RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", "1800"))
+    # 常驻模式（含 --serve）的 Prometheus 指标端口，GET /metrics；0 为不开启
+    METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
     STATE_FILE = os.getenv("STATE_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "state.json"))
+    # 性能剖析（--profile 或 PROFILE_EVERY > 0 时开启）：每 PROFILE_EVERY 轮采样一轮，结果写入 PROFILE_DIR，
+    # 只保留最近 PROFILE_KEEP 轮；PROFILE_SAMPLE_INTERVAL 为调用栈采样间隔秒数
+    PROFILE_EVERY = int(os.getenv("PROFILE_EVERY", "0"))
+    PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(os.path.dirname(os.path.abspath(STATE_FILE)), "profiles")
+    PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+    PROFILE_TOP = int(os.getenv("PROFILE_TOP", "20"))
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+
+    # 流量录制 / 回放（--record / --replay）：CASSETTE_RECORD 为录制文件路径（gzip 压缩，凭据脱敏），
+    # CASSETTE_REPLAY 为回放文件路径（不访问禅道与飞书），CASSETTE_TIME_SCALE 为回放时响应耗时的倍数（0 为不等待）
+    CASSETTE_RECORD = os.getenv("CASSETTE_RECORD", "")
+    CASSETTE_REPLAY = os.getenv("CASSETTE_REPLAY", "")
+    CASSETTE_TIME_SCALE = float(os.getenv("CASSETTE_TIME_SCALE", "1"))
+    # 登录缓存（API 版本 + token/Cookie），默认与状态文件同目录；AUTH_CACHE_FILE 设为 off 时不缓存
+    AUTH_CACHE_FILE = os.getenv("AUTH_CACHE_FILE") or os.path.join(os.path.dirname(os.path.abspath(STATE_FILE)), "auth.json")
+    if AUTH_CACHE_FILE.lower() in ("off", "none", "0"):
+        AUTH_CACHE_FILE = ""
+    AUTH_CACHE_MAX_AGE = int(os.getenv("AUTH_CACHE_MAX_AGE", "86400"))
+    # Bug 快照库（默认与状态文件同目录）；NOTIFY_FIELDS 为触发推送的字段，逗号分隔，留空表示任意内容变化
+    SNAPSHOT_DB = os.getenv("SNAPSHOT_DB") or os.path.join(os.path.dirname(os.path.abspath(STATE_FILE)), "snapshots.db")
+    NOTIFY_FIELDS = os.getenv("NOTIFY_FIELDS", "status,severity,assignedTo")
+    # 产品/模块/用户名称缓存（默认与状态文件同目录，设为 off 时只缓存在内存），过期后后台刷新
+    META_CACHE_FILE = os.getenv("META_CACHE_FILE") or os.path.join(os.path.dirname(os.path.abspath(STATE_FILE)), "meta.json")
+    if META_CACHE_FILE.lower() in ("off", "none", "0"):
+        META_CACHE_FILE = ""
+    META_CACHE_TTL = int(os.getenv("META_CACHE_TTL", "3600"))
+    META_CACHE_SIZE = int(os.getenv("META_CACHE_SIZE", "1000"))
+    # 飞书发件箱（默认与状态文件同目录，设为 off 时不持久化）；超过 OUTBOX_MAX_AGE 秒仍未送达的消息丢弃
+    OUTBOX_DB = os.getenv("OUTBOX_DB") or os.path.join(os.path.dirname(os.path.abspath(STATE_FILE)), "outbox.db")
+    if OUTBOX_DB.lower() in ("off", "none", "0"):
+        OUTBOX_DB = ""
+    OUTBOX_MAX_AGE = int(os.getenv("OUTBOX_MAX_AGE", "86400"))
+    # 进程持有发件箱消息的租约秒数（投递期间续租）；进程异常退出后其他进程最迟在该时间后接手未送达的消息
+    OUTBOX_LEASE = int(os.getenv("OUTBOX_LEASE", "300"))
+    # 单次运行（--once）等待发件箱投递的最长秒数，未送达的留待下次运行
+    OUTBOX_DRAIN_TIMEOUT = int(os.getenv("OUTBOX_DRAIN_TIMEOUT", "60"))
+    # 合并窗口：同一 Bug 最后一次变更后静默 COALESCE_WINDOW 秒再推送一张最终状态的卡片（0 关闭），
+    # 持续被编辑的 Bug 最迟在首次变更 COALESCE_MAX_HOLD 秒后推送；暂存内容存于 COALESCE_DB（设为 off 时只在内存）
+    COALESCE_WINDOW = int(os.getenv("COALESCE_WINDOW", "0"))
+    COALESCE_MAX_HOLD = int(os.getenv("COALESCE_MAX_HOLD", "900"))
+    COALESCE_DB = os.getenv("COALESCE_DB") or os.path.join(os.path.dirname(os.path.abspath(STATE_FILE)), "coalesce.db")
+    if COALESCE_DB.lower() in ("off", "none", "0"):
+        COALESCE_DB = ""
@@ -0,0 +1,271 @@
+"""
+飞书投递线程：按 Webhook 令牌桶限流，失败按指数退避（带抖动）重试，不阻塞轮询；
+配置发件箱时消息先持久化，重启后继续投递
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from config import Config
+from feishu_notifier import FeishuNotifier, _bug_card, _digest_cards
+from metrics import FEISHU_RETRIES, webhook_label
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """第 attempt 次重试的等待秒数：指数增长，取上限后在后半段随机抖动。"""
+    d = min(cap, base * (2 ** attempt))
+    return d / 2 + random.uniform(0, d / 2)
+
+
+class _Job:
+    __slots__ = ("url", "payload", "attempt", "on_done", "bug_count", "msg_id", "created_at")
+
+    def __init__(self, url, payload, on_done=None, bug_count=0):
+        self.url = url
+        self.payload = payload
+        self.attempt = 0
+        self.on_done = on_done
+        self.bug_count = bug_count
+        self.msg_id = None  # 发件箱中的消息 ID
+        self.created_at = time.time()
+
+
+class DeliveryWorker:
+    """
+    后台投递：submit 只入队立即返回，由工作线程发送。
+    待发任务按到期时间放在堆里；某个 Webhook 令牌不足或正在退避时，任务按需要的等待时间重新入堆，
+    不占用工作线程，其他 Webhook 的任务照常发送。
+    传入 outbox 时消息先写入发件箱再入堆，可重试的失败一直重试到 OUTBOX_MAX_AGE，
+    未投递完的消息在下次 start() 时从发件箱认领恢复（其他进程仍持有的不认领），stop() 时交还。
+    """
+
+    def __init__(self, notifier=None, workers=None, max_retries=None, outbox=None):
+        self.notifier = notifier or FeishuNotifier()
+        self.workers = max(1, int(workers or Config.FEISHU_DELIVERY_WORKERS))
+        self.max_retries = Config.FEISHU_MAX_RETRIES if max_retries is None else max_retries
+        self.outbox = outbox
+        self.delivered = 0  # 成功投递的消息数
+        self.failed = 0
+        self.delivered_bugs = 0  # 成功推送的 Bug 数（一张汇总卡片计多条）
+        self._heap = []
+        self._seq = itertools.count()
+        self._inflight = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._threads = []
+        self._local = threading.local()
+        self._renewed = time.monotonic()
+
+    def start(self):
+        if self._threads:
+            return self
+        self._stopping = False
+        if self.outbox is not None:
+            self._restore()
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"feishu-delivery-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+        if self.outbox is not None:
+            self.outbox.release()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap) + self._inflight
+
+    def submit(self, payload, webhook_url=None, on_done=None, bug_count=0):
+        """入队一条消息。on_done(ok) 在最终成功或放弃时回调；bug_count 为该消息包含的 Bug 数。"""
+        url = (webhook_url or self.notifier.webhook_url or "").strip() or None
+        if not url:
+            logger.warning("未配置飞书 Webhook URL，跳过通知")
+            return False
+        job = _Job(url, payload, on_done, bug_count)
+        if self.outbox is None:
+            self._push(time.monotonic(), job)
+            return True
+        job.msg_id = self.outbox.add(url, payload, bug_count)
+        if job.msg_id is None:
+            return True  # 相同的消息已在发件箱中，由持有它的进程投递
+        batch = getattr(self._local, "jobs", None)
+        if batch is None:
+            self._push(time.monotonic(), job)
+        else:
+            batch.append(job)
+        return True
+
+    @contextmanager
+    def batch(self):
+        """
+        块内 submit 的消息在同一个发件箱事务中写入，退出时一次提交后才开始投递；
+        退出即表示这批消息已持久化，调用方可以推进水位线。未配置发件箱时无额外作用。
+        """
+        if self.outbox is None or getattr(self._local, "jobs", None) is not None:
+            yield self
+            return
+        self._local.jobs = []
+        try:
+            with self.outbox.transaction():
+                yield self
+            jobs = self._local.jobs
+        finally:
+            self._local.jobs = None
+        now = time.monotonic()
+        for job in jobs:
+            self._push(now, job)
+
+    def submit_card(self, card, webhook_url=None, on_done=None, bug_count=0):
+        return self.submit({"msg_type": "interactive", "card": card}, webhook_url, on_done, bug_count)
+
+    def submit_bug_card(self, bug, bug_url, webhook_url=None, changes=None, on_done=None, names=None):
+        return self.submit_card(_bug_card(bug, bug_url, changes=changes, names=names), webhook_url, on_done, 1)
+
+    def submit_digest(self, items, webhook_url=None, group_by=None, names=None):
+        """items 为 [(bug, bug_url, changes)]，打包成汇总卡片入队，返回卡片张数。"""
+        cards = _digest_cards(items, group_by=group_by or Config.DIGEST_GROUP_BY, names=names)
+        for card, n in cards:
+            self.submit_card(card, webhook_url, bug_count=n)
+        return len(cards)
+
+    def drain(self, timeout=None):
+        """等待队列清空。超时返回 False。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._heap or self._inflight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _restore(self):
+        """从发件箱认领上次未投递完的消息；超过 OUTBOX_MAX_AGE 的直接丢弃。"""
+        now = time.monotonic()
+        restored = 0
+        for msg_id, url, payload, bug_count, attempt, created_at in self.outbox.claim():
+            job = _Job(url, payload, bug_count=bug_count)
+            job.msg_id = msg_id
+            job.attempt = attempt
+            job.created_at = created_at
+            if self._expired(job):
+                logger.error("发件箱消息 %s 超过 %s 秒未投递成功，丢弃", msg_id, Config.OUTBOX_MAX_AGE)
+                self.outbox.remove(msg_id)
+                continue
+            self._push(now, job)
+            restored += 1
+        if restored:
+            logger.info("从发件箱恢复 %s 条待投递消息", restored)
+
+    def _expired(self, job):
+        return Config.OUTBOX_MAX_AGE > 0 and time.time() - job.created_at > Config.OUTBOX_MAX_AGE
+
+    def _push(self, due, job):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), job))
+            self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                if self._stopping:
+                    return None
+                if self._heap:
+                    due = self._heap[0][0]
+                    now = time.monotonic()
+                    if due <= now:
+                        job = heapq.heappop(self._heap)[2]
+                        self._inflight += 1
+                        return job
+                    self._cond.wait(due - now)
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._deliver(job)
+            except Exception as e:
+                logger.error("飞书投递异常: %s", e, exc_info=True)
+                self._finish(job, False)
+            finally:
+                with self._cond:
+                    self._inflight -= 1
+                    self._cond.notify_all()
+
+    def _renew(self):
+        """投递期间定期为发件箱中持有的消息续租，避免被并行运行的其他进程认领。"""
+        now = time.monotonic()
+        with self._cond:
+            if now - self._renewed < self.outbox.lease / 3:
+                return
+            self._renewed = now
+        self.outbox.renew()
+
+    def _deliver(self, job):
+        if job.msg_id is not None:
+            self._renew()
+        wait = self.notifier.bucket_for(job.url).try_acquire()
+        if wait > 0:
+            self._push(time.monotonic() + wait, job)
+            return
+        ok, retry = self.notifier.post(job.url, job.payload)
+        if ok:
+            self._finish(job, True)
+            return
+        if retry is None:
+            logger.error("飞书投递失败，不可重试（已重试 %s 次）", job.attempt)
+            self._finish(job, False)
+            return
+        if job.msg_id is None:
+            if job.attempt >= self.max_retries:
+                logger.error("飞书投递失败，放弃（已重试 %s 次）", job.attempt)
+                self._finish(job, False)
+                return
+        elif self._expired(job):
+            logger.error("飞书投递失败，消息超过 %s 秒未送达，放弃（已重试 %s 次）", Config.OUTBOX_MAX_AGE, job.attempt)
+            self._finish(job, False)
+            return
+        delay = max(retry, backoff_delay(job.attempt))
+        job.attempt += 1
+        FEISHU_RETRIES.inc(webhook_label(job.url))
+        if job.msg_id is None:
+            logger.warning("飞书投递重试 %s/%s，%.1f 秒后", job.attempt, self.max_retries, delay)
+        else:
+            self.outbox.retry(job.msg_id, job.attempt)
+            logger.warning("飞书投递第 %s 次重试，%.1f 秒后（消息保留在发件箱）", job.attempt, delay)
+        self._push(time.monotonic() + delay, job)
+
+    def _finish(self, job, ok):
+        with self._cond:
+            if ok:
+                self.delivered += 1
+                self.delivered_bugs += job.bug_count
+            else:
+                self.failed += 1
+        if job.msg_id is not None:
+            self.outbox.remove(job.msg_id)
+        if job.on_done:
+            try:
+                job.on_done(ok)
+            except Exception as e:
+                logger.error("投递回调异常: %s", e, exc_info=True)
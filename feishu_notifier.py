@@ -1,48 +1,85 @@
 """
 飞书通知：文本 + 交互卡片（禅道 Bug）
 """
+import json
 import logging
+import threading
+import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
+import cassette
 from config import Config
+from meta_cache import Names
+from metrics import FEISHU_RESPONSES, FEISHU_SEND_SECONDS, webhook_label
 
 logger = logging.getLogger(__name__)
 
+# 飞书自定义机器人频率限制错误码（9499: too many request，11232: 发送频率超限）
+RATE_LIMIT_CODES = (9499, 11232)
 
-def _bug_card(bug, bug_url, header_color="blue"):
+# 变更字段的中文名（卡片中列出变更时使用）
+FIELD_LABELS = {
+    "title": "标题",
+    "severity": "严重程度",
+    "status": "状态",
+    "assignedTo": "指派给",
+    "openedBy": "创建人",
+    "product": "所属产品",
+    "module": "所属模块",
+}
+
+
+def _changes_md(changes, names=None):
+    names = names or Names()
+    lines = []
+    for field, old, new in changes:
+        label = FIELD_LABELS.get(field, field)
+        lines.append(f"- {label}：{names.field(field, old) or '-'} → {names.field(field, new) or '-'}")
+    return "\n".join(lines)
+
+
+def _bug_card(bug, bug_url, header_color="blue", changes=None, names=None):
     """
     组装单条 Bug 的飞书卡片。
-    bug: 禅道 Bug 对象（含 id, title, severity, status, openedBy, openedDate, product, module 等）
+    bug: Bug 记录（bug.Bug）或含 id, title, severity, status, openedBy, openedDate, product, module 等字段的字典
     bug_url: 禅道 Bug 详情页链接
+    changes: 字段变更 [(字段, 旧值, 新值)]，非空时卡片顶部列出变更内容
+    names: meta_cache.Names，产品、模块、人员显示为名称；为 None 时显示原始 ID / 账号
     """
+    names = names or Names()
     bid = bug.get("id", "")
     title = (bug.get("title") or "无标题")[:80]
     severity = bug.get("severity") or "-"
     status = bug.get("status") or "-"
-    opened_by = bug.get("openedBy") or "-"
+    opened_by = names.user(bug.get("openedBy")) or "-"
+    assigned_to = names.user(bug.get("assignedTo")) or "-"
     opened_date = bug.get("openedDate") or "-"
-    product = bug.get("product") or "-"
-    module = bug.get("module") or "-"
-    if isinstance(module, dict):
-        module = module.get("name", "-") if module else "-"
-    if isinstance(product, dict):
-        product = product.get("name", "-") if product else "-"
+    product = names.product(bug.get("product")) or "-"
+    module = names.module(bug.get("module")) or "-"
 
     content = (
         f"**严重程度**：{severity}\n"
         f"**状态**：{status}\n"
         f"**所属产品/模块**：{product} / {module}\n"
+        f"**指派给**：{assigned_to}\n"
         f"**创建人**：{opened_by}\n"
         f"**创建时间**：{opened_date}"
     )
+    elements = []
+    if changes:
+        elements.append(
+            {"tag": "div", "text": {"tag": "lark_md", "content": "**变更**：\n" + _changes_md(changes, names)}}
+        )
+        elements.append({"tag": "hr"})
     card = {
         "config": {"wide_screen_mode": True},
         "header": {
             "title": {"tag": "plain_text", "content": f"Bug #{bid} - {title}"},
             "template": header_color,
         },
-        "elements": [
+        "elements": elements + [
             {"tag": "div", "text": {"tag": "lark_md", "content": content}},
             {
                 "tag": "action",
@@ -60,31 +97,224 @@ def _bug_card(bug, bug_url, header_color="blue"):
     return card
 
 
+def _digest_row(bug, bug_url, changes=None, names=None):
+    """汇总卡片中的一行：链接 + 严重程度/状态/指派 + 变更摘要。"""
+    names = names or Names()
+    title = (bug.get("title") or "无标题")[:60].replace("[", "【").replace("]", "】")
+    parts = [f"[#{bug.get('id', '')} {title}]({bug_url})"]
+    parts.append(f"S{bug.get('severity') or '-'}")
+    parts.append(bug.get("status") or "-")
+    if bug.get("assignedTo"):
+        parts.append(f"@{names.user(bug.get('assignedTo'))}")
+    if changes:
+        parts.append("；".join(
+            f"{FIELD_LABELS.get(f, f)} {names.field(f, o) or '-'}→{names.field(f, n) or '-'}" for f, o, n in changes
+        ))
+    return "- " + " · ".join(parts)
+
+
+def _digest_group_key(bug, group_by, names=None):
+    if group_by == "severity":
+        return f"严重程度 {bug.get('severity') or '-'}"
+    product = (names or Names()).product(bug.get("product")) or "-"
+    return f"产品 {product}"
+
+
+def _json_size(obj):
+    return len(json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _digest_cards(items, group_by="product", max_bytes=None, header_color="orange", names=None):
+    """
+    多条 Bug 打包为汇总卡片。items 为 [(bug, bug_url, changes)]，返回 [(card, 该卡片包含的 Bug 数)]。
+    按 group_by（product / severity）分组，每条一行；按 max_bytes 自动拆成多张卡片，避免超过飞书卡片大小上限。
+    """
+    max_bytes = max_bytes or Config.FEISHU_CARD_MAX_BYTES
+    groups = {}
+    for bug, bug_url, changes in items:
+        groups.setdefault(_digest_group_key(bug, group_by, names), []).append(
+            _digest_row(bug, bug_url, changes, names)
+        )
+
+    empty_card = {
+        "config": {"wide_screen_mode": True},
+        "header": {"title": {"tag": "plain_text", "content": "禅道 Bug 汇总：0000 条（第 00/00 张）"}},
+        "elements": [],
+    }
+    empty_div = {"tag": "div", "text": {"tag": "lark_md", "content": ""}}
+    base_size = _json_size(empty_card)
+    div_size = _json_size(empty_div) + 1
+
+    pages = []  # 每张卡片：[(分组标题, [rows])]
+    current, size = [], base_size
+    for group, rows in groups.items():
+        head = f"**{group}（{len(rows)}）**"
+        section = None
+        for row in rows:
+            row_cost = _json_size(row) + 2
+            if section is not None and size + row_cost > max_bytes:
+                pages.append(current)
+                current, size = [], base_size
+                section = None
+                head = f"**{group}（续）**"
+            if section is None:
+                section_cost = div_size + _json_size(head)
+                if current and size + section_cost + row_cost > max_bytes:
+                    pages.append(current)
+                    current, size = [], base_size
+                section = (head, [])
+                current.append(section)
+                size += section_cost
+            section[1].append(row)
+            size += row_cost
+    if current:
+        pages.append(current)
+
+    total = len(items)
+    cards = []
+    for i, page in enumerate(pages, 1):
+        title = f"禅道 Bug 汇总：{total} 条"
+        if len(pages) > 1:
+            title += f"（第 {i}/{len(pages)} 张）"
+        card = {
+            "config": {"wide_screen_mode": True},
+            "header": {"title": {"tag": "plain_text", "content": title}, "template": header_color},
+            "elements": [
+                {"tag": "div", "text": {"tag": "lark_md", "content": head + "\n" + "\n".join(rows)}}
+                for head, rows in page
+            ],
+        }
+        cards.append((card, sum(len(rows) for _, rows in page)))
+    return cards
+
+
+class TokenBucket:
+    """令牌桶限流：rate 为每秒补充的令牌数，capacity 为突发上限。线程安全。"""
+
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """取一个令牌。成功返回 0，否则返回还需等待的秒数（不阻塞）。"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        """阻塞直到取得一个令牌。"""
+        while True:
+            wait = self.try_acquire()
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+
+def _retry_after(headers, default=0.0):
+    try:
+        return max(default, float(headers.get("Retry-After", "")))
+    except (TypeError, ValueError):
+        return default
+
+
+def _classify_response(status_code, headers, result):
+    """
+    解析飞书 Webhook 响应，返回 (ok, retry)：
+    retry 为 None 表示不可重试；否则为建议的最小重试间隔秒数（限流、5xx）。
+    """
+    if status_code == 429 or status_code >= 500:
+        logger.warning("飞书返回 HTTP %s", status_code)
+        return False, _retry_after(headers, 1.0 if status_code == 429 else 0.0)
+    if status_code >= 400:
+        logger.error("飞书通知失败: HTTP %s %s", status_code, result.get("msg", ""))
+        return False, None
+    code = result.get("code", result.get("StatusCode"))
+    if code == 0:
+        return True, None
+    if code in RATE_LIMIT_CODES:
+        logger.warning("飞书限流 code=%s: %s", code, result.get("msg"))
+        return False, _retry_after(headers, 1.0)
+    logger.error("飞书通知失败: %s", result.get("msg"))
+    return False, None
+
+
 class FeishuNotifier:
-    """飞书通知器（文本 + Bug 卡片）"""
+    """飞书通知器（文本 + Bug 卡片）。每个 Webhook 复用一个长连接 Session 和一个令牌桶。"""
+
+    _sessions = {}
+    _buckets = {}
+    _pool_lock = threading.Lock()
 
     def __init__(self, webhook_url=None):
         self.webhook_url = (webhook_url or Config.FEISHU_WEBHOOK_URL or "").strip() or None
 
+    def session_for(self, url):
+        """该 Webhook 的 keep-alive Session（进程内共享）。"""
+        with self._pool_lock:
+            session = self._sessions.get(url)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, Config.FEISHU_DELIVERY_WORKERS))
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cassette.install(session, "feishu")
+                self._sessions[url] = session
+            return session
+
+    def bucket_for(self, url):
+        """该 Webhook 的令牌桶（FEISHU_RATE_PER_MIN / FEISHU_RATE_BURST）。"""
+        with self._pool_lock:
+            bucket = self._buckets.get(url)
+            if bucket is None:
+                bucket = TokenBucket(Config.FEISHU_RATE_PER_MIN / 60.0, Config.FEISHU_RATE_BURST)
+                self._buckets[url] = bucket
+            return bucket
+
+    def post(self, url, payload):
+        """
+        发送一次（不限流、不重试）。返回 (ok, retry)：
+        retry 为 None 表示不可重试；否则为建议的最小重试间隔秒数（限流、网络错误、5xx）。
+        """
+        label = webhook_label(url)
+        start = time.monotonic()
+        try:
+            response = self.session_for(url).post(url, json=payload, timeout=10)
+        except requests.RequestException as e:
+            FEISHU_SEND_SECONDS.observe(label, value=time.monotonic() - start)
+            FEISHU_RESPONSES.inc(label, "error")
+            logger.warning("飞书请求异常: %s", e)
+            return False, 0.0
+        FEISHU_SEND_SECONDS.observe(label, value=time.monotonic() - start)
+        try:
+            result = response.json()
+        except ValueError:
+            result = {}
+        if not isinstance(result, dict):
+            result = {}
+        code = result.get("code", result.get("StatusCode"))
+        FEISHU_RESPONSES.inc(label, code if response.status_code == 200 and code is not None else response.status_code)
+        return _classify_response(response.status_code, response.headers, result)
+
     def send(self, message, webhook_url=None):
         """发送飞书文本消息"""
         url = (webhook_url or self.webhook_url or "").strip() or None
         if not url:
             logger.warning("未配置飞书 Webhook URL，跳过通知")
             return False
-        try:
-            payload = {"msg_type": "text", "content": {"text": message}}
-            response = requests.post(url, json=payload, timeout=10)
-            response.raise_for_status()
-            result = response.json()
-            if result.get("code") != 0:
-                logger.error("飞书通知失败: %s", result.get("msg"))
-                return False
+        payload = {"msg_type": "text", "content": {"text": message}}
+        self.bucket_for(url).acquire()
+        ok, _ = self.post(url, payload)
+        if ok:
             logger.info("飞书文本通知发送成功")
-            return True
-        except Exception as e:
-            logger.error("发送飞书通知异常: %s", e, exc_info=True)
-            return False
+        return ok
 
     def send_card(self, card, webhook_url=None):
         """发送飞书交互卡片。card 为 card 对象（不含 msg_type）。"""
@@ -92,21 +322,19 @@ class FeishuNotifier:
         if not url:
             logger.warning("未配置飞书 Webhook URL，跳过卡片通知")
             return False
-        try:
-            payload = {"msg_type": "interactive", "card": card}
-            response = requests.post(url, json=payload, timeout=10)
-            response.raise_for_status()
-            result = response.json()
-            if result.get("code") != 0:
-                logger.error("飞书卡片通知失败: %s", result.get("msg"))
-                return False
+        payload = {"msg_type": "interactive", "card": card}
+        self.bucket_for(url).acquire()
+        ok, _ = self.post(url, payload)
+        if ok:
             logger.info("飞书卡片通知发送成功")
-            return True
-        except Exception as e:
-            logger.error("发送飞书卡片异常: %s", e, exc_info=True)
-            return False
+        return ok
+
+    def send_digest_cards(self, items, webhook_url=None, group_by=None, names=None):
+        """多条 Bug 发送为汇总卡片（自动拆分）。items 为 [(bug, bug_url, changes)]，返回成功推送的 Bug 数。"""
+        cards = _digest_cards(items, group_by=group_by or Config.DIGEST_GROUP_BY, names=names)
+        return sum(n for card, n in cards if self.send_card(card, webhook_url=webhook_url))
 
-    def send_bug_card(self, bug, bug_url, webhook_url=None, header_color="blue"):
-        """发送单条 Bug 卡片。"""
-        card = _bug_card(bug, bug_url, header_color=header_color)
+    def send_bug_card(self, bug, bug_url, webhook_url=None, header_color="blue", changes=None, names=None):
+        """发送单条 Bug 卡片。changes 为字段变更列表时卡片中列出变更内容，names 用于显示名称。"""
+        card = _bug_card(bug, bug_url, header_color=header_color, changes=changes, names=names)
         return self.send_card(card, webhook_url=webhook_url)
@@ -0,0 +1,107 @@
+"""
+飞书异步通知器（asyncio + aiohttp）：每个 Webhook 一个并发信号量和令牌桶，失败按退避重试
+"""
+import asyncio
+import logging
+
+import aiohttp
+
+from config import Config
+from delivery import backoff_delay
+from feishu_notifier import TokenBucket, _bug_card, _classify_response, _digest_cards
+
+logger = logging.getLogger(__name__)
+
+_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+
+class AsyncFeishuNotifier:
+    """飞书异步通知器，接口与 FeishuNotifier 对应（方法均为协程）。"""
+
+    def __init__(self, webhook_url=None, concurrency=None, max_retries=None):
+        self.webhook_url = (webhook_url or Config.FEISHU_WEBHOOK_URL or "").strip() or None
+        self.concurrency = max(1, int(concurrency or Config.FEISHU_ASYNC_CONCURRENCY))
+        self.max_retries = Config.FEISHU_MAX_RETRIES if max_retries is None else max_retries
+        self._sems = {}
+        self._buckets = {}
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=_TIMEOUT)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _limits_for(self, url):
+        sem = self._sems.get(url)
+        if sem is None:
+            sem = self._sems[url] = asyncio.Semaphore(self.concurrency)
+            self._buckets[url] = TokenBucket(Config.FEISHU_RATE_PER_MIN / 60.0, Config.FEISHU_RATE_BURST)
+        return sem, self._buckets[url]
+
+    async def post(self, url, payload):
+        """发送一次，返回 (ok, retry)，含义同 FeishuNotifier.post。"""
+        try:
+            async with self._get_session().post(url, json=payload) as resp:
+                try:
+                    result = await resp.json(content_type=None)
+                except ValueError:
+                    result = {}
+                if not isinstance(result, dict):
+                    result = {}
+                return _classify_response(resp.status, resp.headers, result)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning("飞书请求异常: %s", e)
+            return False, 0.0
+
+    async def send_payload(self, payload, webhook_url=None):
+        """限流 + 重试发送一条消息。"""
+        url = (webhook_url or self.webhook_url or "").strip() or None
+        if not url:
+            logger.warning("未配置飞书 Webhook URL，跳过通知")
+            return False
+        sem, bucket = self._limits_for(url)
+        attempt = 0
+        while True:
+            async with sem:
+                wait = bucket.try_acquire()
+                while wait > 0:
+                    await asyncio.sleep(wait)
+                    wait = bucket.try_acquire()
+                ok, retry = await self.post(url, payload)
+            if ok:
+                return True
+            if retry is None or attempt >= self.max_retries:
+                logger.error("飞书投递失败，放弃（已重试 %s 次）", attempt)
+                return False
+            delay = max(retry, backoff_delay(attempt))
+            attempt += 1
+            logger.warning("飞书投递重试 %s/%s，%.1f 秒后", attempt, self.max_retries, delay)
+            await asyncio.sleep(delay)
+
+    async def send(self, message, webhook_url=None):
+        """发送飞书文本消息"""
+        return await self.send_payload({"msg_type": "text", "content": {"text": message}}, webhook_url)
+
+    async def send_card(self, card, webhook_url=None):
+        """发送飞书交互卡片。card 为 card 对象（不含 msg_type）。"""
+        return await self.send_payload({"msg_type": "interactive", "card": card}, webhook_url)
+
+    async def send_bug_card(self, bug, bug_url, webhook_url=None, header_color="blue", changes=None):
+        """发送单条 Bug 卡片。"""
+        return await self.send_card(_bug_card(bug, bug_url, header_color=header_color, changes=changes), webhook_url)
+
+    async def send_digest_cards(self, items, webhook_url=None, group_by=None):
+        """多条 Bug 并发发送为汇总卡片，返回成功推送的 Bug 数。"""
+        cards = _digest_cards(items, group_by=group_by or Config.DIGEST_GROUP_BY)
+        results = await asyncio.gather(*(self.send_card(card, webhook_url) for card, _ in cards))
+        return sum(n for (_, n), ok in zip(cards, results) if ok)
@@ -0,0 +1,115 @@
+"""
+流式 JSON 解析：从响应字节块中逐个取出指定路径下数组的元素，不构建整个对象
+"""
+import codecs
+import json
+
+_WHITESPACE = " \t\r\n"
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """按需从字节块迭代器补充文本缓冲区，已解析部分随补充丢弃。"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        """读入下一块，无更多数据时返回 False。"""
+        if self.eof:
+            return False
+        if self.pos:
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+        for chunk in self._chunks:
+            text = self._utf8.decode(chunk)
+            if text:
+                self.buf += text
+                return True
+        self.eof = True
+        tail = self._utf8.decode(b"", final=True)
+        self.buf += tail
+        return bool(tail)
+
+    def peek(self):
+        """跳过空白，返回下一个字符；数据结束返回空串。"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ""
+
+    def expect(self, chars):
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError(f"JSON 格式错误：位置 {self.pos} 期望 {chars!r}，实际 {c!r}")
+        self.pos += 1
+        return c
+
+    def value(self):
+        """解析一个完整的 JSON 值；缓冲区内不完整时继续读入。"""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if self.more():
+                    continue
+                raise
+            # 数字可能被块边界截断（如 "12" 后面还有 "3"），值恰好结束于缓冲区末尾时多读一块再解析
+            if end == len(self.buf) and self.more():
+                continue
+            self.pos = end
+            return obj
+
+
+def _walk_object(reader, path, meta):
+    reader.expect("{")
+    if reader.peek() == "}":
+        reader.pos += 1
+        return
+    while True:
+        key = reader.value()
+        if not isinstance(key, str):
+            raise ValueError("JSON 格式错误：对象键不是字符串")
+        reader.expect(":")
+        c = reader.peek()
+        if key == path[0] and len(path) > 1 and c == "{":
+            yield from _walk_object(reader, path[1:], meta.setdefault(key, {}))
+        elif key == path[0] and len(path) == 1 and c == "[":
+            yield from _walk_array(reader)
+        else:
+            meta[key] = reader.value()
+        if reader.expect(",}") == "}":
+            return
+
+
+def _walk_array(reader):
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.pos += 1
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(",]") == "]":
+            return
+
+
+def iter_json_items(chunks, path, meta=None):
+    """
+    从 JSON 对象字节流中逐个产出 path 指向的数组元素，例如 path=("result", "bugs")。
+    路径之外的字段（status、total、pager 等）解析后存入 meta（按原嵌套结构），元素迭代完后可读取。
+    内存占用与单个元素大小相关，与数组长度无关。格式错误时抛出 ValueError。
+    """
+    if meta is None:
+        meta = {}
+    reader = _Reader(chunks)
+    yield from _walk_object(reader, tuple(path), meta)
+    if reader.peek():
+        raise ValueError("JSON 格式错误：对象之后还有多余内容")
@@ -2,13 +2,19 @@
 zentao-notify 入口：常驻轮询或单次执行
 """
 import argparse
+import contextlib
 import logging
 import sys
 import time
 
+import cassette
+from cluster import Cluster
 from config import Config
-from notifier import run_once
-from zentao_client import ZenTaoClient
+from metrics import MetricsServer
+from notifier import new_coalescer, new_delivery_worker, run_round, run_sources_once
+from profiler import RoundProfiler
+from scheduler import PollScheduler
+from sources import load_sources
 
 logging.basicConfig(
     level=logging.INFO,
@@ -26,33 +32,223 @@ def main():
         action="store_true",
         help="只执行一次后退出（适合 cron）",
     )
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="使用 asyncio 引擎（需安装 aiohttp），单线程并发拉取与推送",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="接收禅道 Webhook 实时推送，轮询降为 RECONCILE_INTERVAL 兜底",
+    )
     parser.add_argument(
         "--webhook",
         type=str,
         default=None,
         help="飞书 Webhook URL（覆盖环境变量 FEISHU_WEBHOOK_URL）",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="性能剖析：每 PROFILE_EVERY 轮（默认每轮）采样，pstats / 折叠栈 / 摘要写入 PROFILE_DIR",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        default=None,
+        help="把禅道与飞书的请求/响应录制到 FILE（覆盖 CASSETTE_RECORD）",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        default=None,
+        help="离线回放 FILE 中录制的响应，不访问禅道与飞书（覆盖 CASSETTE_REPLAY）",
+    )
+    parser.add_argument(
+        "--time-scale",
+        type=float,
+        default=None,
+        help="回放时响应耗时的倍数，1 为原始耗时，0 为不等待（覆盖 CASSETTE_TIME_SCALE）",
+    )
     args = parser.parse_args()
+    if args.record:
+        Config.CASSETTE_RECORD = args.record
+    if args.replay:
+        Config.CASSETTE_REPLAY = args.replay
+    if args.time_scale is not None:
+        Config.CASSETTE_TIME_SCALE = args.time_scale
+    # 未加 --profile 时也可用 PROFILE_EVERY 在生产环境长期按 1/N 采样
+    profiler = RoundProfiler() if args.profile or Config.PROFILE_EVERY > 0 else None
+
+    if args.use_async:
+        import asyncio
+        if profiler:
+            logger.warning("--async 模式暂不支持性能剖析，忽略 --profile / PROFILE_EVERY")
+        if Config.CASSETTE_RECORD or Config.CASSETTE_REPLAY:
+            logger.warning("--async 模式暂不支持流量录制 / 回放，忽略 --record / --replay")
+        if Config.ZENTAO_SOURCES_FILE:
+            logger.warning("--async 模式暂不支持多禅道实例，忽略 ZENTAO_SOURCES_FILE")
+        try:
+            asyncio.run(main_async(args))
+        except KeyboardInterrupt:
+            logger.info("已退出")
+        return
+
+    # 回放不能改动线上的状态文件、快照与投递队列
+    if Config.CASSETTE_REPLAY:
+        cassette.isolate_state()
+    # 配置 ZENTAO_SOURCES_FILE 时同一进程轮询多个禅道实例，否则为环境变量配置的单个实例
+    sources = load_sources()
 
     if args.once:
-        run_once(webhook_url=args.webhook)
+        with _profiled(profiler, "once"):
+            run_sources_once(sources, webhook_url=args.webhook)
         return
 
-    # 常驻轮询（复用同一客户端，避免每轮重复登录）
-    interval = max(60, Config.POLL_INTERVAL)
-    logger.info("常驻轮询模式，间隔 %s 秒", interval)
-    client = ZenTaoClient()
+    if args.serve:
+        if len(sources) > 1:
+            logger.error("--serve 模式暂只支持单个禅道实例，请去掉 ZENTAO_SOURCES_FILE 或改用常驻轮询")
+            return
+        serve(args, sources[0], profiler)
+        return
+
+    # 常驻轮询（复用同一客户端，避免每轮重复登录），每个禅道实例按产品自适应调度
+    schedulers = [PollScheduler() for _ in sources]
+    logger.info(
+        "常驻轮询模式，产品间隔 %s~%s 秒，每轮最多 %s 个产品",
+        int(schedulers[0].min_interval), int(schedulers[0].max_interval), schedulers[0].budget,
+    )
+    # 配置 CLUSTER_DB 时与其他副本分摊产品，水位线存放在共享库中
+    cluster = None
+    if Config.CLUSTER_DB:
+        if len(sources) > 1:
+            logger.warning("多禅道实例暂不支持集群模式，忽略 CLUSTER_DB")
+        else:
+            cluster = Cluster().start()
+    metrics = MetricsServer().start() if Config.METRICS_PORT else None
+    # 投递在后台线程进行，飞书限流/重试不拖慢轮询；各禅道实例共用
+    delivery = new_delivery_worker(args.webhook, routers=[source.router(args.webhook) for source in sources],
+                                   cluster=cluster)
+    # 配置 COALESCE_WINDOW 时同一 Bug 的连续变更合并后由后台线程到期推送
+    coalescers = [
+        new_coalescer(source.client, delivery, args.webhook, router=source.router(args.webhook),
+                      path=source.coalesce_db)
+        for source in sources
+    ]
+    all_products = [None] * len(sources)
     while True:
+        for i, (source, scheduler) in enumerate(zip(sources, schedulers)):
+            due = []
+            try:
+                if all_products[i] is None or scheduler.products_stale():
+                    all_products[i] = source.products()
+                    scheduler.set_products(cluster.sync(all_products[i]) if cluster else all_products[i])
+                elif cluster:
+                    scheduler.set_products(cluster.sync(all_products[i]), refreshed=False)
+                due = scheduler.due()
+                if due:
+                    store = cluster.state_store() if cluster else None
+                    with _profiled(profiler, f"round-{source.name}" if source.name else "round"):
+                        result = run_round(
+                            webhook_url=args.webhook, delivery=delivery, product_ids=due, store=store,
+                            coalescer=coalescers[i], **source.round_kwargs(args.webhook),
+                        )
+                    scheduler.record(due, active=result["active"], failed=result["failed"],
+                                     skipped=result["skipped"], circuit_open=result["circuit_open"])
+            except Exception as e:
+                logger.error("%s本轮执行异常: %s", f"[{source.name}] " if source.name else "", e, exc_info=True)
+                scheduler.record(due, failed=due)
+        wait = min(scheduler.seconds_until_next() for scheduler in schedulers)
+        if cluster:
+            wait = min(wait, cluster.ttl / 3)
         try:
-            run_once(webhook_url=args.webhook, client=client)
+            time.sleep(max(1.0, wait))
+        except KeyboardInterrupt:
+            for coalescer in coalescers:
+                if coalescer:
+                    coalescer.close()
+            delivery.drain(timeout=30)
+            delivery.stop()
+            if cluster:
+                cluster.stop()
+            if metrics:
+                metrics.stop()
+            logger.info("已退出")
+            break
+
+
+def _profiled(profiler, label):
+    return profiler.round(label) if profiler else contextlib.nullcontext()
+
+
+def serve(args, source, profiler=None):
+    """--serve：Webhook 接收 + 低频兜底轮询，共用同一客户端与投递线程。"""
+    from webhook_server import WebhookReceiver
+
+    metrics = MetricsServer().start() if Config.METRICS_PORT else None
+    client = source.client
+    router = source.router(args.webhook)
+    delivery = new_delivery_worker(args.webhook, routers=[router])
+    coalescer = new_coalescer(client, delivery, args.webhook, router=router, path=source.coalesce_db)
+    try:
+        receiver = WebhookReceiver(
+            client, delivery, webhook_url=args.webhook, coalescer=coalescer, router=router,
+            snapshot_db=source.snapshot_db,
+        ).start()
+    except ValueError as e:
+        logger.error("%s", e)
+        if coalescer:
+            coalescer.close()
+        delivery.stop()
+        if metrics:
+            metrics.stop()
+        return
+    interval = max(60, Config.RECONCILE_INTERVAL)
+    logger.info("Webhook 模式，兜底轮询间隔 %s 秒", interval)
+    while True:
+        try:
+            with _profiled(profiler, "reconcile"):
+                run_round(webhook_url=args.webhook, delivery=delivery, product_ids=source.products(),
+                          coalescer=coalescer, **source.round_kwargs(args.webhook))
         except Exception as e:
-            logger.error("本轮执行异常: %s", e, exc_info=True)
+            logger.error("兜底轮询异常: %s", e, exc_info=True)
         try:
             time.sleep(interval)
         except KeyboardInterrupt:
+            receiver.stop()
+            if coalescer:
+                coalescer.close()
+            delivery.drain(timeout=30)
+            delivery.stop()
+            if metrics:
+                metrics.stop()
             logger.info("已退出")
             break
 
 
+async def main_async(args):
+    """--async 入口：单个事件循环内完成拉取、推送与轮询等待。"""
+    import asyncio
+
+    from feishu_notifier_async import AsyncFeishuNotifier
+    from notifier_async import run_once_async
+    from zentao_client_async import AsyncZenTaoClient
+
+    async with AsyncZenTaoClient() as client, AsyncFeishuNotifier(webhook_url=args.webhook) as notifier:
+        if args.once:
+            await run_once_async(webhook_url=args.webhook, client=client, notifier=notifier)
+            return
+        interval = max(60, Config.POLL_INTERVAL)
+        logger.info("异步常驻轮询模式，间隔 %s 秒", interval)
+        while True:
+            try:
+                await run_once_async(webhook_url=args.webhook, client=client, notifier=notifier)
+            except Exception as e:
+                logger.error("本轮执行异常: %s", e, exc_info=True)
+            await asyncio.sleep(interval)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,216 @@
+"""
+元数据缓存：产品、模块、用户名称按 TTL 缓存，过期后先用旧值并在后台刷新，用于卡片显示名称
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import cassette
+from config import Config
+from state_store import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+
+class TTLCache:
+    """
+    带过期时间与容量上限的字典缓存（线程安全）。
+    过期条目仍保留，lookup 返回 (命中, 值, 是否新鲜)，由调用方决定先用旧值还是同步刷新；
+    超过 maxsize 时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, ttl, maxsize, clock=time.time):
+        self.ttl = ttl
+        self.maxsize = max(1, int(maxsize))
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None, False
+            self._data.move_to_end(key)
+            return True, entry[1], entry[0] > self._clock()
+
+    def get(self, key, default=None):
+        """只返回值（过期也返回），不存在时返回 default。"""
+        found, value, _ = self.lookup(key)
+        return value if found else default
+
+    def put(self, key, value, expires=None):
+        with self._lock:
+            self._data[key] = (self._clock() + self.ttl if expires is None else expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def dump(self):
+        with self._lock:
+            return [[key, expires, value] for key, (expires, value) in self._data.items()]
+
+    def restore(self, rows):
+        for key, expires, value in rows:
+            self.put(key, value, expires)
+
+
+class MetadataCache:
+    """
+    禅道元数据缓存，挂在 ZenTaoClient.meta 上：
+    - products()：产品列表，替代每轮调用 get_products()
+    - names_for(bugs)：一次性解析一批 Bug 涉及的产品、模块、用户名称，缺失的模块按产品批量拉取，
+      用户列表整体拉取，均按 META_CACHE_TTL 缓存
+    过期数据先照常使用，同时在后台线程刷新（同一类数据同时只有一个刷新线程）；
+    配置 META_CACHE_FILE 时刷新结果持久化，重启后直接可用。
+    名称接口不可用（如传统 API）时记为空结果并同样缓存，不会每轮重试。
+    """
+
+    def __init__(self, client, path=None, ttl=None, maxsize=None, clock=time.time):
+        self.client = client
+        self.path = Config.META_CACHE_FILE if path is None else path
+        ttl = Config.META_CACHE_TTL if ttl is None else ttl
+        maxsize = Config.META_CACHE_SIZE if maxsize is None else maxsize
+        # 产品列表与用户表各为一个条目；模块按产品缓存，最多 maxsize 个产品
+        self._lists = TTLCache(ttl, 2, clock)
+        self._modules = TTLCache(ttl, maxsize, clock)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._load()
+
+    def products(self):
+        """产品列表 [{"id", "name"}]。首次同步拉取（失败抛出 ZenTaoClientError），过期后后台刷新。"""
+        return self._cached(self._lists, "products", self.client.get_products, raise_errors=True)
+
+    def product_names(self):
+        return {p["id"]: p["name"] for p in self.products() if p.get("id")}
+
+    def users(self):
+        """{account: realname}，拉取失败时为空。"""
+        return self._cached(self._lists, "users", self.client.get_users)
+
+    def modules(self, product_id):
+        """该产品的 {module_id: name}，拉取失败时为空。"""
+        pid = str(product_id)
+        return self._cached(self._modules, pid, lambda: self.client.get_modules(pid))
+
+    def names_for(self, bugs):
+        """解析一批 Bug 用到的名称，返回 Names；任何元数据不可用时对应字段按原值显示。"""
+        bugs = list(bugs)
+        if not bugs:
+            return Names()
+        try:
+            products = self.product_names()
+        except Exception as e:
+            logger.warning("获取产品名称失败: %s", e)
+            products = {}
+        modules = {}
+        for pid in {str(b.get("product") or "") for b in bugs}:
+            if pid and pid.isdigit():
+                modules.update(self.modules(pid))
+        return Names(products, modules, self.users())
+
+    def _cached(self, cache, key, fetch, raise_errors=False):
+        found, value, fresh = cache.lookup(key)
+        if found:
+            if not fresh:
+                self._refresh_in_background(cache, key, fetch)
+            return value
+        try:
+            value = fetch()
+        except Exception as e:
+            if raise_errors:
+                raise
+            logger.warning("获取禅道元数据 %s 失败，%s 秒内不再重试: %s", key, cache.ttl, e)
+            value = {}
+        cache.put(key, value)
+        self._save()
+        return value
+
+    def _refresh_in_background(self, cache, key, fetch):
+        token = (id(cache), key)
+        with self._lock:
+            if token in self._refreshing:
+                return
+            self._refreshing.add(token)
+
+        def run():
+            try:
+                cache.put(key, fetch())
+                self._save()
+            except Exception as e:
+                logger.warning("后台刷新禅道元数据 %s 失败，继续使用旧值: %s", key, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(token)
+
+        threading.Thread(target=run, name=f"zentao-meta-{key}", daemon=True).start()
+
+    def _load(self):
+        # 录制时不读取：录制文件需包含产品、模块、用户请求，回放时才有元数据
+        if not self.path or not os.path.isfile(self.path) or cassette.active() is not None:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("base_url") != self.client.base_url:
+                return
+            self._lists.restore(data.get("lists") or [])
+            self._modules.restore(data.get("modules") or [])
+        except Exception as e:
+            logger.warning("读取元数据缓存失败: %s", e)
+
+    def _save(self):
+        if not self.path:
+            return
+        data = {"base_url": self.client.base_url, "lists": self._lists.dump(), "modules": self._modules.dump()}
+        try:
+            with self._lock:
+                atomic_write_json(self.path, data)
+        except Exception as e:
+            logger.warning("写入元数据缓存失败: %s", e)
+
+
+def _display(value):
+    if isinstance(value, dict):
+        return value.get("name") or value.get("realname") or value.get("account") or value.get("id") or ""
+    return str(value or "")
+
+
+class Names:
+    """卡片用的名称映射；查不到名称时原样显示 ID / 账号。"""
+
+    def __init__(self, products=None, modules=None, users=None):
+        self.products = products or {}
+        self.modules = modules or {}
+        self.users = users or {}
+
+    def product(self, value):
+        key = _display(value)
+        return self.products.get(key) or key
+
+    def module(self, value):
+        key = _display(value)
+        if key in ("", "0"):
+            return ""
+        return self.modules.get(key) or key
+
+    def user(self, value):
+        key = _display(value)
+        return self.users.get(key) or key
+
+    def field(self, field, value):
+        """变更记录中的字段值：人员字段显示真实姓名。"""
+        if field in ("assignedTo", "openedBy"):
+            return self.user(value)
+        if field == "product":
+            return self.product(value)
+        if field == "module":
+            return self.module(value)
+        return value
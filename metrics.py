@@ -0,0 +1,286 @@
+"""
+运行指标：计数器、仪表、直方图（Prometheus 文本格式），常驻模式下可通过 /metrics 暴露
+"""
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 耗时直方图的桶（秒）与字节数直方图的桶
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    pairs.extend(f'{n}="{_escape(v)}"' for n, v in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} 需要标签 {self.labels}")
+        return tuple(str(v) for v in labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labels and self.kind != "histogram":
+            items = [((), 0)]
+        for key, value in items:
+            lines.extend(self._render_one(key, value))
+        return lines
+
+    def _render_one(self, key, value):
+        return [f"{self.name}{_labels_text(self.labels, key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=TIME_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels):
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def _render_one(self, key, entry):
+        counts, total, count = entry
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            labels = _labels_text(self.labels, key, (("le", _number(float(bound))),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _labels_text(self.labels, key)
+        lines.append(f"{self.name}_sum{labels} {_number(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labels=()):
+    return REGISTRY.register(Counter(name, help_text, labels))
+
+
+def gauge(name, help_text, labels=()):
+    return REGISTRY.register(Gauge(name, help_text, labels))
+
+
+def histogram(name, help_text, labels=(), buckets=TIME_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_text, labels, buckets))
+
+
+# 禅道客户端
+ZENTAO_LOGINS = counter("zentao_logins_total", "禅道登录次数", ("api", "result"))
+ZENTAO_LOGIN_SECONDS = histogram("zentao_login_seconds", "禅道登录耗时（含 v2 -> v1 -> 传统探测）", ("api",))
+ZENTAO_RELOGINS = counter("zentao_relogins_total", "认证失效后的重新登录次数")
+ZENTAO_FETCH_SECONDS = histogram("zentao_fetch_seconds", "单个产品 Bug 列表拉取耗时（含翻页）", ("product",))
+ZENTAO_FETCH_BYTES = histogram("zentao_fetch_bytes", "单个产品 Bug 列表的响应字节数（含翻页）", ("product",),
+                               BYTES_BUCKETS)
+ZENTAO_FETCH_FAILURES = counter("zentao_fetch_failures_total", "产品 Bug 列表拉取失败次数", ("product", "reason"))
+
+# 每轮处理（run_once）
+ROUND_SECONDS = histogram("notify_round_seconds", "一轮检查的总耗时")
+ROUND_STAGE_SECONDS = histogram(
+    "notify_round_stage_seconds", "一轮中各阶段累计耗时：fetch 等待拉取、filter 水位线过滤、diff 快照比对去重、"
+    "render 渲染入队、drain 等待投递", ("stage",)
+)
+ROUND_BUGS_SEEN = counter("notify_bugs_seen_total", "拉取到的 Bug 数（水位线过滤前）")
+ROUND_BUGS_CHANGED = counter("notify_bugs_changed_total", "水位线过滤后需要比对的 Bug 数")
+ROUND_BUGS_PUSHED = counter("notify_bugs_pushed_total", "推送（入队）的「Bug × Webhook」条数")
+ROUND_LAST_TIMESTAMP = gauge("notify_round_last_timestamp_seconds", "最近一轮完成的 Unix 时间")
+
+# 飞书
+FEISHU_SEND_SECONDS = histogram("feishu_send_seconds", "飞书 Webhook 单次请求耗时", ("webhook",))
+FEISHU_RESPONSES = counter("feishu_responses_total", "飞书 Webhook 响应，code 为飞书返回码、HTTP 状态码或 error",
+                           ("webhook", "code"))
+FEISHU_RETRIES = counter("feishu_retries_total", "飞书投递重试次数", ("webhook",))
+
+
+def webhook_label(url):
+    """Webhook 的指标标签：URL 含机器人密钥，只取哈希前 8 位。"""
+    return hashlib.sha1((url or "").encode("utf-8")).hexdigest()[:8]
+
+
+class StageTimer:
+    """累计一轮中各阶段的耗时：with timer.stage("filter"): ...；finish() 时写入直方图。"""
+
+    def __init__(self):
+        self.totals = {}
+        self._start = time.perf_counter()
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def add(self, name, seconds):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+    def iterate(self, items, name):
+        """逐个产出 items，等待每个元素的时间计入阶段 name；提前结束时关闭 items（如生成器）。"""
+        it = iter(items)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    self.add(name, time.perf_counter() - start)
+                yield item
+        finally:
+            close = getattr(it, "close", None)
+            if close is not None:
+                close()
+
+    def finish(self):
+        for name, seconds in self.totals.items():
+            ROUND_STAGE_SECONDS.observe(name, value=seconds)
+        ROUND_SECONDS.observe(value=time.perf_counter() - self._start)
+        ROUND_LAST_TIMESTAMP.set(value=time.time())
+
+
+class _Stage:
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start)
+
+
+class MetricsServer:
+    """独立线程提供 GET /metrics（Prometheus 文本格式）。"""
+
+    def __init__(self, host=None, port=None, registry=REGISTRY):
+        self.host = host or Config.METRICS_HOST
+        self.port = Config.METRICS_PORT if port is None else port
+        self.registry = registry
+        self._server = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?", 1)[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                logger.debug("metrics %s - " + fmt, self.address_string(), *args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info("指标接口 http://%s:%s/metrics", self.host, self._server.server_address[1])
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -1,14 +1,18 @@
 """
 轮询逻辑：从禅道拉取新/更新 Bug -> 去重 -> 推送飞书
 """
-import json
 import logging
-import os
 from datetime import datetime
 
+from coalescer import Coalescer
 from config import Config
+from delivery import DeliveryWorker
 from feishu_notifier import FeishuNotifier
-from zentao_client import ZenTaoClient, ZenTaoClientError
+from metrics import ROUND_BUGS_CHANGED, ROUND_BUGS_PUSHED, ROUND_BUGS_SEEN, StageTimer
+from outbox import Outbox
+from router import Router
+from state_store import StateStore
+from zentao_client import ZenTaoCircuitOpenError, ZenTaoClient, ZenTaoClientError, ZenTaoDeadlineError
 
 logger = logging.getLogger(__name__)
 
@@ -20,87 +24,305 @@ def _now_iso():
     return datetime.now().strftime(TIME_FMT)
 
 
-def load_state(state_file=None):
-    """读取 state.json，返回 last_check_time（ISO 字符串）或 None。"""
-    path = state_file or Config.STATE_FILE
-    if not path or not os.path.isfile(path):
-        return None
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data.get("last_check_time")
-    except Exception as e:
-        logger.warning("读取状态文件失败: %s", e)
+def _product_ids_from_config():
+    if not Config.ZENTAO_PRODUCT_IDS:
         return None
+    return [x.strip() for x in Config.ZENTAO_PRODUCT_IDS.split(",") if x.strip()]
 
 
-def save_state(last_check_time, state_file=None):
-    """写入 last_check_time 到 state.json。"""
-    path = state_file or Config.STATE_FILE
-    if not path:
-        return
-    try:
-        dir_path = os.path.dirname(path)
-        if dir_path and not os.path.isdir(dir_path):
-            os.makedirs(dir_path, exist_ok=True)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump({"last_check_time": last_check_time}, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error("写入状态文件失败: %s", e)
+def _select_bugs(store, bugs_by_pid, is_first_run, seen=None):
+    """按产品水位线过滤，再按 id 去重（seen 可跨多次调用共享）；首次运行全部作为快照基线。"""
+    if seen is None:
+        seen = set()
+    unique_bugs = []
+    for pid, bugs in bugs_by_pid.items():
+        for b in bugs:
+            bid = b.get("id")
+            if bid and bid not in seen and (is_first_run or store.is_new(pid, b)):
+                seen.add(bid)
+                unique_bugs.append(b)
+    return unique_bugs
+
+
+def _use_digest(count):
+    return bool(Config.DIGEST_THRESHOLD) and count >= Config.DIGEST_THRESHOLD
+
+
+# 一轮内累计待推送的变更达到该条数时先推送一批，其余照常累计到轮末（限制批量变更时的内存占用）
+_DISPATCH_BATCH = 2000
+
+
+def new_delivery_worker(webhook_url=None, routers=None, cluster=None):
+    """
+    新建并启动投递线程，线程数不少于路由目标数，多个 Webhook 可并行发送。
+    routers 为多个禅道实例各自的路由时，按全部路由的目标去重计数。
+    配置 OUTBOX_DB 时消息先写入发件箱，并恢复上次未投递完的消息；传入 cluster 时发件箱在共享的集群库中。
+    """
+    notifier = FeishuNotifier(webhook_url=webhook_url or Config.FEISHU_WEBHOOK_URL)
+    if routers is None:
+        routers = [Router.load(default=notifier.webhook_url)]
+    targets = {url for router in routers for url in router.targets()}
+    outbox = None
+    if Config.OUTBOX_DB:
+        outbox = Outbox(cluster.path, shared=True) if cluster is not None else Outbox()
+    workers = max(Config.FEISHU_DELIVERY_WORKERS, len(targets))
+    return DeliveryWorker(notifier, workers=workers, outbox=outbox).start()
+
+
+def dispatch(delivery, router, items, names=None):
+    """
+    按路由把 [(bug, bug_url, changes)] 分发到各 Webhook 并入队（各 Webhook 由投递线程并行发送）。
+    names 为 meta_cache.Names 时卡片显示产品、模块、人员名称。
+    某个 Webhook 本批条数达到 DIGEST_THRESHOLD 时改发汇总卡片（轮询按整轮调用，见 _RoundDispatch）。
+    返回入队的「Bug × Webhook」条数。
+    返回时消息已写入发件箱（如已配置）。
+    """
+    queued = 0
+    with delivery.batch():
+        for url, url_items in router.group(items).items():
+            if _use_digest(len(url_items)):
+                # 批量变更时打包为汇总卡片，大幅减少 Webhook 调用
+                cards = delivery.submit_digest(url_items, webhook_url=url, names=names)
+                logger.info("%s 条变更打包为 %s 张汇总卡片", len(url_items), cards)
+                queued += len(url_items)
+            else:
+                for bug, bug_url, changes in url_items:
+                    if delivery.submit_bug_card(bug, bug_url, webhook_url=url, changes=changes, names=names):
+                        queued += 1
+    return queued
+
+
+def dispatch_changes(delivery, router, client, changed):
+    """snapshots.diff() 的结果 [(bug, changes)] 补上详情链接与名称后交给 dispatch，返回入队条数。"""
+    if not changed:
+        return 0
+    items = [(bug, client.bug_view_url(bug.get("id", "")), changes) for bug, changes in changed]
+    return dispatch(delivery, router, items, client.meta.names_for(bug for bug, _ in changed))
+
+
+class _RoundDispatch:
+    """
+    轮询流水线中各产品比对出的变更先累计，轮末（或累计达到 _DISPATCH_BATCH 条时）一次交给 dispatch，
+    汇总卡片按整轮各 Webhook 的条数判断，批量变更分散在多个产品时也打包，DIGEST_GROUP_BY=product 可跨产品分组。
+    有变更的 Bug 在消息入队（写入发件箱）后才更新快照，进程中途退出时下一轮仍能比对出这些变更。
+    入队前按 store.owned() 再检查一次，集群模式下本轮中途失去租约的产品的变更不推送、不更新快照，由新主推送。
+    """
+
+    def __init__(self, delivery, router, client, snapshots, store):
+        self.delivery = delivery
+        self.router = router
+        self.client = client
+        self.snapshots = snapshots
+        self.store = store
+        self.queued = 0
+        self._changed = []  # [(product_id, bug, changes)]
+
+    def add(self, pid, changed, bugs):
+        """累计产品 pid 的 snapshots.diff(bugs) 结果；bugs 中没有变更的 Bug 立即更新快照。"""
+        held = {id(bug) for bug, _ in changed}
+        with self.snapshots.lock:
+            self.snapshots.upsert_many([b for b in bugs if id(b) not in held])
+        self._changed.extend((pid, bug, changes) for bug, changes in changed)
+        if len(self._changed) >= _DISPATCH_BATCH:
+            self.flush()
+
+    def flush(self):
+        if not self._changed:
+            return
+        owned = self.store.owned({pid for pid, _, _ in self._changed})
+        lost = {pid for pid, _, _ in self._changed if pid not in owned}
+        if lost:
+            logger.warning("%s 个产品的租约已被其他副本接管，放弃本轮的变更: %s", len(lost), ", ".join(sorted(lost)))
+        bugs = [bug for pid, bug, _ in self._changed if pid in owned]
+        self._changed = []
+        # 暂存期间 Webhook 可能已推送并更新了同一变更，入队前重新比对
+        with self.snapshots.lock:
+            changed = self.snapshots.diff(bugs)
+            self.queued += dispatch_changes(self.delivery, self.router, self.client, changed)
+            self.snapshots.upsert_many(bugs)
 
 
-def run_once(webhook_url=None, state_file=None, client=None):
+def new_coalescer(client, delivery, webhook_url=None, router=None, path=None):
     """
-    执行一次：拉取自上次检查以来的 Bug，推送到飞书，更新状态。
-    首次运行（无 state）仅写入当前时间，不推送历史 Bug。
+    配置 COALESCE_WINDOW 时新建合并窗口并启动后台线程，到期的 Bug 经 delivery 推送；未配置时返回 None。
+    router、path 为该禅道实例的路由与暂存库（默认 ROUTES_FILE 与 COALESCE_DB）。
+    """
+    if Config.COALESCE_WINDOW <= 0:
+        return None
+    if router is None:
+        router = Router.load(default=webhook_url or Config.FEISHU_WEBHOOK_URL)
+    return Coalescer(path=path).start(lambda changed: dispatch_changes(delivery, router, client, changed))
+
+
+def run_once(webhook_url=None, state_file=None, client=None, delivery=None, product_ids=None):
+    """
+    执行一次：按各产品水位线拉取新/更新的 Bug，推送到飞书，推进水位线。
+    首次运行（无 state）仅记录各产品当前水位线，不推送历史 Bug。
+    拉取失败的产品保留原水位线，下轮从原位置继续。
     client 为 None 时内部新建 ZenTaoClient；传入时复用（登录状态会缓存）。
-    返回本轮推送的 Bug 数量。
+    delivery 为 None 时内部新建 DeliveryWorker 并等待发送完毕，返回成功推送数
+    （配置发件箱时最多等待 OUTBOX_DRAIN_TIMEOUT 秒，未送达的留在发件箱）；
+    传入常驻的 DeliveryWorker 时只入队不等待，返回入队数。
+    消息写入发件箱后即推进水位线，飞书故障不会丢失本轮变更。
+    product_ids 为 None 时使用 ZENTAO_PRODUCT_IDS 或全部产品，否则只拉取指定产品。
     """
-    state_file = state_file or Config.STATE_FILE
-    since = load_state(state_file)
-    is_first_run = since is None
+    return run_round(webhook_url, state_file, client, delivery, product_ids)["pushed"]
+
+
+def run_round(webhook_url=None, state_file=None, client=None, delivery=None, product_ids=None, store=None,
+              coalescer=None, router=None, snapshot_db=None, coalesce_db=None):
+    """
+    run_once 的实现，返回本轮统计，供调度器调整各产品轮询间隔：
+    {"pushed": 推送数, "active": 有新变更的产品 ID 集合, "failed": 拉取失败的产品 ID 集合,
+     "skipped": 超出本轮截止时间而跳过的产品 ID 集合, "circuit_open": 熔断中而跳过的产品 ID 集合}
+    跳过的产品不算拉取失败，水位线保持不变。
+    store 为 None 时使用 state_file 的 StateStore；集群模式传入共享的 SharedStateStore（快照也在集群库中，忽略 snapshot_db）。
+    配置 COALESCE_WINDOW 时变更先进入合并窗口：coalescer 为 None 时本轮内部新建，结束前推送已到期的 Bug；
+    常驻模式传入 new_coalescer() 的实例，由其后台线程到期推送。
+    router、snapshot_db、coalesce_db 默认为 ROUTES_FILE、SNAPSHOT_DB、COALESCE_DB；
+    多个禅道实例时传入该实例的路由、快照库与暂存库（见 sources.Source.round_kwargs）。
+    """
+    result = {"pushed": 0, "active": set(), "failed": set(), "skipped": set(), "circuit_open": set()}
+    timer = StageTimer()
+    if store is None:
+        store = StateStore(state_file or Config.STATE_FILE)
+    is_first_run = store.is_empty()
+    now = _now_iso()
     if is_first_run:
-        since = _now_iso()
-        logger.info("首次运行，仅记录检查时间 %s，不推送历史 Bug", since)
-    product_ids = None
-    if Config.ZENTAO_PRODUCT_IDS:
-        product_ids = [x.strip() for x in Config.ZENTAO_PRODUCT_IDS.split(",") if x.strip()]
+        logger.info("首次运行，仅记录各产品水位线，不推送历史 Bug")
+        store.mark_initialized(now)
 
     if client is None:
         client = ZenTaoClient()
     notifier = FeishuNotifier(webhook_url=webhook_url or Config.FEISHU_WEBHOOK_URL)
+    if router is None:
+        router = Router.load(default=notifier.webhook_url)
 
-    if not notifier.webhook_url:
-        logger.warning("未配置 FEISHU_WEBHOOK_URL，跳过推送")
-        return 0
+    if not router.targets():
+        logger.warning("未配置 FEISHU_WEBHOOK_URL 或路由规则，跳过推送")
+        return result
 
     try:
-        bugs = client.get_bugs_since(since_iso_datetime=since, product_ids=product_ids)
+        if product_ids is None:
+            product_ids = _product_ids_from_config()
+        if product_ids is None:
+            product_ids = [p["id"] for p in client.meta.products()]
     except ZenTaoClientError as e:
-        logger.error("获取 Bug 列表失败: %s", e)
-        return 0
+        logger.error("获取产品列表失败: %s", e)
+        return result
 
-    # 按 id 去重（同一 Bug 可能因 openedDate 与 lastEditedDate 都满足条件而出现两次）
+    own_delivery = delivery is None
+    if own_delivery:
+        delivery = new_delivery_worker(notifier.webhook_url)
+    own_coalescer = coalescer is None and Config.COALESCE_WINDOW > 0
+    if own_coalescer:
+        coalescer = Coalescer(path=coalesce_db)
+    # 流水线：哪个产品先拉取完就先过滤、比对、渲染，不等最慢的产品；
+    # 处理完的产品只保留水位线与待推送的变更，Bug 列表随即释放，变更在轮末统一入队（见 _RoundDispatch）
     seen = set()
-    unique_bugs = []
-    for b in bugs:
-        bid = b.get("id")
-        if bid and bid not in seen:
-            seen.add(bid)
-            unique_bugs.append(b)
-
-    pushed = 0
-    for bug in unique_bugs:
-        bid = bug.get("id", "")
-        bug_url = client.bug_view_url(bid)
-        for attempt in range(3):
-            if notifier.send_bug_card(bug, bug_url, webhook_url=notifier.webhook_url):
-                pushed += 1
-                break
-            if attempt < 2:
-                logger.warning("飞书推送重试 %s/%s", attempt + 1, 2)
+    queued = 0
+    done = set()
+    try:
+        with store.snapshots(snapshot_db) as snapshots:
+            pending = _RoundDispatch(delivery, router, client, snapshots, store)
+            # 尚无快照基线的产品（首次运行、新产品、升级）本轮拉取全部 Bug 建立快照，
+            # 旧 Bug 之后被编辑时按字段比对推送，而不是当作新 Bug
+            seeding = set(snapshots.unseeded(product_ids))
+            if seeding and not is_first_run:
+                logger.info("%s 个产品尚无快照基线，本轮拉取全部 Bug 建立快照", len(seeding))
+            since_by_pid = {pid: None if pid in seeding else store.since_for(pid) or now for pid in product_ids}
+            fetched = client.iter_bugs_by_product(product_ids, since=since_by_pid)
+            try:
+                for pid, bugs, error in timer.iterate(fetched, "fetch"):
+                    done.add(pid)
+                    if error is not None:
+                        if isinstance(error, ZenTaoCircuitOpenError):
+                            logger.debug("产品 %s 熔断中，本轮跳过", pid)
+                            result["circuit_open"].add(pid)
+                        elif isinstance(error, ZenTaoDeadlineError):
+                            logger.debug("产品 %s 超出本轮截止时间，跳过", pid)
+                            result["skipped"].add(pid)
+                        else:
+                            logger.warning("拉取产品 %s 的 Bug 失败，保留原水位线: %s", pid, error)
+                            result["failed"].add(pid)
+                        continue
+                    ROUND_BUGS_SEEN.inc(amount=len(bugs))
+                    with timer.stage("filter"):
+                        if not is_first_run and any(store.is_new(pid, b) for b in bugs):
+                            result["active"].add(pid)
+                        fresh = _select_bugs(store, {pid: bugs}, is_first_run, seen)
+                    # 建立快照基线的产品全部 Bug 写入快照，其余只写本轮变化的 Bug
+                    upsert = bugs if pid in seeding else fresh
+                    if fresh:
+                        ROUND_BUGS_CHANGED.inc(amount=len(fresh))
+                    with timer.stage("diff"):
+                        with snapshots.lock:
+                            changed = snapshots.diff(fresh) if fresh and not is_first_run else []
+                            if coalescer is not None and pid in store.owned([pid]):
+                                coalescer.add(changed)
+                                snapshots.upsert_many(upsert)
+                        if coalescer is None:
+                            pending.add(pid, changed, upsert)
+                        if pid in seeding:
+                            snapshots.mark_seeded([pid])
+                    store.advance(pid, bugs)
+            finally:
+                with timer.stage("render"):
+                    pending.flush()
+                queued += pending.queued
+    except ZenTaoClientError as e:
+        logger.error("获取 Bug 列表失败: %s", e)
+        result["failed"].update(pid for pid in product_ids if pid not in done)
 
-    now = _now_iso()
-    save_state(now, state_file)
-    logger.info("本轮检查完成，推送 %s 条 Bug，下次 since=%s", pushed, now)
+    if own_coalescer:
+        with timer.stage("render"):
+            try:
+                # 未持久化时进程退出即丢失，直接推送全部暂存的 Bug
+                queued += coalescer.release(
+                    lambda changed: dispatch_changes(delivery, router, client, changed), flush=not coalescer.path
+                )
+            except Exception as e:
+                logger.error("推送合并窗口中到期的 Bug 失败，下次运行重试: %s", e)
+        coalescer.close()
+    ROUND_BUGS_PUSHED.inc(amount=queued)
+    pushed = queued
+    if own_delivery:
+        with timer.stage("drain"):
+            pushed = _drain_and_stop(delivery)
+
+    store.save()
+    timer.finish()
+    logger.info("%s本轮检查完成，推送 %s 条 Bug，%s 个产品拉取失败，%s 个产品超出截止时间、%s 个熔断中跳过",
+                f"[{client.name}] " if client.name else "", pushed, len(result["failed"]),
+                len(result["skipped"]), len(result["circuit_open"]))
+    result["pushed"] = pushed
+    return result
+
+
+def _drain_and_stop(delivery):
+    """等待投递完毕后停止投递线程（配置发件箱时最多等待 OUTBOX_DRAIN_TIMEOUT 秒），返回成功推送的 Bug 数。"""
+    if delivery.outbox is None:
+        delivery.drain()
+    elif not delivery.drain(timeout=Config.OUTBOX_DRAIN_TIMEOUT):
+        logger.warning("仍有 %s 条消息未送达，保留在发件箱，下次运行继续投递", delivery.pending())
+    delivery.stop()
+    return delivery.delivered_bugs
+
+
+def run_sources_once(sources, webhook_url=None):
+    """
+    --once：各禅道实例（sources.load_sources）依次执行一轮，共用一个投递线程，全部入队后等待发送完毕。
+    单个实例失败不影响其他实例。返回成功推送的 Bug 数。
+    """
+    delivery = new_delivery_worker(webhook_url, routers=[source.router(webhook_url) for source in sources])
+    try:
+        for source in sources:
+            try:
+                run_round(webhook_url=webhook_url, delivery=delivery, product_ids=source.products(),
+                          **source.round_kwargs(webhook_url))
+            except Exception as e:
+                logger.error("禅道实例 %s 本轮执行异常: %s", source.name or source.client.base_url, e, exc_info=True)
+    finally:
+        pushed = _drain_and_stop(delivery)
+    logger.info("本次运行共推送 %s 条 Bug", pushed)
     return pushed
@@ -0,0 +1,111 @@
+"""
+异步轮询：AsyncZenTaoClient 并发拉取 -> 去重 -> AsyncFeishuNotifier 并发推送（main.py --async）
+"""
+import asyncio
+import logging
+
+from config import Config
+from feishu_notifier_async import AsyncFeishuNotifier
+from notifier import _now_iso, _product_ids_from_config, _select_bugs, _use_digest
+from router import Router
+from snapshot_store import SnapshotStore
+from state_store import StateStore
+from zentao_client import ZenTaoClientError
+from zentao_client_async import AsyncZenTaoClient
+
+logger = logging.getLogger(__name__)
+
+
+async def _send_to_webhook(notifier, url, items):
+    """推送到一个 Webhook，返回 (成功的 Bug 数, 未送达的 Bug ID)。汇总卡片任一张失败时该 Webhook 的 Bug 都视为未送达。"""
+    if _use_digest(len(items)):
+        pushed = await notifier.send_digest_cards(items, webhook_url=url)
+        return pushed, set() if pushed == len(items) else {str(bug.get("id")) for bug, _, _ in items}
+    results = await asyncio.gather(*(
+        notifier.send_bug_card(bug, bug_url, webhook_url=url, changes=changes)
+        for bug, bug_url, changes in items
+    ))
+    return sum(1 for ok in results if ok), {str(bug.get("id")) for (bug, _, _), ok in zip(items, results) if not ok}
+
+
+async def dispatch_async(notifier, router, items):
+    """
+    按路由并发推送到各 Webhook（每个 Webhook 的并发受其信号量限制），
+    返回 (成功的「Bug × Webhook」条数, 任一 Webhook 未送达的 Bug ID 集合)。
+    """
+    results = await asyncio.gather(*(
+        _send_to_webhook(notifier, url, url_items) for url, url_items in router.group(items).items()
+    ))
+    failed = set()
+    for _, ids in results:
+        failed |= ids
+    return sum(pushed for pushed, _ in results), failed
+
+
+async def run_once_async(webhook_url=None, state_file=None, client=None, notifier=None):
+    """
+    run_once 的异步版本，状态与快照规则相同。
+    client / notifier 为 None 时内部新建并在结束时关闭；传入时复用。
+    返回本轮成功推送的 Bug 数量。
+    """
+    own_client = client is None
+    own_notifier = notifier is None
+    client = client or AsyncZenTaoClient()
+    notifier = notifier or AsyncFeishuNotifier(webhook_url=webhook_url)
+    try:
+        return await _run_once(webhook_url or notifier.webhook_url, state_file, client, notifier)
+    finally:
+        if own_client:
+            await client.close()
+        if own_notifier:
+            await notifier.close()
+
+
+async def _run_once(webhook_url, state_file, client, notifier):
+    store = StateStore(state_file or Config.STATE_FILE)
+    is_first_run = store.is_empty()
+    now = _now_iso()
+    if is_first_run:
+        logger.info("首次运行，仅记录各产品水位线，不推送历史 Bug")
+        store.mark_initialized(now)
+
+    router = Router.load(default=webhook_url)
+    if not router.targets():
+        logger.warning("未配置 FEISHU_WEBHOOK_URL 或路由规则，跳过推送")
+        return 0
+
+    with SnapshotStore() as snapshots:
+        try:
+            product_ids = _product_ids_from_config()
+            if product_ids is None:
+                product_ids = [p["id"] for p in await client.get_products()]
+            # 尚无快照基线的产品拉取全部 Bug 建立快照（见 run_round）
+            seeding = set(snapshots.unseeded(product_ids))
+            since_by_pid = {pid: None if pid in seeding else store.since_for(pid) or now for pid in product_ids}
+            bugs_by_pid, errors = await client.get_bugs_by_product(product_ids, since=since_by_pid)
+        except ZenTaoClientError as e:
+            logger.error("获取 Bug 列表失败: %s", e)
+            return 0
+        for pid, e in errors.items():
+            logger.warning("拉取产品 %s 的 Bug 失败，保留原水位线: %s", pid, e)
+
+        unique_bugs = _select_bugs(store, bugs_by_pid, is_first_run)
+        with snapshots.lock:
+            changed = [] if is_first_run else snapshots.diff(unique_bugs)
+            items = [(bug, client.bug_view_url(bug.get("id", "")), changes) for bug, changes in changed]
+            pushed, failed = await dispatch_async(notifier, router, items)
+            # 未送达的 Bug 不更新快照，所在产品也不推进水位线，下一轮重新拉取时再次识别为变更并推送
+            snapshots.upsert_many([bug for bug in unique_bugs if str(bug.get("id")) not in failed])
+            seeded = [pid for pid in seeding if pid in bugs_by_pid]
+            snapshots.upsert_many([bug for pid in seeded for bug in bugs_by_pid[pid]
+                                   if str(bug.get("id")) not in failed])
+            snapshots.mark_seeded(seeded)
+
+    for pid, bugs in bugs_by_pid.items():
+        if failed and any(str(bug.get("id")) in failed for bug in bugs):
+            logger.warning("产品 %s 有 Bug 推送失败，保留原水位线，下一轮重试", pid)
+            continue
+        store.advance(pid, bugs)
+    store.save()
+    logger.info("本轮检查完成，推送 %s 条 Bug，%s 个产品拉取失败", pushed, len(errors))
+    return pushed
@@ -0,0 +1,157 @@
+"""
+发件箱：SQLite 持久化待投递的飞书消息，进程重启后继续投递
+"""
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """
+    SQLite 表 messages(id 自增, url, payload, bug_count, attempt, created_at, owner, lease_until, dedup)。
+    轮询把渲染好的卡片写入发件箱并提交后才推进水位线；投递成功或放弃后删除。
+    dedup 为 Webhook 与消息内容的哈希：发件箱中已有相同的待投递消息时 add() 不再写入
+    （如集群中旧主写入发件箱后、更新快照前退出，新主比对出同一变更）。
+    同一进程内多个线程共用一个连接，由 self._lock 串行化。
+    多个进程共用一个发件箱（如 cron 每分钟一次的 --once 在飞书故障时前后重叠）时，消息由写入或认领它的发件箱
+    持有（owner + lease_until）：claim() 只认领无主或租约已过期的消息，持有期间由 renew() 续期，
+    release() 在停止投递时交还未送达的消息，同一条消息不会被两个进程同时投递。
+    shared 为 True 时 path 为多副本共享的集群库（CLUSTER_DB），不切换 WAL（共享存储上不可靠）。
+    """
+
+    def __init__(self, path=None, lease=None, shared=False):
+        self.path = path or Config.OUTBOX_DB
+        self.lease = float(Config.OUTBOX_LEASE if lease is None else lease)
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        dir_path = os.path.dirname(self.path)
+        if dir_path and not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._batch = False
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        if not shared:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " url TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " bug_count INTEGER NOT NULL,"
+            " attempt INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL,"
+            " owner TEXT,"
+            " lease_until REAL NOT NULL DEFAULT 0,"
+            " dedup TEXT"
+            ")"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        if "owner" not in columns:
+            # 旧版发件箱：消息均视为无主，由下一个启动的进程认领
+            self._conn.execute("ALTER TABLE messages ADD COLUMN owner TEXT")
+            self._conn.execute("ALTER TABLE messages ADD COLUMN lease_until REAL NOT NULL DEFAULT 0")
+        if "dedup" not in columns:
+            self._conn.execute("ALTER TABLE messages ADD COLUMN dedup TEXT")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS messages_dedup ON messages (dedup)")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """事务内的 add 一次提交（fsync 一次）；异常时回滚。"""
+        with self._lock:
+            self._batch = True
+            try:
+                yield self
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+            finally:
+                self._batch = False
+
+    def add(self, url, payload, bug_count=0):
+        """写入一条消息，返回其 ID；已有相同的待投递消息时返回 None。不在 transaction 内调用时立即提交。"""
+        data = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        dedup = hashlib.sha1(f"{url}\n{data}".encode("utf-8")).hexdigest()
+        with self._lock:
+            now = time.time()
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO messages (url, payload, bug_count, created_at, owner, lease_until, dedup) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, data, int(bug_count), now, self.owner, now + self.lease, dedup),
+            )
+            if not self._batch:
+                self._conn.commit()
+            if not cur.rowcount:
+                logger.info("发件箱中已有相同的待投递消息，跳过")
+                return None
+            return cur.lastrowid
+
+    def claim(self):
+        """
+        认领无主或租约已过期的待投递消息（BEGIN IMMEDIATE，与其他进程的认领互斥），
+        返回 [(id, url, payload, bug_count, attempt, created_at)]，按写入顺序。
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.commit()
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "UPDATE messages SET owner = ?, lease_until = ? WHERE owner IS NULL OR lease_until < ?",
+                    (self.owner, now + self.lease, now),
+                )
+                rows = self._conn.execute(
+                    "SELECT id, url, payload, bug_count, attempt, created_at FROM messages WHERE owner = ? ORDER BY id",
+                    (self.owner,),
+                ).fetchall()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return [(i, url, json.loads(p), n, attempt, created) for i, url, p, n, attempt, created in rows]
+
+    def renew(self):
+        """为本发件箱持有的消息续租。"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE messages SET lease_until = ? WHERE owner = ?", (time.time() + self.lease, self.owner)
+            )
+            self._conn.commit()
+
+    def release(self):
+        """交还本发件箱持有的未送达消息，下一个进程启动时可立即认领。"""
+        with self._lock:
+            self._conn.execute("UPDATE messages SET owner = NULL, lease_until = 0 WHERE owner = ?", (self.owner,))
+            self._conn.commit()
+
+    def retry(self, msg_id, attempt):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE messages SET attempt = ?, lease_until = ? WHERE id = ? AND owner = ?",
+                (attempt, time.time() + self.lease, msg_id, self.owner),
+            )
+            self._conn.commit()
+
+    def remove(self, msg_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM messages WHERE id = ?", (msg_id,))
+            self._conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
@@ -0,0 +1,197 @@
+"""
+性能剖析（main.py --profile）：每 N 轮采样一轮，输出 pstats、折叠栈与每轮摘要
+"""
+import cProfile
+import glob
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# tracemalloc 记录的调用栈深度（1 帧开销最小，按代码行统计分配）
+_TRACE_FRAMES = 1
+
+# 空闲线程停留的栈顶（锁、条件变量、队列等待）
+_IDLE_FRAME = re.compile(r"\((threading|queue)\.py:|^_worker \(thread\.py:")
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _thread_label(name):
+    # 线程池线程（zentao-fetch_0、feishu-delivery-1）按池合并
+    return re.sub(r"[_-]\d+$", "", name or "thread")
+
+
+class StackSampler:
+    """
+    后台线程每 interval 秒采集一次所有线程的调用栈，累计为折叠栈（flamegraph.pl / speedscope 可直接读取）。
+    cProfile 只能剖析开启它的线程，拉取线程池、投递线程中的耗时（登录、JSON 解析、归一化、飞书请求）靠采样获得。
+    """
+
+    def __init__(self, interval=None):
+        self.interval = float(Config.PROFILE_SAMPLE_INTERVAL if interval is None else interval)
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                stack.append(_thread_label(names.get(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def hot_frames(self, top):
+        """各函数作为栈顶（正在执行或等待 I/O）的采样次数，忽略停在锁、条件变量、队列上的空闲线程。"""
+        leaf = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")
+            if len(frames) > 1 and not _IDLE_FRAME.search(frames[-1]):
+                leaf[frames[-1]] += count
+        return leaf.most_common(top)
+
+
+class RoundProfiler:
+    """
+    with profiler.round(): run_round(...) —— 每 every 轮采样一轮（第 1 轮必采），未采样的轮次没有额外开销。
+    采样轮次：主线程 cProfile、所有线程的调用栈采样、tracemalloc 分配统计，结束后在 directory 下写入
+    profile-时间-序号.pstats / .collapsed / .json（摘要：耗时最多的函数、分配最多的代码行、内存峰值），
+    只保留最近 keep 轮的文件。
+    """
+
+    def __init__(self, directory=None, every=None, top=None, keep=None):
+        self.directory = directory or Config.PROFILE_DIR
+        self.every = max(1, int(every or Config.PROFILE_EVERY or 1))
+        self.top = int(top or Config.PROFILE_TOP)
+        self.keep = Config.PROFILE_KEEP if keep is None else keep
+        self._rounds = 0
+
+    @contextmanager
+    def round(self, label="round"):
+        self._rounds += 1
+        if (self._rounds - 1) % self.every:
+            yield None
+            return
+        profile = cProfile.Profile()
+        sampler = StackSampler().start()
+        own_tracemalloc = not tracemalloc.is_tracing()
+        if own_tracemalloc:
+            tracemalloc.start(_TRACE_FRAMES)
+        tracemalloc.reset_peak()
+        started = time.time()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield profile
+        finally:
+            profile.disable()
+            wall = time.perf_counter() - start
+            sampler.stop()
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if own_tracemalloc:
+                tracemalloc.stop()
+            try:
+                self._write(label, started, wall, profile, sampler, snapshot, peak)
+            except Exception as e:
+                logger.warning("写入性能剖析结果失败: %s", e)
+
+    def _write(self, label, started, wall, profile, sampler, snapshot, peak):
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(
+            self.directory, f"profile-{time.strftime('%Y%m%d-%H%M%S', time.localtime(started))}-{self._rounds:05d}"
+        )
+        profile.dump_stats(prefix + ".pstats")
+        with open(prefix + ".collapsed", "w", encoding="utf-8") as f:
+            f.write(sampler.collapsed())
+
+        stats = pstats.Stats(profile, stream=io.StringIO())
+        functions = []
+        for (filename, line, name), (_, nc, tottime, cumtime, _) in stats.stats.items():
+            functions.append({
+                "function": f"{name} ({os.path.basename(filename)}:{line})",
+                "calls": nc,
+                "tottime": round(tottime, 6),
+                "cumtime": round(cumtime, 6),
+            })
+        functions.sort(key=lambda f: f["tottime"], reverse=True)
+        # 不统计 tracemalloc 与采样器自身的分配
+        snapshot = snapshot.filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__))
+        )
+        allocations = [
+            {
+                "line": f"{os.path.basename(s.traceback[0].filename)}:{s.traceback[0].lineno}",
+                "size": s.size,
+                "count": s.count,
+            }
+            for s in snapshot.statistics("lineno")[:self.top]
+        ]
+        summary = {
+            "label": label,
+            "round": self._rounds,
+            "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started)),
+            "wall_s": round(wall, 4),
+            "peak_traced_bytes": peak,
+            "hot_functions": functions[:self.top],
+            "hot_sampled_frames": [{"frame": f, "samples": n} for f, n in sampler.hot_frames(self.top)],
+            "samples": sampler.samples,
+            "top_allocations": allocations,
+        }
+        with open(prefix + ".json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        logger.info(
+            "性能剖析：%s 耗时 %.2f 秒，内存峰值 %.1f MB，主线程最耗时 %s，结果 %s.*",
+            label, wall, peak / 1048576.0,
+            "、".join(f"{f['function']} {f['tottime']:.3f}s" for f in functions[:3]) or "-", prefix,
+        )
+        self._prune()
+
+    def _prune(self):
+        if not self.keep or self.keep <= 0:
+            return
+        rounds = sorted({p.rsplit(".", 1)[0] for p in glob.glob(os.path.join(self.directory, "profile-*.*"))})
+        for prefix in rounds[:-self.keep]:
+            for path in glob.glob(glob.escape(prefix) + ".*"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
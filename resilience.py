@@ -0,0 +1,113 @@
+"""
+禅道调用的容错：熔断器、对冲请求
+"""
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, TimeoutError as FutureTimeout, wait
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class _Circuit:
+    __slots__ = ("failures", "open_until", "cooldown", "probing")
+
+    def __init__(self):
+        self.failures = 0
+        self.open_until = None
+        self.cooldown = 0
+        self.probing = False
+
+
+class CircuitBreaker:
+    """
+    按键（如 ("bugs", 产品 ID)、("products",)）熔断：连续失败 threshold 次后打开，cooldown 秒内 allow() 返回 False；
+    冷却结束后只放行一个试探请求（半开），成功则关闭，失败则重新打开且冷却时间翻倍（不超过 max_cooldown）。
+    线程安全。
+    """
+
+    def __init__(self, threshold=None, cooldown=None, max_cooldown=None, clock=time.monotonic):
+        self.threshold = max(1, int(threshold or Config.ZENTAO_BREAKER_THRESHOLD))
+        self.cooldown = float(Config.ZENTAO_BREAKER_COOLDOWN if cooldown is None else cooldown)
+        self.max_cooldown = float(Config.ZENTAO_BREAKER_MAX_COOLDOWN if max_cooldown is None else max_cooldown)
+        self._clock = clock
+        self._circuits = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        with self._lock:
+            c = self._circuits.get(key)
+            if c is None or c.open_until is None:
+                return True
+            if self._clock() < c.open_until or c.probing:
+                return False
+            c.probing = True
+            return True
+
+    def is_open(self, key):
+        with self._lock:
+            c = self._circuits.get(key)
+            return c is not None and c.open_until is not None
+
+    def record(self, key, ok):
+        """记录一次调用结果：ok 为 True/False；None 表示结果不计入（如本轮截止时间已到），只结束试探。"""
+        with self._lock:
+            c = self._circuits.get(key)
+            if ok is None:
+                if c is not None:
+                    c.probing = False
+                return
+            if ok:
+                if c is not None:
+                    if c.open_until is not None:
+                        logger.info("%s 已恢复，关闭熔断", _label(key))
+                    del self._circuits[key]
+                return
+            if c is None:
+                c = self._circuits[key] = _Circuit()
+            c.failures += 1
+            if c.probing or (c.open_until is None and c.failures >= self.threshold):
+                c.cooldown = min(self.max_cooldown, c.cooldown * 2) if c.cooldown else self.cooldown
+                c.open_until = self._clock() + c.cooldown
+                c.probing = False
+                logger.warning("%s 连续失败 %s 次，熔断 %.0f 秒", _label(key), c.failures, c.cooldown)
+
+
+def _label(key):
+    if len(key) == 2 and key[0] == "bugs":
+        return f"产品 {key[1]} 的 Bug 列表"
+    return "禅道接口 " + "/".join(str(k) for k in key)
+
+
+def hedged(pool, fn, delay, discard=None):
+    """
+    对冲调用：fn 在 delay 秒内未返回时再发起一次相同调用，取先成功的结果；两次都失败时抛出后失败的异常。
+    落选的结果交给 discard（如关闭 HTTP 响应）。fn 必须是幂等的。
+    """
+    first = pool.submit(fn)
+    try:
+        return first.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    pending = {first, pool.submit(fn)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                winner = f.result()
+                for other in (done - {f}) | pending:
+                    other.add_done_callback(lambda loser: _discard(loser, discard))
+                return winner
+            error = f.exception()
+    raise error
+
+
+def _discard(future, discard):
+    if discard is not None and not future.cancelled() and future.exception() is None:
+        try:
+            discard(future.result())
+        except Exception:
+            pass
@@ -0,0 +1,83 @@
+"""
+禅道列表响应缓存：按 URL 保存校验信息（ETag / Last-Modified / 响应体哈希）与已解析、归一化的结果，
+内容未变（304，产品列表还包括响应体哈希相同）时直接复用，跳过 JSON 解析与归一化
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from config import Config
+from metrics import counter
+
+RESPONSE_CACHE = counter(
+    "zentao_response_cache_total",
+    "禅道列表响应缓存：not_modified 为 304，unchanged 为响应体哈希未变，miss 为重新解析",
+    ("result",),
+)
+
+
+def body_hasher():
+    """响应体哈希，随流式读取逐块 update()，不必把响应体拼接起来。"""
+    return hashlib.blake2b(digest_size=16)
+
+
+class CachedResponse:
+    __slots__ = ("etag", "last_modified", "digest", "items", "total")
+
+    def __init__(self, etag, last_modified, digest, items, total):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.digest = digest
+        self.items = items  # 已解析的结果（Bug 列表页为归一化后的 Bug 元组）
+        self.total = total
+
+    def validators(self):
+        """条件请求头：有 ETag 或 Last-Modified 时服务端可以返回 304。"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    URL（含查询参数）-> CachedResponse 的 LRU，最多 maxsize 条，线程安全；maxsize 为 0 时关闭。
+    每条只保存一页（Bug 列表页不超过 limit 条），安静的产品每轮只请求第一页，条目数按「产品数 × 2（两种排序）」估算即可。
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = max(0, int(Config.ZENTAO_RESPONSE_CACHE if maxsize is None else maxsize))
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key):
+        if not self.maxsize:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, etag, last_modified, digest, items, total=None):
+        if not self.maxsize or not (etag or last_modified or digest):
+            return
+        with self._lock:
+            self._entries[key] = CachedResponse(etag, last_modified, digest, tuple(items), total)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,129 @@
+"""
+推送路由：按产品、模块、严重程度、状态把 Bug 分发到一个或多个飞书 Webhook
+"""
+import json
+import logging
+import os
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 规则文件中的字段名 -> Bug 字段
+DIMENSIONS = (
+    ("products", "product"),
+    ("modules", "module"),
+    ("severities", "severity"),
+    ("statuses", "status"),
+)
+
+# route() 结果缓存上限（按 产品/模块/严重程度/状态 组合缓存）
+_CACHE_MAX = 4096
+
+# load() 缓存：{(path, default): (mtime, Router)}，规则文件未修改时复用已编译的索引
+_loaded = {}
+
+
+def _field_value(value):
+    if isinstance(value, dict):
+        value = value.get("id") or value.get("name") or ""
+    return str(value).strip()
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [x.strip() for x in str(value).split(",") if x.strip()]
+
+
+class Router:
+    """
+    规则示例（ROUTES_FILE，JSON）：
+        {"default": "https://open.feishu.cn/...",
+         "routes": [{"webhooks": ["https://..."], "products": ["1", "2"], "severities": ["1", "2"]},
+                    {"webhook": "https://...", "modules": ["23"], "statuses": ["active"]}]}
+    每条规则各维度为允许值列表，缺省表示不限；Bug 命中的所有规则的 Webhook 都会收到推送，
+    一条也未命中时发往 default。
+    规则编译为「维度 -> 取值 -> 规则位图」的索引，匹配时每个维度查一次字典再按位与，与规则条数无关。
+    """
+
+    def __init__(self, rules=(), default=None):
+        self.default = tuple(u for u in _as_list(default) if u)
+        self._webhooks = []
+        self._index = {field: {} for _, field in DIMENSIONS}
+        self._wildcard = {field: 0 for _, field in DIMENSIONS}
+        self._cache = {}
+        for i, rule in enumerate(rules):
+            urls = tuple(_as_list(rule.get("webhooks")) + _as_list(rule.get("webhook")))
+            if not urls:
+                logger.warning("路由规则 #%s 未配置 webhook，已忽略", i + 1)
+            self._webhooks.append(urls)
+            bit = 1 << i
+            for key, field in DIMENSIONS:
+                values = _as_list(rule.get(key))
+                if not values:
+                    self._wildcard[field] |= bit
+                for v in values:
+                    self._index[field][v] = self._index[field].get(v, 0) | bit
+
+    @classmethod
+    def load(cls, path=None, default=None):
+        """从 ROUTES_FILE 加载规则；未配置规则文件时所有 Bug 发往 default。"""
+        default = default or Config.FEISHU_WEBHOOK_URL
+        path = Config.ROUTES_FILE if path is None else path
+        if not path:
+            return cls(default=default)
+        if not os.path.isfile(path):
+            logger.warning("路由规则文件不存在: %s，全部发往默认 Webhook", path)
+            return cls(default=default)
+        mtime = os.path.getmtime(path)
+        cached = _loaded.get((path, default))
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        router = cls(data.get("routes") or [], default=default or data.get("default"))
+        logger.info("已加载 %s 条推送路由规则", len(router._webhooks))
+        _loaded[(path, default)] = (mtime, router)
+        return router
+
+    def targets(self):
+        """所有可能的 Webhook。"""
+        urls = dict.fromkeys(self.default)
+        for group in self._webhooks:
+            urls.update(dict.fromkeys(group))
+        return list(urls)
+
+    def route(self, bug):
+        """返回该 Bug 应推送到的 Webhook 元组（去重、保持规则顺序）。"""
+        key = tuple(_field_value(bug.get(field, "")) for _, field in DIMENSIONS)
+        urls = self._cache.get(key)
+        if urls is not None:
+            return urls
+        mask = (1 << len(self._webhooks)) - 1
+        for (_, field), value in zip(DIMENSIONS, key):
+            mask &= self._index[field].get(value, 0) | self._wildcard[field]
+            if not mask:
+                break
+        matched = {}
+        i = 0
+        while mask:
+            if mask & 1:
+                matched.update(dict.fromkeys(self._webhooks[i]))
+            mask >>= 1
+            i += 1
+        urls = tuple(matched) or self.default
+        if len(self._cache) >= _CACHE_MAX:
+            self._cache.clear()
+        self._cache[key] = urls
+        return urls
+
+    def group(self, items):
+        """items 为 [(bug, bug_url, changes)]，按 Webhook 分组返回 {url: [items]}。"""
+        by_url = {}
+        for item in items:
+            for url in self.route(item[0]):
+                by_url.setdefault(url, []).append(item)
+        return by_url
@@ -0,0 +1,88 @@
+"""
+自适应轮询调度：每个产品独立的下次到期时间，有变更的产品缩短间隔，长期无变更的产品逐步退避
+"""
+import logging
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """
+    - 新产品立即到期，间隔从 min_interval 开始
+    - 本轮有新变更：间隔重置为 min_interval
+    - 无变更或拉取失败：间隔乘以 backoff，不超过 max_interval
+    - 超出本轮截止时间而跳过：间隔不变且仍为到期状态，下一轮优先拉取；熔断中跳过：间隔不变，按原间隔到期
+    - 每轮最多拉取 budget 个产品（按到期时间先后），其余顺延到下一轮
+    产品列表（未配置 ZENTAO_PRODUCT_IDS 时）每 max_interval 刷新一次。
+    """
+
+    def __init__(self, min_interval=None, max_interval=None, budget=None, backoff=None, clock=time.monotonic):
+        self.min_interval = max(1.0, float(min_interval or Config.SCHED_MIN_INTERVAL))
+        self.max_interval = max(self.min_interval, float(max_interval or Config.SCHED_MAX_INTERVAL))
+        self.budget = max(1, int(budget or Config.SCHED_ROUND_BUDGET))
+        self.backoff = max(1.0, float(backoff or Config.SCHED_BACKOFF))
+        self._clock = clock
+        self._next_due = {}
+        self._interval = {}
+        self._products_refreshed = None
+
+    def products_stale(self):
+        """产品列表是否需要重新获取。"""
+        return self._products_refreshed is None or self._clock() - self._products_refreshed >= self.max_interval
+
+    def set_products(self, product_ids, refreshed=True):
+        """
+        更新产品集合：新增产品立即到期，已删除的产品移出调度。
+        refreshed 为 False 表示只是集群重新分片，不重置产品列表的刷新时间。
+        """
+        now = self._clock()
+        if refreshed:
+            self._products_refreshed = now
+        ids = [str(p) for p in product_ids]
+        for pid in ids:
+            if pid not in self._next_due:
+                self._next_due[pid] = now
+                self._interval[pid] = self.min_interval
+        for pid in set(self._next_due) - set(ids):
+            del self._next_due[pid]
+            del self._interval[pid]
+
+    def due(self):
+        """当前到期的产品（最早到期的在前），最多 budget 个。"""
+        now = self._clock()
+        ready = sorted((due, pid) for pid, due in self._next_due.items() if due <= now)
+        if len(ready) > self.budget:
+            logger.info("本轮到期产品 %s 个，超出预算 %s，其余顺延", len(ready), self.budget)
+        return [pid for _, pid in ready[:self.budget]]
+
+    def record(self, product_ids, active=(), failed=(), skipped=(), circuit_open=()):
+        """根据本轮结果调整各产品的间隔与下次到期时间（skipped、circuit_open 见 run_round 的返回值）。"""
+        now = self._clock()
+        active, failed, skipped, circuit_open = set(active), set(failed), set(skipped), set(circuit_open)
+        for pid in product_ids:
+            if pid not in self._next_due:
+                continue
+            if pid in skipped:
+                continue  # 保留原到期时间（已到期），下一轮按到期先后排在前面
+            if pid in circuit_open:
+                self._next_due[pid] = now + self._interval[pid]
+                continue
+            if pid in active and pid not in failed:
+                interval = self.min_interval
+            else:
+                interval = min(self.max_interval, self._interval[pid] * self.backoff)
+            self._interval[pid] = interval
+            self._next_due[pid] = now + interval
+
+    def seconds_until_next(self):
+        """距最早到期产品（或产品列表刷新）的秒数。"""
+        now = self._clock()
+        candidates = list(self._next_due.values())
+        if self._products_refreshed is not None:
+            candidates.append(self._products_refreshed + self.max_interval)
+        if not candidates:
+            return self.min_interval
+        return max(0.0, min(candidates) - now)
@@ -0,0 +1,140 @@
+"""
+Bug 快照：SQLite 保存每个 Bug 上次见到的归一化内容与内容哈希，用于字段级变更检测
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 单条 SQL 的参数个数上限（旧版 SQLite 为 999）
+_SQL_BATCH = 500
+
+# 不参与内容哈希的字段：仅编辑时间变化不算内容变更
+_VOLATILE_FIELDS = ("lastEditedDate",)
+
+
+def content_hash(bug):
+    data = {k: v for k, v in bug.items() if k not in _VOLATILE_FIELDS}
+    raw = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _parse_fields(value):
+    return tuple(x.strip() for x in (value or "").split(",") if x.strip())
+
+
+class SnapshotStore:
+    """
+    SQLite 快照表 bugs(id 主键, hash, data)；seeded 表记录已建立全量快照基线的产品。
+    diff() 只按本轮变化的 Bug ID 走主键批量查询，与库中总条数无关；
+    upsert_many() 一轮一个事务批量写入。
+    同一进程内轮询与 Webhook 接收同时推送时，diff 到 upsert 之间持有 SnapshotStore.lock，避免重复推送。
+    shared 为 True 时 path 为多副本共享的集群库（见 cluster.SharedStateStore），不切换 WAL（共享存储上不可靠）。
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, path=None, fields=None, shared=False):
+        self.path = path or Config.SNAPSHOT_DB
+        self.fields = _parse_fields(Config.NOTIFY_FIELDS) if fields is None else tuple(fields)
+        dir_path = os.path.dirname(self.path)
+        if dir_path and not os.path.isdir(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        if not shared:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS bugs ("
+            " id TEXT PRIMARY KEY,"
+            " hash TEXT NOT NULL,"
+            " data TEXT NOT NULL,"
+            " updated_at INTEGER NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seeded (product_id TEXT PRIMARY KEY) WITHOUT ROWID")
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def unseeded(self, product_ids):
+        """
+        尚未建立快照基线的产品（首次运行、新产品、升级前已有的安装）。这些产品本轮应拉取全部 Bug 并 upsert_many，
+        再 mark_seeded；否则旧 Bug 首次被编辑时没有快照，会被当作新 Bug 推送整张卡片。
+        """
+        seeded = {r[0] for r in self._conn.execute("SELECT product_id FROM seeded")}
+        return [pid for pid in product_ids if str(pid) not in seeded]
+
+    def mark_seeded(self, product_ids):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO seeded (product_id) VALUES (?)", [(str(pid),) for pid in product_ids]
+            )
+
+    def get_many(self, bug_ids):
+        """按 ID 批量读取快照，返回 {id: (hash, bug)}。"""
+        ids = list(dict.fromkeys(str(i) for i in bug_ids))
+        result = {}
+        for i in range(0, len(ids), _SQL_BATCH):
+            chunk = ids[i:i + _SQL_BATCH]
+            sql = "SELECT id, hash, data FROM bugs WHERE id IN (%s)" % ",".join("?" * len(chunk))
+            for bid, h, data in self._conn.execute(sql, chunk):
+                result[bid] = (h, json.loads(data))
+        return result
+
+    def diff(self, bugs):
+        """
+        与快照对比，返回需要推送的 [(bug, changes)]。
+        changes 为 None 表示新 Bug（无快照）；否则为 [(字段, 旧值, 新值)]，只含配置的 NOTIFY_FIELDS。
+        内容未变或仅非关注字段变化的 Bug 不返回。未配置关注字段时任何内容变化都推送。
+        """
+        old = self.get_many(b.get("id", "") for b in bugs)
+        result = []
+        for bug in bugs:
+            prev = old.get(str(bug.get("id", "")))
+            if prev is None:
+                result.append((bug, None))
+                continue
+            prev_hash, prev_bug = prev
+            if prev_hash == content_hash(bug):
+                continue
+            fields = self.fields or [k for k in bug if k not in _VOLATILE_FIELDS]
+            changes = [
+                (f, prev_bug.get(f, ""), bug.get(f, ""))
+                for f in fields
+                if prev_bug.get(f, "") != bug.get(f, "")
+            ]
+            if changes:
+                result.append((bug, changes))
+        return result
+
+    def upsert_many(self, bugs):
+        """一个事务内批量写入快照。"""
+        now = int(time.time())
+        rows = [
+            (str(b.get("id", "")), content_hash(b), json.dumps(dict(b.items()), ensure_ascii=False), now)
+            for b in bugs
+            if b.get("id")
+        ]
+        if not rows:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO bugs (id, hash, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET hash=excluded.hash, data=excluded.data, updated_at=excluded.updated_at",
+                rows,
+            )
@@ -0,0 +1,141 @@
+"""
+多禅道实例：一个进程轮询 ZENTAO_SOURCES_FILE 中配置的多个禅道，共享拉取线程池与飞书投递，
+状态、快照、元数据缓存、合并窗口暂存按实例分开存放
+"""
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from router import Router
+from zentao_client import ZenTaoClient
+
+logger = logging.getLogger(__name__)
+
+_NAME = re.compile(r"^[A-Za-z0-9_-]+$")
+_API_VERSIONS = ("auto", "v2", "v1", "legacy")
+
+
+def namespaced(path, name):
+    """按实例名区分的文件路径：state.json -> state.main.json。未配置（关闭）的路径或单实例时原样返回。"""
+    if not path or not name:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
+
+
+def _product_list(value):
+    if isinstance(value, str):
+        value = value.split(",")
+    ids = [str(v).strip() for v in value or () if str(v).strip()]
+    return ids or None
+
+
+def _secret(spec, key):
+    """凭据：key_env 为环境变量名时从环境变量读取，凭据不必写进配置文件。"""
+    env = spec.get(key + "_env")
+    if env:
+        return os.getenv(env, "")
+    return spec.get(key) or ""
+
+
+class Source:
+    """
+    一个禅道实例：客户端、要轮询的产品、推送目标，以及按实例名区分的状态文件、快照库、合并窗口暂存库。
+    name 为空表示由环境变量配置的单个实例，文件路径与单实例部署时相同。
+    """
+
+    def __init__(self, name, client, product_ids=None, webhook_url=None, routes_file=None):
+        self.name = name
+        self.client = client
+        self.product_ids = product_ids
+        self.webhook_url = webhook_url
+        self.routes_file = routes_file
+        self.state_file = namespaced(Config.STATE_FILE, name)
+        self.snapshot_db = namespaced(Config.SNAPSHOT_DB, name)
+        self.coalesce_db = namespaced(Config.COALESCE_DB, name)
+
+    def router(self, webhook_url=None):
+        """推送路由：routes_file（默认 ROUTES_FILE），未命中规则时发往 webhook（默认 --webhook / FEISHU_WEBHOOK_URL）。"""
+        return Router.load(self.routes_file, default=self.webhook_url or webhook_url)
+
+    def products(self):
+        """要轮询的产品 ID：配置了 products 时为该列表，否则为该实例的全部产品。"""
+        if self.product_ids is not None:
+            return list(self.product_ids)
+        return [p["id"] for p in self.client.meta.products()]
+
+    def round_kwargs(self, webhook_url=None):
+        """传给 notifier.run_round 的该实例参数。"""
+        return {
+            "client": self.client,
+            "state_file": self.state_file,
+            "router": self.router(webhook_url),
+            "snapshot_db": self.snapshot_db,
+            "coalesce_db": self.coalesce_db,
+        }
+
+
+def load_sources(path=None):
+    """
+    读取禅道实例配置（ZENTAO_SOURCES_FILE，JSON），未配置时返回由环境变量配置的单个实例。示例：
+        {"sources": [
+            {"name": "main", "base_url": "https://zentao.example.com", "account": "bot",
+             "password_env": "MAIN_ZENTAO_PASSWORD", "api": "v2", "products": ["1", "2"],
+             "webhook": "https://open.feishu.cn/..."},
+            {"name": "acme", "base_url": "http://zentao.acme.local", "account": "bot", "password": "...",
+             "api": "legacy", "routes_file": "routes-acme.json"}
+        ]}
+    name 用于区分各实例的状态文件（state.main.json 等）与指标标签，只能包含字母、数字、下划线和连字符；
+    api 为 auto（默认，按 v2 -> v1 -> 传统探测）、v2、v1 或 legacy（指定时只用该接口登录，不探测、不回退）；
+    products 缺省为全部产品；
+    webhook / routes_file 缺省为 FEISHU_WEBHOOK_URL / ROUTES_FILE。password、api_key 可改用 *_env 指定环境变量名。
+    各实例共用 ZENTAO_FETCH_WORKERS 个拉取线程（与对冲请求线程池），配置错误时抛出 ValueError。
+    """
+    path = Config.ZENTAO_SOURCES_FILE if path is None else path
+    if not path:
+        return [Source("", ZenTaoClient(), _product_list(Config.ZENTAO_PRODUCT_IDS))]
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    specs = data.get("sources") if isinstance(data, dict) else data
+    if not specs:
+        raise ValueError(f"{path} 中没有配置禅道实例")
+
+    workers = max(1, Config.ZENTAO_FETCH_WORKERS)
+    fetch_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zentao-fetch") if workers > 1 else None
+    hedge_pool = None
+    if Config.ZENTAO_HEDGE_AFTER > 0:
+        hedge_pool = ThreadPoolExecutor(max_workers=workers * 2, thread_name_prefix="zentao-hedge")
+
+    sources = []
+    for i, spec in enumerate(specs):
+        name = str(spec.get("name") or "").strip()
+        if not _NAME.match(name):
+            raise ValueError(f"禅道实例 #{i + 1} 的 name 只能包含字母、数字、下划线和连字符: {name!r}")
+        if any(s.name == name for s in sources):
+            raise ValueError(f"禅道实例名重复: {name}")
+        api = str(spec.get("api") or "auto").lower()
+        if api not in _API_VERSIONS:
+            raise ValueError(f"禅道实例 {name} 的 api 应为 {' / '.join(_API_VERSIONS)}: {api}")
+        password, api_key = _secret(spec, "password"), _secret(spec, "api_key")
+        # 不回退到 ZENTAO_ACCOUNT / ZENTAO_PASSWORD，避免把一个实例的凭据发给另一个实例
+        if not spec.get("base_url") or not spec.get("account") or not (password or api_key):
+            raise ValueError(f"禅道实例 {name} 需要配置 base_url、account 与 password（或 api_key）")
+        client = ZenTaoClient(
+            base_url=spec["base_url"],
+            account=spec["account"],
+            password=password or api_key,
+            api_key=api_key,
+            use_legacy=api == "legacy",
+            api_version=None if api == "auto" else api,
+            meta_cache_file=namespaced(Config.META_CACHE_FILE, name),
+            name=name,
+            fetch_pool=fetch_pool,
+            hedge_pool=hedge_pool,
+        )
+        sources.append(Source(name, client, _product_list(spec.get("products")), spec.get("webhook") or None,
+                              spec.get("routes_file") or None))
+    logger.info("已加载 %s 个禅道实例: %s", len(sources), ", ".join(s.name for s in sources))
+    return sources
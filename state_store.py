@@ -0,0 +1,149 @@
+"""
+状态存储：按产品记录水位线（已见到的最大 lastEditedDate/openedDate）及该时刻已推送的 Bug ID
+"""
+import json
+import logging
+import os
+import tempfile
+
+from bug import bug_time, format_date, parse_date
+from config import Config
+from snapshot_store import SnapshotStore
+
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 2
+
+
+def atomic_write_json(path, data):
+    """先写同目录临时文件再 os.replace，避免进程中断留下半个文件。"""
+    dir_path = os.path.dirname(path) or "."
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".state-", suffix=".tmp", dir=dir_path)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class StateStore:
+    """
+    按产品的水位线状态，保存在 STATE_FILE（JSON）。
+    - products[pid].watermark：该产品已见到的最大变更时间
+    - products[pid].ids：变更时间恰为 watermark 且已处理的 Bug ID（同一秒内多个变更不重复推送、不遗漏）
+    - created_at：状态首次创建时间，新出现的产品以此为起点
+    兼容旧格式 {"last_check_time": ...}：旧时间作为所有产品的起点。
+    内存中水位线为 parse_date 整数，文件中仍为禅道时间字符串。
+    """
+
+    def __init__(self, path=None):
+        self.path = path or Config.STATE_FILE
+        self.created_at = None
+        self._products = {}
+        self._dirty = False
+        self._dirty_pids = set()
+        self.load()
+
+    def load(self):
+        self.created_at = None
+        self._products = {}
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning("读取状态文件失败: %s", e)
+            return
+        if not isinstance(data, dict):
+            return
+        if data.get("version") == STATE_VERSION:
+            self.created_at = data.get("created_at")
+            for pid, p in (data.get("products") or {}).items():
+                self._products[str(pid)] = (parse_date(p.get("watermark")), set(p.get("ids") or ()))
+        else:
+            self.created_at = data.get("last_check_time")
+
+    def is_empty(self):
+        """是否首次运行（无任何历史状态）。"""
+        return self.created_at is None and not self._products
+
+    def since_for(self, product_id):
+        """该产品的查询起点：已有水位线则用水位线（含等于），否则用 created_at。"""
+        entry = self._products.get(str(product_id))
+        if entry:
+            return format_date(entry[0])
+        return self.created_at
+
+    def is_new(self, product_id, bug):
+        """Bug 是否在该产品水位线之后（或恰在水位线时刻但尚未处理）。"""
+        ts = bug_time(bug)
+        if not ts:
+            return False
+        entry = self._products.get(str(product_id))
+        if entry is None:
+            return self.created_at is None or ts >= parse_date(self.created_at)
+        watermark, ids = entry
+        if ts > watermark:
+            return True
+        return ts == watermark and str(bug.get("id", "")) not in ids
+
+    def advance(self, product_id, bugs):
+        """用本轮已处理的 Bug 推进该产品水位线；拉取失败的产品不要调用，保留原水位线。"""
+        pid = str(product_id)
+        watermark, ids = self._products.get(pid, (0, set()))
+        top = watermark
+        for b in bugs:
+            ts = bug_time(b)
+            if ts > top:
+                top = ts
+        if not top:
+            return
+        if top != watermark:
+            ids = set()
+        new_ids = {str(b.get("id", "")) for b in bugs if bug_time(b) == top}
+        if pid in self._products and top == watermark and new_ids <= ids:
+            return
+        self._products[pid] = (top, ids | new_ids)
+        self._dirty = True
+        self._dirty_pids.add(pid)
+
+    def owned(self, product_ids):
+        """本进程仍负责推送的产品（单实例为全部，集群模式为仍持有租约的产品）。"""
+        return {str(pid) for pid in product_ids}
+
+    def snapshots(self, path=None):
+        """与水位线配套的快照库（默认 SNAPSHOT_DB），集群模式为共享库中的快照。"""
+        return SnapshotStore(path)
+
+    def mark_initialized(self, now):
+        if self.created_at is None:
+            self.created_at = now
+            self._dirty = True
+
+    def save(self):
+        """有变化时原子写入状态文件。"""
+        if not self.path or not self._dirty:
+            return
+        data = {
+            "version": STATE_VERSION,
+            "created_at": self.created_at,
+            "products": {
+                pid: {"watermark": format_date(wm), "ids": sorted(ids)} for pid, (wm, ids) in self._products.items()
+            },
+        }
+        try:
+            atomic_write_json(self.path, data)
+            self._dirty = False
+            self._dirty_pids.clear()
+        except Exception as e:
+            logger.error("写入状态文件失败: %s", e)
@@ -0,0 +1,197 @@
+"""
+禅道 Webhook 接收（main.py --serve）：收到 Bug 事件后秒级推送飞书，轮询降为低频兜底
+"""
+import hmac
+import ipaddress
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from config import Config
+from notifier import dispatch_changes
+from router import Router
+from snapshot_store import SnapshotStore
+from zentao_client import _normalize_bug
+
+logger = logging.getLogger(__name__)
+
+# 一次处理的最大事件数（同一批内同一 Bug 只查询、推送一次）
+_BATCH = 200
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def parse_event(payload):
+    """
+    解析禅道 Webhook 请求体，返回 (bug_id, bug)；非 Bug 事件返回 None。
+    禅道默认 JSON 只含 objectType/objectID/action 等，bug 为 None，需再查询详情；
+    若请求体自带 Bug 对象（自定义推送），直接归一化。
+    """
+    if not isinstance(payload, dict):
+        return None
+    bug = payload.get("bug") if isinstance(payload.get("bug"), dict) else None
+    if bug is None and (payload.get("objectType") or "bug") != "bug":
+        return None
+    bug_id = str((bug or {}).get("id") or payload.get("objectID") or "").strip()
+    if not bug_id:
+        return None
+    return bug_id, (_normalize_bug(bug) if bug else None)
+
+
+class WebhookReceiver:
+    """
+    HTTP 接收线程只做校验和入队，立即返回；处理线程批量取事件：
+    按 ID 去重 -> 取 Bug 详情 -> 与快照比对（与轮询共用，已推送过的变更不会重复推送）-> 交给 DeliveryWorker。
+    传入 coalescer 时变更先进入合并窗口，到期后由其后台线程推送。
+    router、snapshot_db 默认为 ROUTES_FILE 与 SNAPSHOT_DB（禅道实例配置见 sources.Source）。
+    """
+
+    def __init__(self, client, delivery, webhook_url=None, host=None, port=None, path=None, token=None,
+                 coalescer=None, router=None, snapshot_db=None):
+        self.client = client
+        self.delivery = delivery
+        self.coalescer = coalescer
+        self.router = router if router is not None else Router.load(default=webhook_url)
+        self.snapshot_db = snapshot_db
+        self.host = host or Config.WEBHOOK_HOST
+        self.port = Config.WEBHOOK_PORT if port is None else port
+        self.path = path or Config.WEBHOOK_PATH
+        self.token = token if token is not None else Config.WEBHOOK_TOKEN
+        self._queue = queue.Queue()
+        self._server = None
+        self._threads = []
+
+    def start(self):
+        """启动接收。监听非本机地址（默认 0.0.0.0）却未配置 WEBHOOK_TOKEN 时拒绝启动（ValueError）。"""
+        if not self.token and not _is_loopback(self.host):
+            raise ValueError(
+                f"Webhook 接收监听 {self.host or '全部地址'} 但未配置 WEBHOOK_TOKEN，任何人都可以触发拉取与推送；"
+                "请配置 WEBHOOK_TOKEN，或将 WEBHOOK_HOST 设为 127.0.0.1 并由反向代理转发"
+            )
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                receiver._handle_post(self)
+
+            def log_message(self, fmt, *args):
+                logger.debug("webhook %s - %s", self.address_string(), fmt % args)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name="webhook-http", daemon=True),
+            threading.Thread(target=self._process_loop, name="webhook-process", daemon=True),
+        ]
+        for t in self._threads:
+            t.start()
+        logger.info("禅道 Webhook 接收已启动: http://%s:%s%s", self.host, self.port, self.path)
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        self._queue.put(None)
+        for t in self._threads:
+            t.join(5)
+        self._threads = []
+
+    def _reply(self, handler, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json; charset=utf-8")
+        handler.send_header("Content-Length", str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _handle_post(self, handler):
+        url = urlparse(handler.path)
+        if url.path != self.path:
+            return self._reply(handler, 404, {"code": 404, "msg": "not found"})
+        if self.token:
+            given = handler.headers.get("X-Token") or (parse_qs(url.query).get("token") or [""])[0]
+            if not hmac.compare_digest(given.encode("utf-8"), self.token.encode("utf-8")):
+                return self._reply(handler, 403, {"code": 403, "msg": "forbidden"})
+        try:
+            length = int(handler.headers.get("Content-Length") or 0)
+            raw = handler.rfile.read(length) if length > 0 else b""
+            payload = json.loads(raw.decode("utf-8") or "{}")
+        except (ValueError, UnicodeDecodeError):
+            return self._reply(handler, 400, {"code": 400, "msg": "invalid json"})
+        event = parse_event(payload)
+        if event:
+            self._queue.put(event)
+        self._reply(handler, 200, {"code": 0})
+
+    def submit_event(self, payload):
+        """直接投递一个事件（与 HTTP 请求体格式相同），返回是否为 Bug 事件。"""
+        event = parse_event(payload)
+        if event:
+            self._queue.put(event)
+        return event is not None
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        while len(batch) < _BATCH:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _process_loop(self):
+        with SnapshotStore(self.snapshot_db) as snapshots:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                try:
+                    self._process(batch, snapshots)
+                except Exception as e:
+                    logger.error("处理禅道 Webhook 事件异常: %s", e, exc_info=True)
+
+    def _process(self, batch, snapshots):
+        events = {}
+        for bug_id, bug in batch:
+            if bug is not None or bug_id not in events:
+                events[bug_id] = bug
+        bugs = []
+        for bug_id, bug in events.items():
+            if bug is None:
+                try:
+                    bug = self.client.get_bug(bug_id)
+                except Exception as e:
+                    logger.warning("获取 Bug #%s 详情失败，留待兜底轮询: %s", bug_id, e)
+                    continue
+            if bug:
+                bugs.append(bug)
+        with snapshots.lock:
+            changed = snapshots.diff(bugs)
+            if self.coalescer is not None:
+                self.coalescer.add(changed)
+            else:
+                dispatch_changes(self.delivery, self.router, self.client, changed)
+            snapshots.upsert_many(bugs)
+        if self.coalescer is not None:
+            logger.info("Webhook 事件 %s 个，%s 条 Bug 进入合并窗口", len(batch), len(changed))
+        else:
+            logger.info("Webhook 事件 %s 个，推送 %s 条 Bug", len(batch), len(changed))
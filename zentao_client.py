@@ -1,15 +1,39 @@
 """
 禅道 API 客户端：支持 v1 / v2 / 传统 Session（开源版 21.7.6 为 v1）
 """
+import contextlib
+import itertools
+import json
 import logging
-from urllib.parse import urljoin
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlencode, urljoin
 
 import requests
+from urllib3.util.request import ACCEPT_ENCODING
 
+import cassette
+from auth_cache import load_auth, save_auth
+from bug import Bug, parse_date
 from config import Config
+from json_stream import iter_json_items
+from meta_cache import MetadataCache
+from metrics import (
+    ZENTAO_FETCH_BYTES, ZENTAO_FETCH_FAILURES, ZENTAO_FETCH_SECONDS, ZENTAO_LOGIN_SECONDS, ZENTAO_LOGINS,
+    ZENTAO_RELOGINS,
+)
+from resilience import CircuitBreaker, hedged
+from response_cache import RESPONSE_CACHE, ResponseCache, body_hasher
 
 logger = logging.getLogger(__name__)
 
+# 流式解析 Bug 列表时每次从连接读取的字节数
+_STREAM_CHUNK = 64 * 1024
+# 没有 ETag / Last-Modified 的产品列表响应最多缓冲该字节数用于比对哈希，超过时改为边读边解析、不写入缓存
+_CACHE_MAX_BODY = 2 * 1024 * 1024
+
 
 class ZenTaoClientError(Exception):
     """禅道 API 调用异常"""
@@ -17,29 +41,274 @@ class ZenTaoClientError(Exception):
 
 
 class ZenTaoAuthError(ZenTaoClientError):
-    """认证失效（如 token 过期），清空登录状态后可由调用方重试"""
+    """认证失效（如 token 过期），由调用方经 _relogin 清空登录状态后重试"""
+    pass
+
+
+class ZenTaoDeadlineError(ZenTaoClientError):
+    """本轮（或该产品）的截止时间已到，未发出请求"""
+    pass
+
+
+class ZenTaoCircuitOpenError(ZenTaoClientError):
+    """该产品或接口处于熔断冷却期，本次跳过"""
     pass
 
 
+def _bug_id_key(bug):
+    try:
+        return int(bug.get("id") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _account(value):
+    """人员字段：REST v1 为 {"id", "account", "realname"} 对象，取其账号；其他版本为账号字符串。"""
+    if isinstance(value, dict):
+        return value.get("account") or value.get("realname") or ""
+    return value or ""
+
+
 def _normalize_bug(b):
-    """将禅道 Bug 对象统一为含 openedDate、lastEditedDate、product、module 等字段的字典。"""
-    opened = (b.get("openedDate") or "").strip()
-    if opened == "0000-00-00 00:00:00":
-        opened = ""
-    last_edited = (b.get("lastEditedDate") or "").strip()
-    if last_edited == "0000-00-00 00:00:00":
-        last_edited = ""
-    return {
-        "id": str(b.get("id", "")),
-        "title": b.get("title") or "",
-        "severity": b.get("severity") or "",
-        "status": b.get("status") or "",
-        "openedBy": b.get("openedBy") or "",
-        "openedDate": opened,
-        "lastEditedDate": last_edited,
-        "product": b.get("product") or b.get("productName") or "",
-        "module": b.get("module") or "",
-    }
+    """将禅道 Bug 对象归一化为 Bug 记录（含 openedDate、lastEditedDate、assignedTo、product、module 等字段）。"""
+    assigned_to = _account(b.get("assignedTo"))
+    return Bug(
+        id=str(b.get("id", "")),
+        title=b.get("title") or "",
+        severity=b.get("severity") or "",
+        status=b.get("status") or "",
+        opened_by=_account(b.get("openedBy")),
+        assigned_to=assigned_to,
+        opened=parse_date(b.get("openedDate")),
+        last_edited=parse_date(b.get("lastEditedDate")),
+        product=b.get("product") or b.get("productName") or "",
+        module=b.get("module") or "",
+    )
+
+
+def _auth_failed(status_code, data):
+    """判断是否为认证/授权失败，需重登。"""
+    if status_code in (401, 403):
+        return True
+    if not isinstance(data, dict):
+        return False
+    if data.get("status") == "fail":
+        msg = (data.get("message") or data.get("msg") or "").lower()
+        if "token" in msg or "登录" in msg or "auth" in msg or "unauthorized" in msg:
+            return True
+    return False
+
+
+def _parse_rest_products(data):
+    if data.get("status") != "success":
+        raise ZenTaoClientError(data.get("message", "获取产品列表失败"))
+    products = data.get("products") or []
+    return [{"id": str(p.get("id", "")), "name": p.get("name", "")} for p in products]
+
+
+def _check_rest_bugs_status(data):
+    if data.get("status") != "success":
+        raise ZenTaoClientError(data.get("message", "获取 Bug 列表失败"))
+
+
+def _parse_rest_bugs_page(data):
+    _check_rest_bugs_status(data)
+    return data.get("bugs") or [], data.get("total")
+
+
+def _parse_rest_modules(data):
+    """REST 模块树 {"modules": [{"id", "name", "children": [...]}]} 展平为 {module_id: name}。"""
+    result = {}
+    stack = list(data.get("modules") or [])
+    while stack:
+        m = stack.pop()
+        if not isinstance(m, dict):
+            continue
+        if m.get("id"):
+            result[str(m["id"])] = m.get("name") or ""
+        stack.extend(m.get("children") or [])
+    return result
+
+
+def _parse_rest_users(data):
+    """REST 用户列表，返回 ({account: realname}, total)。"""
+    users = {u["account"]: u.get("realname") or u["account"] for u in data.get("users") or [] if u.get("account")}
+    return users, data.get("total")
+
+
+def _parse_legacy_products(data):
+    """解析传统 API 产品列表的 result，无法识别时返回 None（由调用方退回从 Bug 列表提取）。"""
+    result = data.get("result")
+    if isinstance(result, list):
+        return [{"id": str(p.get("id", "")), "name": p.get("name", "")} for p in result]
+    if isinstance(result, dict):
+        return [{"id": str(k), "name": v} for k, v in result.items() if k and v]
+    return None
+
+
+def _parse_legacy_products_from_bugs(data):
+    result = data.get("result") or {}
+    products = result.get("products") if isinstance(result, dict) else {}
+    if not products:
+        return [{"id": "1", "name": "默认产品"}]
+    return [{"id": str(k), "name": v} for k, v in products.items()]
+
+
+def _check_legacy_bugs_status(data):
+    if data.get("status") == 0 or data.get("msg") == "error":
+        raise ZenTaoClientError(data.get("msg", data.get("message", "获取 Bug 列表失败")))
+
+
+def _legacy_bugs_total(data):
+    result = data.get("result")
+    pager = result.get("pager") if isinstance(result, dict) else None
+    return pager.get("recTotal") if isinstance(pager, dict) else None
+
+
+def _parse_legacy_bugs_page(data):
+    _check_legacy_bugs_status(data)
+    result = data.get("result")
+    if not isinstance(result, dict):
+        return [], None
+    return result.get("bugs") or [], _legacy_bugs_total(data)
+
+
+def _parse_bug_detail(data):
+    """解析单个 Bug 详情：REST 直接返回 Bug 对象或 {"bug": {...}}；传统 API 为 {"data": "<json>"}。"""
+    if isinstance(data.get("data"), str):
+        try:
+            data = json.loads(data["data"])
+        except ValueError:
+            return None
+    bug = data.get("bug") if isinstance(data.get("bug"), dict) else data
+    if not isinstance(bug, dict) or not bug.get("id"):
+        return None
+    return _normalize_bug(bug)
+
+
+def _failure_reason(error):
+    """拉取失败原因（指标标签）。"""
+    if isinstance(error, ZenTaoCircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, ZenTaoDeadlineError):
+        return "deadline"
+    if isinstance(error, ZenTaoAuthError):
+        return "auth"
+    if isinstance(error, requests.Timeout):
+        return "timeout"
+    if isinstance(error, requests.HTTPError):
+        return "http"
+    return "error"
+
+
+def _legacy_bugs_path(product_id, page, limit, order):
+    return (
+        f"index.php?m=bug&f=getList&t=json&productID={product_id}&branch=0"
+        f"&orderBy={order}&recPerPage={limit}&pageID={page}"
+    )
+
+
+class BugPager:
+    """
+    单个产品 Bug 列表的分页状态机，与具体 HTTP 实现无关（同步/异步客户端共用）。
+    有 since 时按 lastEditedDate 倒序翻页，遇到整页都早于 since 即停止；
+    未编辑过的新 Bug lastEditedDate 为空、排在末尾，再按 id 倒序补一轮，遇到整页 openedDate 早于 since 停止。
+    服务端未按要求排序时（本页键值非递减）该轮不提前停止。
+    早于 since 的 Bug 边解析边丢弃，只保留变更时间最大的一批（用于推进水位线），
+    内存占用与产品 Bug 总数无关。
+    用法：循环 next_request() 得到 (page, limit, order)，请求后把 (bugs, total) 交给 feed()，
+    next_request() 返回 None 时由 bugs() 取归一化结果。
+    bugs 可以是原始 Bug 对象或已归一化的 Bug，可以是列表或流式解析的迭代器（feed 返回时关闭）；
+    total 可以是可调用对象，在 bugs 迭代完后求值。
+    """
+
+    def __init__(self, since=None, limit=100):
+        self.since = parse_date(since)
+        self.limit = limit
+        if self.since:
+            self._passes = [("lastEditedDate_desc", "last_edited"), ("id_desc", "opened")]
+        else:
+            self._passes = [("id_desc", None)]
+        self._seen = {}
+        self._newest = {}  # 变更时间最大的 Bug（可能早于 since），保证水位线按服务端时间推进
+        self._newest_ts = 0
+        self._pass = -1
+        self._done = True
+        self._page = 0
+
+    def _start_pass(self):
+        self._pass += 1
+        self._page = 1
+        self._prev_key = None
+        self._prev_first_id = None
+        self._ordered = True
+        self._done = False
+
+    def next_request(self):
+        if self._done:
+            if self._pass + 1 >= len(self._passes):
+                return None
+            self._start_pass()
+        return self._page, self.limit, self._passes[self._pass][0]
+
+    def feed(self, raw, total):
+        order, field = self._passes[self._pass]
+        count = 0
+        all_older = True
+        try:
+            for item in raw:
+                b = item if isinstance(item, Bug) else _normalize_bug(item)
+                if count == 0 and b.id == self._prev_first_id:
+                    self._done = True  # 服务端忽略了分页参数，重复返回同一页
+                    return
+                if count == 0:
+                    first_id = b.id
+                count += 1
+                self._keep(b)
+                if field:
+                    key = _bug_id_key(b) if order == "id_desc" else getattr(b, field)
+                    if self._ordered and self._prev_key is not None and self._prev_key < key:
+                        self._ordered = False
+                        logger.debug("服务端未按 %s 排序，本轮不提前停止", order)
+                    self._prev_key = key
+                    if getattr(b, field) >= self.since:
+                        all_older = False
+        finally:
+            # 提前返回或出错时关闭流式解析的迭代器，释放响应连接
+            close = getattr(raw, "close", None)
+            if close is not None:
+                close()
+        if not count:
+            self._done = True  # 空页
+            return
+        if field and self._ordered and all_older:
+            self._done = True
+            return
+        if count != self.limit:
+            self._done = True  # 不足一页为末页；多于一页说明服务端忽略了 limit，已是全量
+            return
+        if callable(total):
+            total = total()
+        if total is not None and self._page * self.limit >= int(total):
+            self._done = True
+            return
+        self._prev_first_id = first_id
+        self._page += 1
+
+    def _keep(self, bug):
+        ts = bug.timestamp
+        if ts > self._newest_ts:
+            self._newest_ts = ts
+            self._newest = {}
+        if ts == self._newest_ts:
+            self._newest.setdefault(bug.id, bug)
+        if not self.since or ts >= self.since:
+            self._seen.setdefault(bug.id, bug)
+
+    def bugs(self):
+        merged = dict(self._newest)
+        merged.update(self._seen)
+        return list(merged.values())
 
 
 class ZenTaoClient:
@@ -48,19 +317,144 @@ class ZenTaoClient:
     - 优先 v2（api.php/v2/users/login），适用于 21.7.8+
     - 若 v2 返回 404，尝试 v1（api.php/v1/tokens），适用于开源版 21.7.6
     - 若 v1 也不可用，使用传统 Session API（index.php?m=api&f=getSessionID 等）
+    api_version 可指定已知的接口版本："v2" / "v1" 只用该版本登录（不探测、不回退，接口不存在时登录失败），
+    "legacy" 等同 use_legacy=True。
+    同一进程内连接多个禅道实例时（见 sources.py），name 区分各实例的指标标签，
+    fetch_pool / hedge_pool 传入共享线程池，代替每个客户端各自的线程池。
     """
 
-    def __init__(self, base_url=None, account=None, password=None, api_key=None, use_legacy=None):
+    def __init__(self, base_url=None, account=None, password=None, api_key=None, use_legacy=None,
+                 fetch_workers=None, auth_cache_file=None, api_version=None, meta_cache_file=None, name=None,
+                 fetch_pool=None, hedge_pool=None):
         self.base_url = (base_url or Config.ZENTAO_BASE_URL).rstrip("/")
         self.account = account or Config.ZENTAO_ACCOUNT
         self.password = password or Config.ZENTAO_PASSWORD
         self.api_key = api_key or Config.ZENTAO_API_KEY
         self._use_legacy = use_legacy if use_legacy is not None else getattr(Config, "ZENTAO_USE_LEGACY_API", None)
+        if api_version == "legacy":
+            self._use_legacy = True
+        self._api_hint = api_version
+        self.name = name or ""
         self._token = None
         self._api_version = None  # "v1" | "v2"
         self._logged_in = False
+        self._login_gen = 0  # 每次登录成功 +1，并发重登时用于判断是否已被其他线程处理
+        self._login_lock = threading.RLock()
+        self.fetch_workers = max(1, int(fetch_workers or Config.ZENTAO_FETCH_WORKERS))
+        # 产品/模块/用户名称缓存，见 meta_cache.MetadataCache
+        self.meta = MetadataCache(self, path=meta_cache_file)
+        self.page_size = max(1, int(Config.ZENTAO_PAGE_SIZE))
+        self.auth_cache_file = Config.AUTH_CACHE_FILE if auth_cache_file is None else auth_cache_file
+        self._session_cookie = None  # 传统 Session 的 (name, id)
         self._session = requests.Session()
         self._session.headers["Content-Type"] = "application/json"
+        # 协商压缩传输：gzip、deflate，安装 brotli 时加上 br（以 urllib3 能解码的为准）
+        self._session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        cassette.install(self._session, "zentao")
+        self.timeout = float(Config.ZENTAO_TIMEOUT)
+        self.hedge_after = float(Config.ZENTAO_HEDGE_AFTER)
+        self.breaker = CircuitBreaker()
+        # 产品列表与 Bug 列表页的条件请求缓存，见 response_cache.ResponseCache
+        self.responses = ResponseCache()
+        self._local = threading.local()  # 当前线程正在拉取的产品的截止时间
+        self._hedge_pool = hedge_pool
+        self._fetch_pool = fetch_pool
+        self._hedge_lock = threading.Lock()
+        self._behind = set()  # 上一轮因截止时间跳过的产品，下一轮排在最前
+
+    def _timeout(self):
+        """单次请求的超时：ZENTAO_TIMEOUT 与当前截止时间剩余秒数中较小者；截止时间已到时不再发请求。"""
+        deadline = getattr(self._local, "deadline", None)
+        if deadline is None:
+            return self.timeout
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise ZenTaoDeadlineError("已超过本轮截止时间，跳过")
+        return min(self.timeout, remaining)
+
+    def _get_list(self, url, **kwargs):
+        """
+        拉取列表页（幂等 GET）。配置 ZENTAO_HEDGE_AFTER 时，超过该秒数未返回响应头则再发一次相同请求，
+        取先返回者，慢查询（长尾）的产品不再拖住整轮。
+        """
+        kwargs["timeout"] = self._timeout()
+        if self.hedge_after <= 0:
+            return self._session.get(url, **kwargs)
+        with self._hedge_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(
+                    max_workers=self.fetch_workers * 2, thread_name_prefix="zentao-hedge"
+                )
+        return hedged(self._hedge_pool, lambda: self._session.get(url, **kwargs), self.hedge_after,
+                      discard=lambda resp: resp.close())
+
+    def _conditional_get(self, url, params=None, stream=False):
+        """
+        带缓存校验信息的列表请求，返回 (缓存键, 缓存条目或 None, 响应)。
+        缓存条目有 ETag / Last-Modified 时带上 If-None-Match / If-Modified-Since，内容未变时服务端返回 304。
+        """
+        key = url + ("?" + urlencode(params) if params else "")
+        cached = self.responses.get(key)
+        headers = cached.validators() if cached is not None else None
+        return key, cached, self._get_list(url, params=params, headers=headers, stream=stream)
+
+    def _read_body(self, resp, key, cached):
+        """
+        服务端没有给出 ETag / Last-Modified 时边读边计算响应体哈希，与缓存条目 cached 相同则返回 (None, None)，
+        由调用方直接使用 cached；否则返回 (响应体分块, 哈希)。给出校验信息时不缓冲，返回 (流式分块, None)。
+        响应体超过 _CACHE_MAX_BODY（如服务端忽略了 limit）时不再缓冲，返回 (已读分块 + 剩余流式分块, None)，不写入缓存。
+        """
+        chunks = self._counted(resp)
+        if not self.responses.enabled or resp.headers.get("ETag") or resp.headers.get("Last-Modified"):
+            return chunks, None
+        hasher = body_hasher()
+        buffered = []
+        size = 0
+        try:
+            for chunk in chunks:
+                hasher.update(chunk)
+                buffered.append(chunk)
+                size += len(chunk)
+                if size > _CACHE_MAX_BODY:
+                    return itertools.chain(buffered, chunks), None
+        except BaseException:
+            resp.close()
+            raise
+        resp.close()
+        digest = hasher.digest()
+        if cached is not None and cached.digest == digest:
+            RESPONSE_CACHE.inc("unchanged")
+            return None, None
+        return buffered, digest
+
+    def _store(self, key, resp, digest, items, total=None):
+        if not self.responses.enabled:
+            return
+        RESPONSE_CACHE.inc("miss")
+        self.responses.put(key, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), digest, items, total)
+
+    def _guarded(self, key, fn, *args):
+        """经熔断器调用 fn：熔断冷却期内直接抛出 ZenTaoCircuitOpenError，截止时间导致的跳过不计入失败。"""
+        if not self.breaker.allow(key):
+            raise ZenTaoCircuitOpenError(f"{'/'.join(map(str, key))} 熔断中，跳过")
+        try:
+            result = fn(*args)
+        except ZenTaoDeadlineError:
+            self.breaker.record(key, None)
+            raise
+        except requests.Timeout as e:
+            deadline = getattr(self._local, "deadline", None)
+            if deadline is not None and time.monotonic() >= deadline:
+                # 超时被截止时间缩短：与直接跳过相同，不计入失败
+                self.breaker.record(key, None)
+                raise ZenTaoDeadlineError(f"已超过本轮截止时间，跳过: {e}") from e
+            self.breaker.record(key, False)
+            raise
+        except Exception:
+            self.breaker.record(key, False)
+            raise
+        self.breaker.record(key, True)
+        return result
 
     def _url(self, path):
         return urljoin(self.base_url + "/", path.lstrip("/"))
@@ -75,7 +469,7 @@ class ZenTaoClient:
             resp = self._session.post(
                 url,
                 json={"account": self.account, "password": password},
-                timeout=15,
+                timeout=self._timeout(),
             )
             if resp.status_code == 404:
                 return False
@@ -106,7 +500,7 @@ class ZenTaoClient:
             resp = self._session.post(
                 url,
                 json={"account": self.account, "password": password},
-                timeout=15,
+                timeout=self._timeout(),
             )
             if resp.status_code == 404:
                 return False
@@ -131,7 +525,7 @@ class ZenTaoClient:
         """传统 Session 登录（getSessionID + user-login）。"""
         get_session_url = self._url("index.php?m=api&f=getSessionID&t=json")
         try:
-            r = self._session.get(get_session_url, timeout=15)
+            r = self._session.get(get_session_url, timeout=self._timeout())
             r.raise_for_status()
             data = r.json()
         except requests.RequestException as e:
@@ -147,6 +541,7 @@ class ZenTaoClient:
 
         self._session.cookies.set(session_name, session_id, domain="", path="/")
         self._session.headers.pop("Token", None)
+        self._session_cookie = (session_name, session_id)
 
         login_url = self._url("index.php?m=user&f=login&t=json")
         password = self.password or self.api_key
@@ -156,7 +551,7 @@ class ZenTaoClient:
             r = self._session.post(
                 login_url,
                 data={"account": self.account, "password": password},
-                timeout=15,
+                timeout=self._timeout(),
             )
             r.raise_for_status()
             login_data = r.json()
@@ -171,6 +566,56 @@ class ZenTaoClient:
 
     def login(self):
         """登录：v2 -> v1 -> 传统 Session。"""
+        with self._login_lock:
+            start = time.monotonic()
+            try:
+                self._login()
+            except Exception:
+                ZENTAO_LOGINS.inc("none", "error")
+                raise
+            api = self._api_version or "legacy"
+            ZENTAO_LOGINS.inc(api, "ok")
+            ZENTAO_LOGIN_SECONDS.observe(api, value=time.monotonic() - start)
+            self._login_gen += 1
+            self._save_auth_cache()
+
+    def _save_auth_cache(self):
+        if not self.auth_cache_file or cassette.replaying():
+            return
+        if self._token:
+            save_auth(self.base_url, self.account, self._api_version, token=self._token, path=self.auth_cache_file)
+        elif self._session_cookie:
+            save_auth(self.base_url, self.account, "legacy", cookie=self._session_cookie, path=self.auth_cache_file)
+
+    def _restore_auth_cache(self):
+        """
+        从登录缓存恢复登录状态（不发请求）。缓存失效时由首个请求的认证失败触发完整登录探测。
+        录制 / 回放时不恢复：录制文件需包含登录请求才能回放，回放也不能用线上的登录状态。
+        """
+        if not self.auth_cache_file or cassette.active() is not None:
+            return False
+        entry = load_auth(self.base_url, self.account, path=self.auth_cache_file)
+        if not entry:
+            return False
+        if entry["api_version"] == "legacy":
+            if not entry.get("cookie") or self._api_hint in ("v1", "v2"):
+                return False
+            name, value = entry["cookie"]
+            self._session.cookies.set(name, value, domain="", path="/")
+            self._session_cookie = (name, value)
+        else:
+            if self._use_legacy is True or not entry.get("token"):
+                return False
+            if self._api_hint in ("v1", "v2") and entry["api_version"] != self._api_hint:
+                return False
+            self._token = entry["token"]
+            self._session.headers["Token"] = self._token
+            self._api_version = entry["api_version"]
+        self._logged_in = True
+        logger.info("复用缓存的禅道登录状态（%s）", entry["api_version"])
+        return True
+
+    def _login(self):
         if not self.base_url or not self.account:
             raise ZenTaoClientError("未配置 ZENTAO_BASE_URL 或 ZENTAO_ACCOUNT")
 
@@ -178,216 +623,508 @@ class ZenTaoClient:
             self._legacy_login()
             return
 
-        try:
-            if self._try_v2_login():
-                logger.info("禅道 REST v2 登录成功")
-                return
-        except ZenTaoClientError:
-            raise
+        if self._api_hint != "v1":
+            try:
+                if self._try_v2_login():
+                    logger.info("禅道 REST v2 登录成功")
+                    return
+            except ZenTaoClientError:
+                raise
 
-        try:
-            if self._try_v1_login():
-                return
-        except ZenTaoClientError:
-            raise
+        if self._api_hint != "v2":
+            try:
+                if self._try_v1_login():
+                    return
+            except ZenTaoClientError:
+                raise
 
+        if self._api_hint in ("v1", "v2"):
+            # 指定了接口版本时不回退到其他版本
+            raise ZenTaoClientError(f"禅道未提供 REST {self._api_hint} 接口（404），请检查实例配置的 api")
         logger.info("未检测到 REST v1/v2，改用传统 Session API")
         self._legacy_login()
 
     def _ensure_login(self):
         if not self._logged_in:
-            self.login()
+            with self._login_lock:
+                if not self._logged_in:
+                    if self._restore_auth_cache():
+                        self._login_gen += 1
+                    else:
+                        self.login()
+
+    def _relogin(self, seen_gen):
+        """
+        认证失效后重登。seen_gen 为发起请求时的 _login_gen；
+        多个线程同时遇到 ZenTaoAuthError 时只有第一个真正重登，其余直接复用新登录状态。
+        """
+        with self._login_lock:
+            if self._login_gen == seen_gen:
+                ZENTAO_RELOGINS.inc()
+                self._clear_login()
+                self.login()
 
     def _clear_login(self):
         """清空登录状态（token 失效时调用，便于重试时重新登录）。"""
         self._logged_in = False
         self._token = None
+        self._api_version = None
+        self._session_cookie = None
         self._session.headers.pop("Token", None)
 
     def _is_auth_fail(self, status_code, data):
         """判断是否为认证/授权失败，需重登。"""
-        if status_code == 401:
-            return True
-        if status_code == 403:
-            return True
-        if not isinstance(data, dict):
-            return False
-        if data.get("status") == "fail":
-            msg = (data.get("message") or data.get("msg") or "").lower()
-            if "token" in msg or "登录" in msg or "auth" in msg or "unauthorized" in msg:
-                return True
-        return False
+        return _auth_failed(status_code, data)
 
     def _v2_get_products(self):
-        url = self._url("api.php/v2/products")
-        resp = self._session.get(url, timeout=15)
-        try:
-            data = resp.json()
-        except ValueError:
-            data = {}
-        if self._is_auth_fail(resp.status_code, data):
-            self._clear_login()
-            raise ZenTaoAuthError("认证失效，请重新登录")
-        resp.raise_for_status()
-        if data.get("status") != "success":
-            raise ZenTaoClientError(data.get("message", "获取产品列表失败"))
-        products = data.get("products") or []
-        return [{"id": str(p.get("id", "")), "name": p.get("name", "")} for p in products]
+        return self._rest_get_products("v2")
 
     def _v1_get_products(self):
-        url = self._url("api.php/v1/products")
-        resp = self._session.get(url, timeout=15)
+        return self._rest_get_products("v1")
+
+    def _rest_get_products(self, version):
+        key, cached, resp = self._conditional_get(self._url(f"api.php/{version}/products"), stream=True)
+        if resp.status_code == 304 and cached is not None:
+            resp.close()
+            RESPONSE_CACHE.inc("not_modified")
+            return [dict(p) for p in cached.items]
+        if resp.status_code == 200:
+            chunks, digest = self._read_body(resp, key, cached)
+            if chunks is None:
+                return [dict(p) for p in cached.items]
+            body = b"".join(chunks)
+        else:
+            body = resp.content
         try:
-            data = resp.json()
+            data = json.loads(body)
         except ValueError:
             data = {}
         if self._is_auth_fail(resp.status_code, data):
-            self._clear_login()
             raise ZenTaoAuthError("认证失效，请重新登录")
         resp.raise_for_status()
-        if data.get("status") != "success":
-            raise ZenTaoClientError(data.get("message", "获取产品列表失败"))
-        products = data.get("products") or []
-        return [{"id": str(p.get("id", "")), "name": p.get("name", "")} for p in products]
+        products = _parse_rest_products(data)
+        if resp.status_code == 200:
+            self._store(key, resp, digest, [dict(p) for p in products])
+        return products
+
+    def _rest_get_bugs_page(self, version, product_id, page, limit, order):
+        """
+        REST v1/v2 分页拉取一页 Bug，返回 (Bug 迭代器, total)。
+        成功响应按流式解析 bugs 数组，total 在迭代完后求值。
+        """
+        url = self._url(f"api.php/{version}/products/{product_id}/bugs")
+        key, cached, resp = self._conditional_get(url, {"page": page, "limit": limit, "order": order}, stream=True)
+        if resp.status_code == 304 and cached is not None:
+            resp.close()
+            RESPONSE_CACHE.inc("not_modified")
+            return cached.items, cached.total
+        if resp.status_code != 200:
+            try:
+                data = resp.json()
+            except ValueError:
+                data = {}
+            if self._is_auth_fail(resp.status_code, data):
+                raise ZenTaoAuthError("认证失效，请重新登录")
+            resp.raise_for_status()
+            return _parse_rest_bugs_page(data)
+
+        def invalid(meta):
+            meta.clear()
 
-    def _v2_get_bugs_for_product(self, product_id):
-        url = self._url(f"api.php/v2/products/{product_id}/bugs")
-        resp = self._session.get(url, timeout=15)
+        def check(meta):
+            if self._is_auth_fail(resp.status_code, meta):
+                raise ZenTaoAuthError("认证失效，请重新登录")
+            _check_rest_bugs_status(meta)
+
+        return self._bugs_page(resp, key, cached, limit, ("bugs",), invalid, check, lambda meta: meta.get("total"))
+
+    def _bugs_page(self, resp, key, cached, limit, path, invalid, check, total_of):
+        """
+        流式解析一页 Bug 列表（path 为 bugs 数组在 JSON 中的位置），边解析边归一化，返回 (Bug 迭代器, total)。
+        解析完整页且 check 通过后写入缓存：有 ETag / Last-Modified 时保存 Bug 供 304 复用；
+        没有时边解析边计算响应体哈希，只记录哈希（无法 304，不保存 Bug），不为比对哈希预先缓冲响应体。
+        超过 limit 条（服务端忽略了 limit）时不保留、不缓存，内存占用不随产品 Bug 总数增长。
+        invalid(meta) 处理 JSON 无法解析的情况，check(meta) 检查响应状态。
+        """
+        chunks = self._counted(resp)
+        meta = {}
+        hasher = None
+        items = None
+        if self.responses.enabled:
+            if resp.headers.get("ETag") or resp.headers.get("Last-Modified"):
+                items = []
+            else:
+                hasher = body_hasher()
+
+        def hashed():
+            for chunk in chunks:
+                hasher.update(chunk)
+                yield chunk
+
+        def bugs():
+            nonlocal items
+            count = 0
+            try:
+                for raw in iter_json_items(hashed() if hasher else chunks, path, meta):
+                    bug = _normalize_bug(raw)
+                    count += 1
+                    if items is not None:
+                        if len(items) < limit:
+                            items.append(bug)
+                        else:
+                            items = None
+                    yield bug
+            except ValueError:
+                invalid(meta)
+            finally:
+                resp.close()
+            check(meta)
+            if items is not None:
+                self._store(key, resp, None, items, total_of(meta))
+            elif hasher is not None and count <= limit:
+                digest = hasher.digest()
+                if cached is not None and cached.digest == digest:
+                    RESPONSE_CACHE.inc("unchanged")
+                else:
+                    self._store(key, resp, digest, (), total_of(meta))
+
+        return bugs(), lambda: total_of(meta)
+
+    def _counted(self, resp):
+        """逐块读取响应体，累计当前线程从连接读取的字节数（压缩传输时为压缩后的字节数，用于按产品统计拉取流量）。"""
+        size = 0
         try:
-            data = resp.json()
-        except ValueError:
-            data = {}
-        if self._is_auth_fail(resp.status_code, data):
-            self._clear_login()
+            for chunk in resp.iter_content(_STREAM_CHUNK):
+                size += len(chunk)
+                yield chunk
+        finally:
+            tell = getattr(resp.raw, "tell", None)
+            try:
+                size = tell() if tell is not None else size
+            except Exception:
+                pass
+            self._local.bytes = getattr(self._local, "bytes", 0) + size
+
+    def _v2_get_bugs_for_product(self, product_id, since=None):
+        return self._paginate_bugs(
+            lambda page, limit, order: self._rest_get_bugs_page("v2", product_id, page, limit, order), since
+        )
+
+    def _v1_get_bugs_for_product(self, product_id, since=None):
+        return self._paginate_bugs(
+            lambda page, limit, order: self._rest_get_bugs_page("v1", product_id, page, limit, order), since
+        )
+
+    def _legacy_json(self, resp):
+        """解析传统 API 响应：401/403、非 JSON（被重定向到登录页）或明确的认证失败视为 Session 失效。"""
+        if resp.status_code in (401, 403):
             raise ZenTaoAuthError("认证失效，请重新登录")
         resp.raise_for_status()
-        if data.get("status") != "success":
-            raise ZenTaoClientError(data.get("message", "获取 Bug 列表失败"))
-        return data.get("bugs") or []
-
-    def _v1_get_bugs_for_product(self, product_id):
-        url = self._url(f"api.php/v1/products/{product_id}/bugs")
-        resp = self._session.get(url, timeout=15)
         try:
             data = resp.json()
         except ValueError:
-            data = {}
+            raise ZenTaoAuthError("传统 Session 失效，请重新登录")
         if self._is_auth_fail(resp.status_code, data):
-            self._clear_login()
             raise ZenTaoAuthError("认证失效，请重新登录")
-        resp.raise_for_status()
-        if data.get("status") != "success":
-            raise ZenTaoClientError(data.get("message", "获取 Bug 列表失败"))
-        return data.get("bugs") or []
+        return data
 
     def _legacy_get_products(self):
         url = self._url("index.php?m=product&f=getList&t=json")
         try:
-            resp = self._session.get(url, timeout=15)
+            resp = self._session.get(url, timeout=self._timeout())
             resp.raise_for_status()
             data = resp.json()
         except requests.RequestException:
             return self._legacy_get_products_from_bugs()
-        result = data.get("result")
-        if result is None:
+        products = _parse_legacy_products(data)
+        if products is None:
             return self._legacy_get_products_from_bugs()
-        if isinstance(result, list):
-            return [{"id": str(p.get("id", "")), "name": p.get("name", "")} for p in result]
-        if isinstance(result, dict):
-            return [{"id": str(k), "name": v} for k, v in result.items() if k and v]
-        return self._legacy_get_products_from_bugs()
+        return products
 
     def _legacy_get_products_from_bugs(self):
-        url = self._url("index.php?m=bug&f=getList&t=json&productID=1&branch=0")
-        resp = self._session.get(url, timeout=15)
-        resp.raise_for_status()
-        data = resp.json()
-        result = data.get("result") or {}
-        products = result.get("products") if isinstance(result, dict) else {}
-        if not products:
-            return [{"id": "1", "name": "默认产品"}]
-        return [{"id": str(k), "name": v} for k, v in products.items()]
-
-    def _legacy_get_bugs_for_product(self, product_id):
-        url = self._url(f"index.php?m=bug&f=getList&t=json&productID={product_id}&branch=0")
-        resp = self._session.get(url, timeout=15)
+        # 只需要 result.products，每页 1 条即可，不下载整个 Bug 列表
+        url = self._url(_legacy_bugs_path(1, 1, 1, "id_desc"))
+        resp = self._session.get(url, timeout=self._timeout())
+        return _parse_legacy_products_from_bugs(self._legacy_json(resp))
+
+    def _legacy_get_bugs_page(self, product_id, page, limit, order):
+        """传统 API 分页拉取一页 Bug（recPerPage/pageID），返回 (Bug 迭代器, total)，流式解析 result.bugs。"""
+        url = self._url(_legacy_bugs_path(product_id, page, limit, order))
+        key, cached, resp = self._conditional_get(url, stream=True)
+        if resp.status_code == 304 and cached is not None:
+            resp.close()
+            RESPONSE_CACHE.inc("not_modified")
+            return cached.items, cached.total
+        if resp.status_code in (401, 403):
+            resp.close()
+            raise ZenTaoAuthError("认证失效，请重新登录")
         resp.raise_for_status()
-        data = resp.json()
-        if data.get("status") == 0 or data.get("msg") == "error":
-            raise ZenTaoClientError(data.get("msg", data.get("message", "获取 Bug 列表失败")))
-        result = data.get("result")
-        if not isinstance(result, dict):
-            return []
-        bugs = result.get("bugs") or []
-        return [_normalize_bug(b) for b in bugs]
+
+        def invalid(meta):
+            raise ZenTaoAuthError("传统 Session 失效，请重新登录")
+
+        def check(meta):
+            if self._is_auth_fail(resp.status_code, meta):
+                raise ZenTaoAuthError("认证失效，请重新登录")
+            _check_legacy_bugs_status(meta)
+
+        return self._bugs_page(resp, key, cached, limit, ("result", "bugs"), invalid, check, _legacy_bugs_total)
+
+    def _legacy_get_bugs_for_product(self, product_id, since=None):
+        return self._paginate_bugs(
+            lambda page, limit, order: self._legacy_get_bugs_page(product_id, page, limit, order), since
+        )
+
+    def _paginate_bugs(self, fetch_page, since=None):
+        """分页拉取并归一化一个产品的 Bug，翻页与提前停止规则见 BugPager。"""
+        pager = BugPager(since, self.page_size)
+        while True:
+            req = pager.next_request()
+            if req is None:
+                return pager.bugs()
+            pager.feed(*fetch_page(*req))
 
     def get_products(self):
+        return self._guarded(("products",), self._call, self._get_products)
+
+    def _call(self, fn, *args):
+        """登录后调用 fn；认证失效时重登（并发时只重登一次）后再试一次。"""
         self._ensure_login()
+        gen = self._login_gen
         try:
-            if self._api_version == "v1":
-                return self._v1_get_products()
-            if self._token:
-                return self._v2_get_products()
-            return self._legacy_get_products()
+            return fn(*args)
         except ZenTaoAuthError:
-            self.login()
-            if self._api_version == "v1":
-                return self._v1_get_products()
-            if self._token:
-                return self._v2_get_products()
-            return self._legacy_get_products()
-
-    def get_bugs_for_product(self, product_id):
+            self._relogin(gen)
+            return fn(*args)
+
+    def _get_products(self):
+        if self._api_version == "v1":
+            return self._v1_get_products()
+        if self._token:
+            return self._v2_get_products()
+        return self._legacy_get_products()
+
+    def get_modules(self, product_id):
+        """该产品的 Bug 模块 {module_id: name}（REST GET /modules?type=bug&id=产品 ID）；传统 API 返回空。"""
         self._ensure_login()
+        if not self._token:
+            return {}
+        gen = self._login_gen
         try:
-            if self._api_version == "v1":
-                raw = self._v1_get_bugs_for_product(product_id)
-            elif self._token:
-                raw = self._v2_get_bugs_for_product(product_id)
-            else:
-                return self._legacy_get_bugs_for_product(product_id)
-            return [_normalize_bug(b) for b in raw]
+            return self._rest_get_modules(product_id)
+        except ZenTaoAuthError:
+            self._relogin(gen)
+            return self._rest_get_modules(product_id)
+
+    def _rest_get_modules(self, product_id):
+        url = self._url(f"api.php/{self._api_version or 'v2'}/modules")
+        resp = self._session.get(url, params={"type": "bug", "id": product_id}, timeout=self._timeout())
+        try:
+            data = resp.json()
+        except ValueError:
+            data = {}
+        if self._is_auth_fail(resp.status_code, data):
+            raise ZenTaoAuthError("认证失效，请重新登录")
+        resp.raise_for_status()
+        return _parse_rest_modules(data)
+
+    def get_users(self):
+        """用户 {account: realname}（REST GET /users 分页拉取）；传统 API 返回空。"""
+        self._ensure_login()
+        if not self._token:
+            return {}
+        gen = self._login_gen
+        try:
+            return self._rest_get_users()
         except ZenTaoAuthError:
-            self.login()
-            if self._api_version == "v1":
-                raw = self._v1_get_bugs_for_product(product_id)
-            elif self._token:
-                raw = self._v2_get_bugs_for_product(product_id)
+            self._relogin(gen)
+            return self._rest_get_users()
+
+    def _rest_get_users(self):
+        url = self._url(f"api.php/{self._api_version or 'v2'}/users")
+        users = {}
+        limit = 500
+        for page in range(1, 101):
+            resp = self._session.get(url, params={"page": page, "limit": limit}, timeout=self._timeout())
+            try:
+                data = resp.json()
+            except ValueError:
+                data = {}
+            if self._is_auth_fail(resp.status_code, data):
+                raise ZenTaoAuthError("认证失效，请重新登录")
+            resp.raise_for_status()
+            batch, total = _parse_rest_users(data)
+            users.update(batch)
+            if len(batch) < limit or (total is not None and page * limit >= int(total)):
+                break
+        return users
+
+    def get_bugs_for_product(self, product_id, since=None):
+        """
+        拉取单个产品的 Bug（已归一化）。传入 since 时翻页到整页早于 since 即停止，早于 since 的 Bug 除变更时间最大的一批外不返回。
+        该产品连续失败时熔断一段时间，期间抛出 ZenTaoCircuitOpenError。
+        """
+        return self._guarded(("bugs", str(product_id)), self._call, self._get_bugs_for_product, product_id, since)
+
+    def _get_bugs_for_product(self, product_id, since=None):
+        if self._api_version == "v1":
+            return self._v1_get_bugs_for_product(product_id, since)
+        if self._token:
+            return self._v2_get_bugs_for_product(product_id, since)
+        return self._legacy_get_bugs_for_product(product_id, since)
+
+    def get_bugs_by_product(self, product_ids, workers=None, since=None):
+        """
+        拉取多个产品的 Bug。workers > 1 时用线程池并发拉取，共享同一登录状态。
+        since 可为字符串（所有产品相同）或 {product_id: since} 字典（按产品水位线）。
+        返回 (bugs_by_pid, errors_by_pid)：单个产品失败只记入 errors，不影响其他产品。
+        """
+        bugs_by_pid = {}
+        errors = {}
+        for pid, bugs, error in self.iter_bugs_by_product(product_ids, workers=workers, since=since):
+            if error is None:
+                bugs_by_pid[pid] = bugs
             else:
-                return self._legacy_get_bugs_for_product(product_id)
-            return [_normalize_bug(b) for b in raw]
+                errors[pid] = error
+        return bugs_by_pid, errors
+
+    def iter_bugs_by_product(self, product_ids, workers=None, since=None, deadline=None):
+        """
+        按完成顺序逐个产出 (product_id, bugs, error)，拉取成功时 error 为 None，失败时 bugs 为 None。
+        已拉取但未被消费的结果最多缓存 workers 个，消费方处理慢时拉取线程会阻塞等待（背压），
+        内存中同时存在的产品 Bug 列表数有上限。提前关闭生成器时停止领取新产品，并等待已在拉取的产品结束后才返回
+        （共享线程池时不会与下一轮或其他实例的拉取重叠）。
+        deadline 为本轮总预算秒数（默认 ZENTAO_ROUND_DEADLINE，0 不限制）：每个产品开始时按剩余时间与
+        剩余产品数分到一份（至少一次请求超时），超出的请求缩短超时或直接跳过（ZenTaoDeadlineError）；
+        被跳过的产品下一次调用时排在最前，不会每轮都是末尾的同一批产品超时。
+        """
+        self._ensure_login()
+        product_ids = sorted(product_ids, key=lambda pid: pid not in self._behind)
+        since_by_pid = since if isinstance(since, dict) else {pid: since for pid in product_ids}
+        workers = min(max(1, int(workers or self.fetch_workers)), len(product_ids) or 1)
+        deadline = Config.ZENTAO_ROUND_DEADLINE if deadline is None else deadline
+        round_deadline = time.monotonic() + deadline if deadline else None
+        if workers <= 1:
+            for i, pid in enumerate(product_ids):
+                yield self._fetch_product(pid, since_by_pid.get(pid), round_deadline, len(product_ids) - i, 1)
+            return
+
+        todo = queue.Queue()
+        for pid in product_ids:
+            todo.put(pid)
+        results = queue.Queue(maxsize=workers)
+        stop = threading.Event()
+
+        def fetch_loop():
+            while not stop.is_set():
+                try:
+                    pid = todo.get_nowait()
+                except queue.Empty:
+                    return
+                item = self._fetch_product(pid, since_by_pid.get(pid), round_deadline, todo.qsize() + 1, workers)
+                while not stop.is_set():
+                    try:
+                        results.put(item, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+
+        if self._fetch_pool is not None:
+            pool_context = contextlib.nullcontext(self._fetch_pool)
+        else:
+            pool_context = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="zentao-fetch")
+        with pool_context as pool:
+            futures = [pool.submit(fetch_loop) for _ in range(workers)]
+            try:
+                for _ in product_ids:
+                    yield results.get()
+            finally:
+                stop.set()
+                for future in futures:
+                    future.cancel()
+                wait(futures)
+
+    def _fetch_product(self, pid, since, round_deadline, left, workers):
+        """拉取一个产品，返回 (pid, bugs, error)。left 为尚未开始的产品数（含本产品），用于分配截止时间。"""
+        if round_deadline is not None:
+            now = time.monotonic()
+            remaining = round_deadline - now
+            share = remaining * workers / max(1, left)
+            self._local.deadline = now + min(remaining, max(share, self.timeout))
+        self._local.bytes = 0
+        start = time.monotonic()
+        try:
+            bugs = self.get_bugs_for_product(pid, since)
+        except Exception as e:
+            ZENTAO_FETCH_FAILURES.inc(self._product_label(pid), _failure_reason(e))
+            if isinstance(e, ZenTaoDeadlineError):
+                self._behind.add(pid)
+            else:
+                self._behind.discard(pid)
+            return pid, None, e
+        finally:
+            self._local.deadline = None
+        self._behind.discard(pid)
+        label = self._product_label(pid)
+        ZENTAO_FETCH_SECONDS.observe(label, value=time.monotonic() - start)
+        ZENTAO_FETCH_BYTES.observe(label, value=self._local.bytes)
+        return pid, bugs, None
+
+    def _product_label(self, pid):
+        """指标中的产品标签：多个禅道实例时加上实例名，如 main/1。"""
+        return f"{self.name}/{pid}" if self.name else str(pid)
 
     def get_bugs_since(self, since_iso_datetime=None, product_ids=None):
+        """
+        拉取多个产品自 since 以来的 Bug 并合并返回。单个产品失败（含熔断、超出本轮截止时间）只记录日志，
+        返回其余产品的结果。
+        """
         self._ensure_login()
         if product_ids is None:
-            products = self.get_products()
-            product_ids = [p["id"] for p in products]
+            product_ids = [p["id"] for p in self.meta.products()]
         if not product_ids:
             return []
 
+        bugs_by_pid, errors = self.get_bugs_by_product(product_ids, since=since_iso_datetime)
+        for pid, e in errors.items():
+            logger.warning("拉取产品 %s 的 Bug 失败，跳过: %s", pid, e)
         all_bugs = []
         for pid in product_ids:
-            try:
-                bugs = self.get_bugs_for_product(pid)
-                all_bugs.extend(bugs)
-            except ZenTaoClientError:
-                raise
-            except Exception as e:
-                logger.warning("拉取产品 %s 的 Bug 时出错: %s", pid, e)
+            all_bugs.extend(bugs_by_pid.get(pid) or [])
 
         if not since_iso_datetime:
             return all_bugs
 
-        since = (since_iso_datetime or "").strip()
-        result = []
-        for b in all_bugs:
-            opened = (b.get("openedDate") or "").strip()
-            last_edited = (b.get("lastEditedDate") or "").strip()
-            if opened and opened >= since:
-                result.append(b)
-            elif last_edited and last_edited >= since:
-                result.append(b)
-        return result
+        since = parse_date(since_iso_datetime)
+        return [b for b in all_bugs if b.timestamp >= since]
+
+    def _get_bug(self, bug_id):
+        if self._token:
+            url = self._url(f"api.php/{self._api_version or 'v2'}/bugs/{bug_id}")
+            resp = self._session.get(url, timeout=self._timeout())
+            try:
+                data = resp.json()
+            except ValueError:
+                data = {}
+            if self._is_auth_fail(resp.status_code, data):
+                raise ZenTaoAuthError("认证失效，请重新登录")
+            if resp.status_code == 404:
+                return None
+            resp.raise_for_status()
+        else:
+            resp = self._session.get(self._url(f"index.php?m=bug&f=view&t=json&bugID={bug_id}"), timeout=self._timeout())
+            data = self._legacy_json(resp)
+        return _parse_bug_detail(data)
+
+    def get_bug(self, bug_id):
+        """按 ID 获取单个 Bug（已归一化），不存在时返回 None。"""
+        self._ensure_login()
+        gen = self._login_gen
+        try:
+            return self._get_bug(bug_id)
+        except ZenTaoAuthError:
+            self._relogin(gen)
+            return self._get_bug(bug_id)
 
     def bug_view_url(self, bug_id):
         return self._url(f"bug-view-{bug_id}.html")
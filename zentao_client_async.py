@@ -0,0 +1,315 @@
+"""
+禅道 API 异步客户端（asyncio + aiohttp）：与 ZenTaoClient 相同的 v2 / v1 / 传统 Session 登录探测及产品、Bug 列表
+"""
+import asyncio
+import logging
+from urllib.parse import urljoin
+
+import aiohttp
+from yarl import URL
+
+from auth_cache import load_auth, save_auth
+from config import Config
+from zentao_client import (
+    BugPager,
+    ZenTaoAuthError,
+    ZenTaoClientError,
+    _auth_failed,
+    _legacy_bugs_path,
+    _parse_legacy_bugs_page,
+    _parse_legacy_products,
+    _parse_legacy_products_from_bugs,
+    _parse_rest_bugs_page,
+    _parse_rest_products,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncZenTaoClient:
+    """
+    禅道异步客户端。所有请求经同一个信号量（ZENTAO_ASYNC_CONCURRENCY）限流，
+    多个产品并发拉取时共享登录状态，认证失效只重登一次。
+    """
+
+    def __init__(self, base_url=None, account=None, password=None, api_key=None, use_legacy=None,
+                 concurrency=None, auth_cache_file=None):
+        self.base_url = (base_url or Config.ZENTAO_BASE_URL).rstrip("/")
+        self.account = account or Config.ZENTAO_ACCOUNT
+        self.password = password or Config.ZENTAO_PASSWORD
+        self.api_key = api_key or Config.ZENTAO_API_KEY
+        self._use_legacy = use_legacy if use_legacy is not None else getattr(Config, "ZENTAO_USE_LEGACY_API", None)
+        self.concurrency = max(1, int(concurrency or Config.ZENTAO_ASYNC_CONCURRENCY))
+        self.page_size = max(1, int(Config.ZENTAO_PAGE_SIZE))
+        self.auth_cache_file = Config.AUTH_CACHE_FILE if auth_cache_file is None else auth_cache_file
+        self._session_cookie = None
+        self._token = None
+        self._api_version = None  # "v1" | "v2"
+        self._logged_in = False
+        self._login_gen = 0
+        self._login_lock = asyncio.Lock()
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self._headers = {}
+        self._session = None
+
+    def _url(self, path):
+        return urljoin(self.base_url + "/", path.lstrip("/"))
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency),
+                cookie_jar=aiohttp.CookieJar(unsafe=True),
+                timeout=aiohttp.ClientTimeout(total=Config.ZENTAO_TIMEOUT),
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, method, path, **kwargs):
+        """发送请求，返回 (status, data)；响应体不是 JSON 时 data 为 None。"""
+        async with self._sem:
+            try:
+                async with self._get_session().request(
+                    method, self._url(path), headers=self._headers, **kwargs
+                ) as resp:
+                    try:
+                        data = await resp.json(content_type=None)
+                    except ValueError:
+                        return resp.status, None
+                    return resp.status, data if isinstance(data, dict) else {}
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise ZenTaoClientError(f"请求 {path} 失败: {e}") from e
+
+    def _password(self):
+        password = self.password or self.api_key
+        if not password:
+            raise ZenTaoClientError("未配置 ZENTAO_PASSWORD 或 ZENTAO_API_KEY")
+        return password
+
+    async def _try_rest_login(self, version):
+        """REST v1/v2 登录。成功返回 True，404 返回 False。"""
+        path = "api.php/v2/users/login" if version == "v2" else "api.php/v1/tokens"
+        status, data = await self._request("POST", path, json={"account": self.account, "password": self._password()})
+        data = data or {}
+        if status == 404:
+            return False
+        if status >= 400:
+            raise ZenTaoClientError(f"{version} 登录请求失败: HTTP {status}")
+        if version == "v2" and data.get("status") != "success":
+            raise ZenTaoClientError(data.get("message", "登录失败"))
+        token = data.get("token")
+        if not token:
+            raise ZenTaoClientError(f"{version} 登录响应中无 token")
+        self._token = token
+        self._headers["Token"] = token
+        self._api_version = version
+        self._logged_in = True
+        logger.info("禅道 REST %s 登录成功", version)
+        return True
+
+    async def _legacy_login(self):
+        """传统 Session 登录（getSessionID + user-login）。"""
+        status, data = await self._request("GET", "index.php?m=api&f=getSessionID&t=json")
+        data = data or {}
+        if status >= 400:
+            raise ZenTaoClientError(f"getSessionID 失败: HTTP {status}")
+        if data.get("status") != "success":
+            raise ZenTaoClientError(data.get("message", "getSessionID 失败"))
+        inner = data.get("data") or data
+        session_name = inner.get("sessionName") or "zentaosid"
+        session_id = inner.get("sessionID")
+        if not session_id:
+            raise ZenTaoClientError("getSessionID 未返回 sessionID")
+        self._get_session().cookie_jar.update_cookies({session_name: session_id}, URL(self.base_url + "/"))
+        self._headers.pop("Token", None)
+        self._session_cookie = (session_name, session_id)
+
+        status, login_data = await self._request(
+            "POST", "index.php?m=user&f=login&t=json", data={"account": self.account, "password": self._password()}
+        )
+        login_data = login_data or {}
+        if status >= 400:
+            raise ZenTaoClientError(f"登录失败: HTTP {status}")
+        if login_data.get("status") == "fail" or login_data.get("status") == 0:
+            raise ZenTaoClientError(login_data.get("message", login_data.get("msg", "登录失败")))
+        self._logged_in = True
+        logger.info("禅道传统 Session 登录成功")
+
+    async def login(self):
+        """登录：v2 -> v1 -> 传统 Session。"""
+        async with self._login_lock:
+            await self._login()
+            self._login_gen += 1
+            self._save_auth_cache()
+
+    def _save_auth_cache(self):
+        if not self.auth_cache_file:
+            return
+        if self._token:
+            save_auth(self.base_url, self.account, self._api_version, token=self._token, path=self.auth_cache_file)
+        elif self._session_cookie:
+            save_auth(self.base_url, self.account, "legacy", cookie=self._session_cookie, path=self.auth_cache_file)
+
+    def _restore_auth_cache(self):
+        """从登录缓存恢复登录状态（不发请求），规则同 ZenTaoClient._restore_auth_cache。"""
+        if not self.auth_cache_file:
+            return False
+        entry = load_auth(self.base_url, self.account, path=self.auth_cache_file)
+        if not entry:
+            return False
+        if entry["api_version"] == "legacy":
+            if not entry.get("cookie"):
+                return False
+            name, value = entry["cookie"]
+            self._get_session().cookie_jar.update_cookies({name: value}, URL(self.base_url + "/"))
+            self._session_cookie = (name, value)
+        else:
+            if self._use_legacy is True or not entry.get("token"):
+                return False
+            self._token = entry["token"]
+            self._headers["Token"] = self._token
+            self._api_version = entry["api_version"]
+        self._logged_in = True
+        logger.info("复用缓存的禅道登录状态（%s）", entry["api_version"])
+        return True
+
+    async def _login(self):
+        if not self.base_url or not self.account:
+            raise ZenTaoClientError("未配置 ZENTAO_BASE_URL 或 ZENTAO_ACCOUNT")
+        if self._use_legacy is True:
+            await self._legacy_login()
+            return
+        if await self._try_rest_login("v2"):
+            return
+        if await self._try_rest_login("v1"):
+            return
+        logger.info("未检测到 REST v1/v2，改用传统 Session API")
+        await self._legacy_login()
+
+    async def _ensure_login(self):
+        if not self._logged_in:
+            async with self._login_lock:
+                if not self._logged_in:
+                    if self._restore_auth_cache():
+                        self._login_gen += 1
+                    else:
+                        await self._login()
+                        self._login_gen += 1
+                        self._save_auth_cache()
+
+    async def _relogin(self, seen_gen):
+        """认证失效后重登；并发请求同时失效时只有第一个真正重登。"""
+        async with self._login_lock:
+            if self._login_gen == seen_gen:
+                self._logged_in = False
+                self._token = None
+                self._api_version = None
+                self._session_cookie = None
+                self._headers.pop("Token", None)
+                await self._login()
+                self._login_gen += 1
+                self._save_auth_cache()
+
+    async def _rest_get(self, path, params=None):
+        status, data = await self._request("GET", path, params=params)
+        data = data or {}
+        if _auth_failed(status, data):
+            raise ZenTaoAuthError("认证失效，请重新登录")
+        if status >= 400:
+            raise ZenTaoClientError(f"请求 {path} 失败: HTTP {status}")
+        return data
+
+    async def _legacy_get(self, path):
+        """传统 API：401/403、非 JSON（被重定向到登录页）或明确的认证失败视为 Session 失效。"""
+        status, data = await self._request("GET", path)
+        if status in (401, 403):
+            raise ZenTaoAuthError("认证失效，请重新登录")
+        if status >= 400:
+            raise ZenTaoClientError(f"请求 {path} 失败: HTTP {status}")
+        if data is None:
+            raise ZenTaoAuthError("传统 Session 失效，请重新登录")
+        if _auth_failed(status, data):
+            raise ZenTaoAuthError("认证失效，请重新登录")
+        return data
+
+    async def _get_products(self):
+        if self._api_version in ("v1", "v2") and self._token:
+            return _parse_rest_products(await self._rest_get(f"api.php/{self._api_version}/products"))
+        try:
+            products = _parse_legacy_products(await self._legacy_get("index.php?m=product&f=getList&t=json"))
+        except ZenTaoAuthError:
+            raise
+        except ZenTaoClientError:
+            products = None
+        if products is None:
+            # 只需要 result.products，每页 1 条即可，不下载整个 Bug 列表
+            data = await self._legacy_get(_legacy_bugs_path(1, 1, 1, "id_desc"))
+            products = _parse_legacy_products_from_bugs(data)
+        return products
+
+    async def get_products(self):
+        await self._ensure_login()
+        gen = self._login_gen
+        try:
+            return await self._get_products()
+        except ZenTaoAuthError:
+            await self._relogin(gen)
+            return await self._get_products()
+
+    async def _get_bugs_page(self, product_id, page, limit, order):
+        if self._api_version in ("v1", "v2") and self._token:
+            data = await self._rest_get(
+                f"api.php/{self._api_version}/products/{product_id}/bugs",
+                params={"page": page, "limit": limit, "order": order},
+            )
+            return _parse_rest_bugs_page(data)
+        return _parse_legacy_bugs_page(await self._legacy_get(_legacy_bugs_path(product_id, page, limit, order)))
+
+    async def _get_bugs_for_product(self, product_id, since=None):
+        pager = BugPager(since, self.page_size)
+        while True:
+            req = pager.next_request()
+            if req is None:
+                return pager.bugs()
+            pager.feed(*await self._get_bugs_page(product_id, *req))
+
+    async def get_bugs_for_product(self, product_id, since=None):
+        await self._ensure_login()
+        gen = self._login_gen
+        try:
+            return await self._get_bugs_for_product(product_id, since)
+        except ZenTaoAuthError:
+            await self._relogin(gen)
+            return await self._get_bugs_for_product(product_id, since)
+
+    async def get_bugs_by_product(self, product_ids, since=None):
+        """
+        并发拉取多个产品的 Bug（并发度受信号量限制）。since 可为字符串或 {product_id: since}。
+        返回 (bugs_by_pid, errors_by_pid)，单个产品失败不影响其他产品。
+        """
+        await self._ensure_login()
+        since_by_pid = since if isinstance(since, dict) else {pid: since for pid in product_ids}
+        results = await asyncio.gather(
+            *(self.get_bugs_for_product(pid, since_by_pid.get(pid)) for pid in product_ids),
+            return_exceptions=True,
+        )
+        bugs_by_pid = {}
+        errors = {}
+        for pid, result in zip(product_ids, results):
+            if isinstance(result, BaseException):
+                errors[pid] = result
+            else:
+                bugs_by_pid[pid] = result
+        return bugs_by_pid, errors
+
+    def bug_view_url(self, bug_id):
+        return self._url(f"bug-view-{bug_id}.html")